@@ -3,6 +3,8 @@ from itertools import batched
 import click
 from tqdm import tqdm
 
+from mlirmut.synthfuzz.corpus import CorpusReader, is_corpus
+
 @click.command()
 @click.argument("input_dir", type=click.Path(exists=True, file_okay=False, path_type=Path))
 @click.argument("output_dir", type=click.Path(path_type=Path))
@@ -10,6 +12,14 @@ from tqdm import tqdm
 def main(input_dir: Path, output_dir: Path, batch_size: int):
     output_dir.mkdir(parents=True, exist_ok=True)
 
+    if is_corpus(input_dir):
+        with CorpusReader(input_dir) as corpus:
+            num_batches = round(len(corpus) / batch_size + 0.5)
+            for batch_idx, batch in enumerate(tqdm(batched(corpus.indices(), batch_size), total=num_batches)):
+                with (output_dir / f"batch_{batch_idx}.mlir").open("w") as outf:
+                    outf.write("\n// -----\n".join(corpus[index] for index in batch))
+        return
+
     input_files = list(input_dir.glob("*.mlir"))
     num_batches = round(len(input_files) / batch_size + 0.5)
     for batch_idx, batch in enumerate(tqdm(batched(input_dir.glob("*.mlir"), batch_size), total=num_batches)):
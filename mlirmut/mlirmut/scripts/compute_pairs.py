@@ -11,6 +11,8 @@ from tqdm import tqdm
 from concurrent.futures import ProcessPoolExecutor, as_completed, ThreadPoolExecutor
 import traceback
 
+from mlirmut.synthfuzz.corpus import CorpusReader, is_corpus
+
 
 @dataclass
 class DecomposedOp:
@@ -205,17 +207,26 @@ def format_mlir(text: str, mlir_opt_path: Path):
     return process.stdout
 
 
-def compute_dependencies_file(filepath: Path, mlir_opt_path: Path):
-    with filepath.open("r") as f:
-        raw_mlir = f.read()
+def compute_dependencies_text(raw_mlir: str, name: str, mlir_opt_path: Path):
     try:
         formatted_mlir = format_mlir(raw_mlir, mlir_opt_path)
         control_deps, data_deps = compute_op_pairs(formatted_mlir)
     except Exception as e:
-        raise Exception(f"Failed to compute dependencies in {filepath}.") from e
+        raise Exception(f"Failed to compute dependencies in {name}.") from e
     return control_deps, data_deps
 
 
+def compute_dependencies_file(filepath: Path, mlir_opt_path: Path):
+    with filepath.open("r") as f:
+        raw_mlir = f.read()
+    return compute_dependencies_text(raw_mlir, str(filepath), mlir_opt_path)
+
+
+def compute_dependencies_corpus_test(corpus: CorpusReader, index: int, mlir_opt_path: Path):
+    # the test case is piped to mlir-opt, no file is needed
+    return compute_dependencies_text(corpus[index], corpus.label(index), mlir_opt_path)
+
+
 def unify_deps(dep1, dep2):
     for k, v in dep2.items():
         if k in dep1:
@@ -264,16 +275,31 @@ def main(mlirpath: Path, output: Path | None, cache_dir: Path | None, max_worker
                 all_data_deps = {name: set(deps) for name, deps in data["data"].items()}
                 seen_files = set(data["files"])
 
-        filepaths = [
-            filepath
-            for filepath in mlirpath.glob("*.mlir")
-            if str(filepath) not in seen_files
-        ]
+        # files are named by their path, test cases of a packed corpus by their label
+        corpus = CorpusReader(mlirpath) if is_corpus(mlirpath) else None
+        if corpus is not None:
+            filepaths = [
+                index
+                for index in corpus.indices()
+                if corpus.label(index) not in seen_files
+            ]
+        else:
+            filepaths = [
+                filepath
+                for filepath in mlirpath.glob("*.mlir")
+                if str(filepath) not in seen_files
+            ]
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_filepath = {
-                executor.submit(compute_dependencies_file, filepath, mlir_opt_path): filepath
-                for filepath in filepaths
-            }
+            if corpus is not None:
+                future_to_filepath = {
+                    executor.submit(compute_dependencies_corpus_test, corpus, index, mlir_opt_path): corpus.label(index)
+                    for index in filepaths
+                }
+            else:
+                future_to_filepath = {
+                    executor.submit(compute_dependencies_file, filepath, mlir_opt_path): str(filepath)
+                    for filepath in filepaths
+                }
             processed_files = set()
             for idx, future in enumerate(
                 tqdm(as_completed(future_to_filepath), total=len(filepaths))
@@ -282,7 +308,7 @@ def main(mlirpath: Path, output: Path | None, cache_dir: Path | None, max_worker
                     control_deps, data_deps = future.result()
                     unify_deps(all_control_deps, control_deps)
                     unify_deps(all_data_deps, data_deps)
-                    processed_files.add(str(future_to_filepath[future]))
+                    processed_files.add(future_to_filepath[future])
                 except Exception:
                     print(
                         f"Failed to compute dependencies in {future_to_filepath[future]} because of:"
@@ -300,6 +326,8 @@ def main(mlirpath: Path, output: Path | None, cache_dir: Path | None, max_worker
                             },
                             f,
                         )
+        if corpus is not None:
+            corpus.close()
 
     all_deps = {
         "dialect": {
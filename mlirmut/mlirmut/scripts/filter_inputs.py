@@ -2,11 +2,14 @@ import os
 from pathlib import Path
 import shutil
 import subprocess
+import tempfile
 import concurrent.futures
 
 import click
 from tqdm import tqdm
 
+from mlirmut.synthfuzz.corpus import CorpusReader, CorpusWriter, is_corpus
+
 
 def process_file(filepath: Path, oracle_tmplt: str, output_dir: Path):
     oracle = oracle_tmplt.replace("%inputpath", str(filepath))
@@ -23,6 +26,45 @@ def process_file(filepath: Path, oracle_tmplt: str, output_dir: Path):
         return False
 
 
+def process_corpus_test(corpus: CorpusReader, index: int, oracle_tmplt: str, temp_dir: Path):
+    # the oracle needs a file path, so the test case is written to a temporary file
+    filepath = temp_dir / f"{index}.mlir"
+    filepath.write_bytes(corpus.read_bytes(index))
+    try:
+        oracle = oracle_tmplt.replace("%inputpath", str(filepath))
+        result = subprocess.run(
+            oracle, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+    finally:
+        filepath.unlink()
+    return result.returncode == 0
+
+
+def filter_corpus(input_dir: Path, output_dir: Path, oracle_tmplt: str, max_workers: int):
+    """Filters a packed corpus into a packed corpus in the output directory."""
+    with CorpusReader(input_dir) as corpus, CorpusWriter(output_dir) as output, \
+            tempfile.TemporaryDirectory(prefix="filter-inputs-") as temp_dir, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        copied = 0
+        future_to_index = {
+            executor.submit(process_corpus_test, corpus, index, oracle_tmplt, Path(temp_dir)): index
+            for index in corpus.indices()
+        }
+        for future in tqdm(
+            concurrent.futures.as_completed(future_to_index), total=len(corpus)
+        ):
+            index = future_to_index[future]
+            try:
+                if future.result():
+                    # records are copied as is, only the main thread writes the output
+                    output.append_record(index, corpus.record(index))
+                    copied += 1
+            except Exception as e:
+                print(f"Test {corpus.label(index)} failed: {e}")
+
+    print(f"Copied: {copied}/{len(corpus)}")
+
+
 @click.command()
 @click.argument(
     "input_dir", type=click.Path(exists=True, file_okay=False, path_type=Path)
@@ -33,6 +75,10 @@ def process_file(filepath: Path, oracle_tmplt: str, output_dir: Path):
 @click.option("--oracle-tmplt", type=str, required=True)
 @click.option("--max-workers", type=int, default=int(os.cpu_count() * 3 / 4))
 def main(input_dir: Path, output_dir: Path, oracle_tmplt: str, max_workers: int):
+    if is_corpus(input_dir):
+        filter_corpus(input_dir, output_dir, oracle_tmplt, max_workers)
+        return
+
     filepaths = list(input_dir.glob("*.mlir"))
     if not output_dir.exists():
         output_dir.mkdir(parents=True, exist_ok=True)
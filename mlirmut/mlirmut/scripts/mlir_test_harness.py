@@ -1,5 +1,6 @@
 import os
 import subprocess
+from contextlib import contextmanager
 import click
 from pathlib import Path
 import logging
@@ -11,6 +12,8 @@ import concurrent.futures
 from tqdm import tqdm
 import time
 
+from mlirmut.synthfuzz.corpus import CorpusReader, is_corpus
+
 logger = logging.getLogger(__name__)
 
 
@@ -85,10 +88,16 @@ def main(
         cov_batch_dir=cov_batch_dir,
         batch_size=batch_size,
         save_stderr=save_stderr,
+        corpus_dir=input_dir if is_corpus(input_dir) else None,
     )
 
     batch_mapping = dict()
-    input_files = list(input_dir.glob("*.mlir"))
+    # inputs are file paths or, for a packed corpus, test case indices
+    input_files: list
+    if tester.corpus is not None:
+        input_files = tester.corpus.indices()
+    else:
+        input_files = list(input_dir.glob("*.mlir"))
     n_batches = round(len(input_files) / batch_size + 0.5)
     profiles = []
 
@@ -116,7 +125,7 @@ def main(
             desc="Batch",
         ):
             i, batch = future_to_batch[future]
-            batch_mapping[i] = [str(file) for file in batch]
+            batch_mapping[i] = [tester.label(item) for item in batch]
             if find_crashes:
                 continue
             profdata_path = future.result()
@@ -162,6 +171,7 @@ class Tester:
         cov_batch_dir: Path,
         batch_size: int,
         save_stderr: bool,
+        corpus_dir: Path | None = None,
     ):
         self.associations = dialect_assocations
         self.rand = rand
@@ -173,6 +183,46 @@ class Tester:
         self.cov_batch_dir = cov_batch_dir
         self.batch_size = batch_size
         self.save_stderr = save_stderr
+        self.corpus_dir = corpus_dir
+        self._corpus = None
+
+    def __getstate__(self):
+        # the memory-mapped corpus is reopened in the worker processes
+        state = self.__dict__.copy()
+        state["_corpus"] = None
+        return state
+
+    @property
+    def corpus(self) -> CorpusReader | None:
+        if self._corpus is None and self.corpus_dir is not None:
+            self._corpus = CorpusReader(self.corpus_dir)
+        return self._corpus
+
+    def label(self, item) -> str:
+        """Name of an input file or corpus test case in the logs."""
+        if self.corpus is not None:
+            return self.corpus.label(item)
+        return str(item)
+
+    @contextmanager
+    def open_input(self, item):
+        """
+        Yields the label, the text and a file path of an input. Test cases of a
+        packed corpus are written to a temporary file for the target binary.
+        """
+        if self.corpus is None:
+            with open(item, "r") as f:
+                mlir_text = f.read()
+            yield str(item), mlir_text, item
+            return
+        data = self.corpus.read_bytes(item)
+        self.temp_dir.mkdir(parents=True, exist_ok=True)
+        file_path = self.temp_dir / f"{item}.mlir"
+        file_path.write_bytes(data)
+        try:
+            yield self.corpus.label(item), data.decode(), file_path
+        finally:
+            file_path.unlink()
 
     def determine_options(self, mlir_text: str) -> list[str]:
         avail_dialects = [
@@ -193,74 +243,71 @@ class Tester:
             avail_options, min(len(self.associations), self.max_options)
         )
 
-    def exec_sequential(self, inputs: list[Path], time_each=False):
+    def exec_sequential(self, inputs: list, time_each=False):
         cmds = dict()
-        for file_path in tqdm(inputs):
-            with open(file_path, "r") as f:
-                mlir_text = f.read()
+        for item in tqdm(inputs):
+            with self.open_input(item) as (label, mlir_text, file_path):
+                if self.random_mode:
+                    options = self.random_options()
+                else:
+                    options = self.determine_options(mlir_text)
 
-            if self.random_mode:
-                options = self.random_options()
-            else:
-                options = self.determine_options(mlir_text)
-
-            cmd = [
-                str(self.target_binary),
-                *options,
-                "-split-input-file",
-                str(file_path),
-            ]
-            cmds[str(file_path)] = cmd
-            subprocess.run(
-                cmd,
-                env={
-                    "LLVM_PROFILE_FILE": "/dev/null",
-                },
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-            )
+                cmd = [
+                    str(self.target_binary),
+                    *options,
+                    "-split-input-file",
+                    str(file_path),
+                ]
+                cmds[label] = cmd
+                subprocess.run(
+                    cmd,
+                    env={
+                        "LLVM_PROFILE_FILE": "/dev/null",
+                    },
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
         return cmds
 
-    def eval_batch(self, batch: Iterable[Path], pbar: tqdm | None, crash_only: bool):
+    def eval_batch(self, batch: Iterable, pbar: tqdm | None, crash_only: bool):
         profile_files = []
         cmds = dict()
         crashes = dict()
         stderrs = dict()
-        for file_path in batch:
-            with open(file_path, "r") as f:
-                mlir_text = f.read()
-            if self.random_mode:
-                options = self.random_options()
-            else:
-                options = self.determine_options(mlir_text)
-
-            cmd = [
-                str(self.target_binary),
-                *options,
-                "-split-input-file",
-                str(file_path),
-            ]
-            cmds[str(file_path)] = cmd
-            profraw_path = self.temp_dir / file_path.with_suffix(".profraw").name
-            if crash_only:
-                profraw_path = "/dev/null"  # type: ignore
-            try:
-                proc = subprocess.run(
-                    cmd,
-                    env={
-                        "LLVM_PROFILE_FILE": str(profraw_path),
-                    },
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.PIPE if self.save_stderr else subprocess.DEVNULL,
-                    timeout=30,
-                )
-            except subprocess.TimeoutExpired:
-                crashes[str(file_path)] = {"cmd": cmd, "retcode": -9999}
-                continue
+        for item in batch:
+            with self.open_input(item) as (label, mlir_text, file_path):
+                if self.random_mode:
+                    options = self.random_options()
+                else:
+                    options = self.determine_options(mlir_text)
+
+                cmd = [
+                    str(self.target_binary),
+                    *options,
+                    "-split-input-file",
+                    str(file_path),
+                ]
+                cmds[label] = cmd
+                profraw_path = self.temp_dir / file_path.with_suffix(".profraw").name
+                if crash_only:
+                    profraw_path = "/dev/null"  # type: ignore
+                try:
+                    proc = subprocess.run(
+                        cmd,
+                        env={
+                            "LLVM_PROFILE_FILE": str(profraw_path),
+                        },
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.PIPE if self.save_stderr else subprocess.DEVNULL,
+                        timeout=30,
+                    )
+                except subprocess.TimeoutExpired:
+                    crashes[label] = {"cmd": cmd, "retcode": -9999}
+                    continue
             if self.save_stderr:
-                stderrs[str(file_path)] = proc.stderr.decode()
+                stderrs[label] = proc.stderr.decode()
             if proc.returncode != 0:
-                crashes[str(file_path)] = {"cmd": cmd, "retcode": proc.returncode}
+                crashes[label] = {"cmd": cmd, "retcode": proc.returncode}
             profile_files.append(profraw_path)
             if pbar:
                 pbar.update()
@@ -304,7 +351,7 @@ class Tester:
 
 
 
-def time_execution(input_files: list[Path], tester: Tester, log_dir: Path):
+def time_execution(input_files: list, tester: Tester, log_dir: Path):
     start_time = time.time()
     cmds = tester.exec_sequential(input_files)
     end_time = time.time()
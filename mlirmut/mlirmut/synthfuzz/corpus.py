@@ -0,0 +1,127 @@
+import lzma
+import zlib
+from pathlib import Path
+
+from .packed import PackedReader, PackedWriter, packed_exists
+
+CORPUS_NAME = 'corpus'
+
+# The first byte of every record tells how the rest of it is compressed.
+_COMPRESSORS = {
+    None: (b'n', lambda data: data),
+    'zlib': (b'z', zlib.compress),
+    'lzma': (b'x', lzma.compress),
+}
+_DECOMPRESSORS = {
+    ord('n'): lambda data: data,
+    ord('z'): zlib.decompress,
+    ord('x'): lzma.decompress,
+}
+COMPRESSIONS = [name for name in _COMPRESSORS if name]
+
+
+class CorpusWriter:
+    """
+    Packed test corpus: test cases are appended to a few shard files of a
+    directory (see :class:`~mlirmut.synthfuzz.packed.PackedWriter`) instead of
+    being saved to a file each, optionally compressed one by one.
+
+    :param compression: ``None``, ``'zlib'`` or ``'lzma'``.
+    """
+    def __init__(self, directory, compression=None, encoding='utf-8', errors='strict'):
+        if compression not in _COMPRESSORS:
+            raise ValueError(f'Unknown compression: {compression}')
+        self._writer = PackedWriter(directory, CORPUS_NAME)
+        self._tag, self._compress = _COMPRESSORS[compression]
+        self._compression = compression
+        self._encoding = encoding
+        self._errors = errors
+
+    def __getstate__(self):
+        return {'writer': self._writer, 'compression': self._compression, 'encoding': self._encoding, 'errors': self._errors}
+
+    def __setstate__(self, state):
+        self._writer = state['writer']
+        self._tag, self._compress = _COMPRESSORS[state['compression']]
+        self._compression = state['compression']
+        self._encoding = state['encoding']
+        self._errors = state['errors']
+
+    def append(self, index, test):
+        self._writer.append(index, self._tag + self._compress(test.encode(self._encoding, self._errors)))
+
+    def append_record(self, index, record):
+        """
+        Append a record read by :meth:`CorpusReader.record` as is, without
+        recompressing it.
+        """
+        self._writer.append(index, record)
+
+    def close(self):
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class CorpusReader:
+    """
+    Memory-mapped random access to the test cases of a packed corpus by their
+    index.
+    """
+    def __init__(self, directory, encoding='utf-8', errors='strict'):
+        self.directory = Path(directory)
+        self._reader = PackedReader(directory, CORPUS_NAME)
+        self._encoding = encoding
+        self._errors = errors
+
+    def __len__(self):
+        return len(self._reader)
+
+    def __contains__(self, index):
+        return index in self._reader
+
+    def indices(self):
+        return self._reader.keys()
+
+    def record(self, index):
+        """
+        Raw, possibly compressed record of a test case.
+        """
+        return self._reader[index]
+
+    def read_bytes(self, index):
+        record = self._reader[index]
+        return _DECOMPRESSORS[record[0]](record[1:])
+
+    def __getitem__(self, index):
+        return self.read_bytes(index).decode(self._encoding, self._errors)
+
+    def items(self):
+        for index in self.indices():
+            yield index, self[index]
+
+    def label(self, index):
+        """
+        Name of a test case in logs, standing in for its file path.
+        """
+        return f'{self.directory}#{index}'
+
+    def close(self):
+        self._reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def is_corpus(path):
+    """
+    Check whether ``path`` is a directory holding a packed corpus.
+    """
+    return Path(path).is_dir() and packed_exists(path, CORPUS_NAME)
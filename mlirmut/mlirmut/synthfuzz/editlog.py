@@ -0,0 +1,214 @@
+import pickle
+from dataclasses import dataclass
+from os.path import basename, join
+
+from grammarinator.runtime.rule import UnlexerRule, UnparserRule
+
+from .packed import PackedReader, PackedWriter
+from .tree import NodeRef, SynthFuzzTree
+
+LOG_NAME = 'edits'
+
+
+@dataclass(slots=True)
+class EditRecord:
+    """
+    Everything needed to rebuild a mutant from the population trees it was
+    created from (see :func:`replay`).
+
+    :param recipient: Edited node (for ``insert``, the inserted placeholder)
+        or ``None`` for ``generate``. The tree is referred to by the base name
+        of its population file, or by ``None`` for the mutant made by the
+        previous edits (of stacked edits).
+    :param donor: Donor node of ``recombine``, ``edit`` and ``insert``.
+    :param substitutions: Parameter substitutions in the order they were made:
+        the path of the value node in the recipient tree and the paths of the
+        substituted parameter nodes relative to the donor node.
+    :param payload: Pickled tree created from grammar: the new subtree for
+        ``mutate``, the whole test for ``generate``. For ``insert``, the
+        pickled srcs of the literals inserted along with the placeholder
+        (``None`` in its place).
+    :param stacked: Records of the further edits made on the mutant, in
+        order (see ``edits_per_mutant`` of
+        :class:`~mlirmut.synthfuzz.generator.SynthFuzzGeneratorTool`).
+    """
+    strategy: str
+    recipient: NodeRef | None
+    donor: NodeRef | None
+    substitutions: list[tuple[tuple[int, ...], tuple[tuple[int, ...], ...]]]
+    is_fit: bool | None
+    fitness_violation: int
+    payload: bytes | None = None
+    stacked: tuple = ()
+
+    def encode(self):
+        # Plain tuples pickle much smaller than the dataclasses themselves.
+        return pickle.dumps(self._fields(), protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _fields(self):
+        return (self.strategy,
+                (self.recipient.tree, self.recipient.path) if self.recipient else None,
+                (self.donor.tree, self.donor.path) if self.donor else None,
+                self.substitutions, self.is_fit, self.fitness_violation, self.payload,
+                tuple(record._fields() for record in self.stacked))
+
+    @classmethod
+    def decode(cls, data):
+        return cls._from_fields(pickle.loads(data))
+
+    @classmethod
+    def _from_fields(cls, fields):
+        # records written before edits were stacked have no stacked field
+        strategy, recipient, donor, substitutions, is_fit, fitness_violation, payload, *stacked = fields
+        return cls(strategy=strategy,
+                   recipient=NodeRef(*recipient) if recipient else None,
+                   donor=NodeRef(*donor) if donor else None,
+                   substitutions=substitutions, is_fit=is_fit, fitness_violation=fitness_violation, payload=payload,
+                   stacked=tuple(cls._from_fields(record) for record in stacked[0]) if stacked else ())
+
+
+def pickle_subtree(node):
+    # Detach the node temporarily, otherwise its parent link would pull the
+    # whole tree into the pickle.
+    parent, node.parent = node.parent, None
+    try:
+        return pickle.dumps(node, protocol=pickle.HIGHEST_PROTOCOL)
+    finally:
+        node.parent = parent
+
+
+class EditLogWriter:
+    """
+    Append-only binary edit log: one :class:`EditRecord` per test case, keyed
+    by the index of the test case and stored in a :class:`PackedWriter`.
+    """
+    def __init__(self, directory):
+        self._writer = PackedWriter(directory, LOG_NAME)
+
+    def append(self, index, strategy, result):
+        self._writer.append(index, self._record(strategy, result).encode())
+
+    def _record(self, strategy, result):
+        recipient = getattr(result, 'recipient', None) or getattr(result, 'original_node', None)
+        if recipient is not None:
+            recipient = NodeRef(tree=basename(recipient.tree) if recipient.tree else None, path=recipient.path)
+        donor = getattr(result, 'donor', None)
+        if donor is not None:
+            donor = NodeRef(tree=basename(donor.tree) if donor.tree else None, path=donor.path)
+        if strategy == 'generate':
+            payload = pickle_subtree(result.mutant)
+        elif strategy == 'mutate':
+            payload = pickle_subtree(result.mutated_node)
+        elif getattr(result, 'inserted_word', None):
+            payload = pickle.dumps(result.inserted_word, protocol=pickle.HIGHEST_PROTOCOL)
+        else:
+            payload = None
+        fitness_violation = getattr(result, 'fitness_violation', None)
+        return EditRecord(strategy=strategy, recipient=recipient, donor=donor,
+                          substitutions=getattr(result, 'substitution_paths', None) or [],
+                          is_fit=getattr(result, 'is_fit', None),
+                          fitness_violation=fitness_violation.value if fitness_violation is not None else 0,
+                          payload=payload,
+                          stacked=tuple(self._record(strategy, edit) for edit in getattr(result, 'stacked', None) or ()))
+
+    def close(self):
+        self._writer.close()
+
+
+class EditLogReader:
+    """
+    Random access to the records of an edit log directory by test case index.
+    """
+    def __init__(self, directory):
+        self._reader = PackedReader(directory, LOG_NAME)
+
+    def __len__(self):
+        return len(self._reader)
+
+    def __contains__(self, index):
+        return index in self._reader
+
+    def indices(self):
+        return self._reader.keys()
+
+    def __getitem__(self, index):
+        return EditRecord.decode(self._reader[index])
+
+    def close(self):
+        self._reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _load_node(population, ref, mutant=None):
+    # Trees are copied the same way as for mutation, so that the paths (which
+    # were recorded on such copies) lead to the same nodes. References without
+    # a tree are to the mutant made by the previous edits. Replay leaves the
+    # population as it is: missing indexes are only built in memory.
+    tree = SynthFuzzTree(mutant) if ref.tree is None else SynthFuzzTree.load(join(population, ref.tree), save_index=False)
+    node = tree.clone().root
+    for idx in ref.path:
+        node = node.children[idx]
+    return node
+
+
+def replay(record, population):
+    """
+    Rebuild the mutant described by ``record`` from the trees in the
+    ``population`` directory (which must still contain the trees the mutant
+    was created from).
+
+    :return: The root of the mutant (transformers are not applied).
+    """
+    mutant = _replay_edit(record, population)
+    for stacked in record.stacked:
+        mutant = _replay_edit(stacked, population, mutant)
+    return mutant
+
+
+def _replay_edit(record, population, mutant=None):
+    if record.strategy == 'generate':
+        return pickle.loads(record.payload)
+
+    if record.strategy == 'mutate':
+        node = _load_node(population, record.recipient, mutant).replace(pickle.loads(record.payload))
+    elif record.strategy == 'insert' and not record.recipient.path:
+        # no insertion location was found, the recipient was kept as is
+        node = _load_node(population, record.recipient, mutant)
+    else:
+        donor_node = _load_node(population, record.donor)
+        if record.strategy == 'insert':
+            # the recipient path points to the placeholder that was inserted,
+            # possibly along with literals
+            recipient_node = UnparserRule(name=donor_node.name, parent=None)
+            inserted_word = pickle.loads(record.payload) if record.payload else (None,)
+            inserted_nodes = [recipient_node if src is None else UnlexerRule(src=src) for src in inserted_word]
+            position = record.recipient.path[-1] - inserted_word.index(None)
+            parent = _load_node(population, NodeRef(tree=record.recipient.tree, path=record.recipient.path[:-1]), mutant)
+            for offset, inserted_node in enumerate(inserted_nodes):
+                parent.insert_child(idx=position + offset, node=inserted_node)
+        else:
+            recipient_node = _load_node(population, record.recipient, mutant)
+        recipient_root = recipient_node
+        while recipient_root.parent:
+            recipient_root = recipient_root.parent
+
+        def resolve(node, path):
+            for idx in path:
+                node = node.children[idx]
+            return node
+        # resolve every node before the first substitution moves any of them
+        substitutions = [(resolve(recipient_root, value_path), [resolve(donor_node, param_path) for param_path in param_paths])
+                         for value_path, param_paths in record.substitutions]
+        for param_value, param_nodes in substitutions:
+            for param_node in param_nodes:
+                param_node.replace(param_value)
+        node = recipient_node.replace(donor_node)
+
+    while node.parent:
+        node = node.parent
+    return node
@@ -0,0 +1,168 @@
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+# Key of the ``parent.*`` entries of a match dict.
+ANY_CHILD = -1
+
+
+def matches_config(match_dict, rule_id, parent_id):
+    """
+    Check a node against a ``build_match_dict``-style configuration (see
+    :class:`~mlirmut.synthfuzz.generator.SynthFuzzGeneratorTool`), which maps
+    the id of a rule to the bitset of the ids of its accepted parents (-1 for
+    any parent). The parent id of the root is 0, the id of ``None``.
+    """
+    return match_dict.get(rule_id, 0) >> parent_id & 1
+
+
+@dataclass(slots=True)
+class Fragment:
+    """
+    Parameterization of a donor fragment in terms of pre-order node ids of the
+    donor tree.
+
+    :param parameters: Maps every node of the donor context that can bind a
+        parameter to the nodes of the fragment that it parameterizes (nodes of
+        the same name and text).
+    :param to_check: Parameter nodes of the fragment that must be substituted
+        according to the ``should_substitute`` fitness criteria.
+    :param context_ids: The keys of ``parameters`` in ascending order.
+    """
+    parameters: dict[int, tuple[int, ...]]
+    to_check: frozenset[int]
+    context_ids: array
+
+    def binds_parameters(self, first, end):
+        """
+        Check whether any node with id in ``[first, end)``, e.g., a subtree of
+        the donor context, binds a parameter.
+        """
+        pos = bisect_left(self.context_ids, first)
+        return pos < len(self.context_ids) and self.context_ids[pos] < end
+
+
+@dataclass(slots=True)
+class DonorTable:
+    """
+    Recipient-independent data of a donor tree, shared by all of its fragments.
+    """
+    # id of the closest blacklisted node on the path from the root (inclusive), or -1
+    blocked: array
+    # hash of the rule id and the text hash of each node
+    keys: array
+    # ids of the nodes with no blacklisted ancestor, by key
+    context_ids_by_key: dict
+    should_sub: bytearray
+
+
+class FragmentBank:
+    """
+    Cache of donor parameterizations. Which nodes of a donor fragment are
+    parameters, which nodes of the donor context bind them and which of them
+    must be substituted does not depend on the recipient, so it is computed
+    once per donor node (and the underlying per-tree tables once per tree)
+    instead of once per edit. Entries are keyed by the :class:`TreeIndex` of
+    the donor tree, which is shared by all copies of a population tree; at
+    most ``max_fragments`` fragments are kept, least recently used ones are
+    evicted first. The table of a tree is kept as long as fragments of the
+    tree are.
+    """
+    def __init__(self, parameter_blacklist, fitness_should_sub, max_fragments=4096):
+        self._parameter_blacklist = parameter_blacklist
+        self._fitness_should_sub = fitness_should_sub
+        self._max_fragments = max_fragments
+        # id(index) -> [index, DonorTable, number of cached fragments]; the index is kept
+        # alive while fragments are cached by its id, so that the id is not reused
+        self._tables = {}
+        self._fragments = OrderedDict()
+
+    def fragment(self, donor_tree, donor_id, cache=True):
+        """
+        Return the :class:`Fragment` rooted at node ``donor_id`` of
+        ``donor_tree``. Set ``cache`` to ``False`` for trees that are not part
+        of the population.
+        """
+        key = (id(donor_tree.index), donor_id)
+        fragment = self._fragments.get(key) if cache else None
+        if fragment is not None:
+            self._fragments.move_to_end(key)
+            return fragment
+
+        index = donor_tree.index
+        table = self._table(index, cache)
+        fragment = self._parameterize(table, donor_id, index.ends[donor_id])
+        if cache:
+            self._fragments[key] = fragment
+            self._tables[key[0]][2] += 1
+            if len(self._fragments) > self._max_fragments:
+                (index_id, _), _ = self._fragments.popitem(last=False)
+                entry = self._tables[index_id]
+                entry[2] -= 1
+                if not entry[2]:
+                    del self._tables[index_id]
+        return fragment
+
+    def _table(self, index, cache):
+        entry = self._tables.get(id(index)) if cache else None
+        if entry is not None:
+            return entry[1]
+
+        rule_ids, parents = index.rule_ids, index.parents
+        size = len(rule_ids)
+        parent_rule_ids = [rule_ids[parent_id] if parent_id >= 0 else 0 for parent_id in parents]
+
+        blocked = array('i', [-1]) * size
+        should_sub = bytearray(size)
+        blacklist = self._parameter_blacklist
+        # the parents of ``parent.*`` entries are blacklisted themselves
+        blacklisted_parents = blacklist.get(ANY_CHILD, 0)
+        for i in range(size):
+            if (matches_config(blacklist, rule_ids[i], parent_rule_ids[i])
+                    or blacklisted_parents >> rule_ids[i] & 1):
+                blocked[i] = i
+            elif parents[i] >= 0:
+                blocked[i] = blocked[parents[i]]
+            should_sub[i] = matches_config(self._fitness_should_sub, rule_ids[i], parent_rule_ids[i])
+
+        keys = array('q', (hash(key) for key in zip(rule_ids, index.text_hashes, index.text_lengths)))
+
+        context_ids_by_key = {}
+        for i in range(size):
+            if blocked[i] < 0:
+                context_ids_by_key.setdefault(keys[i], array('i')).append(i)
+
+        table = DonorTable(blocked=blocked, keys=keys, context_ids_by_key=context_ids_by_key, should_sub=should_sub)
+        if cache:
+            self._tables[id(index)] = [index, table, 0]
+        return table
+
+    @staticmethod
+    def _parameterize(table, donor_id, end):
+        # Nodes of the fragment below the donor root, unless a blacklisted node
+        # separates them from it.
+        fragment_ids_by_key = {}
+        for i in range(donor_id + 1, end):
+            if table.blocked[i] <= donor_id:
+                fragment_ids_by_key.setdefault(table.keys[i], []).append(i)
+
+        parameters = {}
+        to_check = set()
+        for key, fragment_ids in fragment_ids_by_key.items():
+            context_ids = table.context_ids_by_key.get(key)
+            if not context_ids:
+                continue
+            # The context is the donor tree except for the fragment, which is
+            # a contiguous range of ids.
+            lo, hi = bisect_left(context_ids, donor_id), bisect_left(context_ids, end)
+            if lo == 0 and hi == len(context_ids):
+                continue
+            fragment_ids = tuple(fragment_ids)
+            for context_id in context_ids[:lo]:
+                parameters[context_id] = fragment_ids
+            for context_id in context_ids[hi:]:
+                parameters[context_id] = fragment_ids
+            to_check.update(i for i in fragment_ids if table.should_sub[i])
+        return Fragment(parameters=parameters, to_check=frozenset(to_check), context_ids=array('i', sorted(parameters)))
@@ -9,11 +9,12 @@ from pathlib import Path
 from importlib import import_module
 
 from argparse import ArgumentParser, ArgumentTypeError, SUPPRESS
+from contextlib import nullcontext
 from functools import partial
-from itertools import count
+from itertools import chain, count
 from math import inf
-from multiprocessing import Manager, Pool
-from os.path import abspath, exists, isdir, join
+from multiprocessing import Lock, Pool
+from os.path import abspath, dirname, exists, isdir, join
 
 from inators.arg import add_log_level_argument, add_sys_path_argument, add_sys_recursion_limit_argument, add_version_argument, process_log_level_argument, process_sys_path_argument, process_sys_recursion_limit_argument
 from inators.imp import import_object
@@ -21,8 +22,12 @@ from inators.imp import import_object
 from grammarinator.cli import add_encoding_argument, add_encoding_errors_argument, add_jobs_argument, import_list, init_logging, logger
 from grammarinator.tool.generator import DefaultGeneratorFactory
 
+from .corpus import COMPRESSIONS, CorpusWriter
 from .generator import SynthFuzzGeneratorTool
+from .metadata import METADATA_NAME, insert_patterns, load_metadata
+from .model import AliasModel
 from .population import SynthFuzzPopulation
+from .rules import RULE_IDS_NAME, RULES
 from mlirmut.pkgdata import __version__
 
 def restricted_float(value):
@@ -53,18 +58,47 @@ def process_args(args):
     else:
         args.weights = {}
 
+    if args.grammar_metadata:
+        if args.insert_patterns is not None or args.rule_ids is not None:
+            raise ValueError('Grammar metadata cannot be combined with insert patterns or rule ids.')
+        metadata = load_metadata(args.grammar_metadata)
+        # before anything interns rule names, so that the grammar rules get their stable ids
+        RULES.update(metadata.RULES)
+        args.insert_patterns = insert_patterns(metadata)
+    elif args.rule_ids is None and args.insert_patterns is not None:
+        # emitted by the processor next to the insert patterns
+        rule_ids = join(dirname(abspath(args.insert_patterns)), RULE_IDS_NAME)
+        args.rule_ids = rule_ids if exists(rule_ids) else None
+    if args.rule_ids:
+        # before anything interns rule names, so that the grammar rules get their stable ids
+        RULES.load(args.rule_ids)
+    if isinstance(args.insert_patterns, str):
+        with open(args.insert_patterns, 'rb') as f:
+            args.insert_patterns = pickle.load(f)
+
     if args.population:
         if not isdir(args.population):
             raise ValueError('Population must point to an existing directory.')
         args.population = abspath(args.population)
 
+    if args.corpus:
+        if exists(args.corpus) and not isdir(args.corpus):
+            raise ValueError('Corpus must point to a directory.')
+        # Tests are not saved to files, the pattern only names the trees kept in the population.
+        args.out = join(abspath(args.corpus), 'test_%d')
 
-def generator_tool_helper(args, weights, lock, save_to_file):
-    if args.insert_patterns is not None:
-        with open(args.insert_patterns, 'rb') as f:
-            insert_patterns = pickle.load(f)
-    else:
-        insert_patterns = None
+
+def population_helper(args):
+    if not args.population:
+        return None
+    return SynthFuzzPopulation(args.population,
+                               min_depths={name: method.min_depth
+                                           for name, method in inspect.getmembers(args.generator, inspect.ismethod)
+                                           if hasattr(method, 'min_depth')}, k_ancestors=args.k_ancestors, l_siblings=args.l_siblings, r_siblings=args.r_siblings,
+                               tree_cache_size=args.tree_cache_size * 1024 * 1024, insert_patterns=args.insert_patterns)
+
+
+def generator_tool_helper(args, population, weights, lock, save_to_file):
     if args.driver_class:
         driver_module_name, driver_class_name = args.driver_class.rsplit('.', 1)
         driver_module = import_module(driver_module_name)
@@ -72,33 +106,56 @@ def generator_tool_helper(args, weights, lock, save_to_file):
         driver = driver_class(args.driver_config)
     else:
         driver = None
+    model_class, cooldown = args.model, args.cooldown
+    if isinstance(model_class, type) and issubclass(model_class, AliasModel):
+        # The alias model applies the weights and the cooldown itself, instead of a CooldownModel wrapper.
+        # The models of the generations share the alias tables, which only depend on the weights,
+        # and the cooled-down multipliers, like the CooldownModels share the weights.
+        model_class, cooldown, weights = partial(model_class, cooldown=cooldown, weights=weights, tables={}, multipliers={}), 1.0, None
     return SynthFuzzGeneratorTool(generator_factory=DefaultGeneratorFactory(args.generator,
-                                                                   model_class=args.model,
-                                                                   cooldown=args.cooldown,
+                                                                   model_class=model_class,
+                                                                   cooldown=cooldown,
                                                                    weights=weights,
-                                                                   lock=lock,
                                                                    listener_classes=args.listener),
                          driver=driver,
                          test_output_path=args.test_output_path,
                          save_errors_only=args.save_errors_only,
-                         rule=args.rule, out_format=args.out,
+                         rule=args.rule, out_format=args.out, lock=lock,
                          max_depth=args.max_depth,
-                         population=SynthFuzzPopulation(args.population,
-                                                      min_depths={name: method.min_depth
-                                                                  for name, method in inspect.getmembers(args.generator, inspect.ismethod)
-                                                                  if hasattr(method, 'min_depth')}, k_ancestors=args.k_ancestors, l_siblings=args.l_siblings, r_siblings=args.r_siblings) if args.population else None,
+                         population=population,
                          generate=args.generate, mutate=args.mutate, recombine=args.recombine, edit=args.edit, insert=args.insert,
-                         keep_trees=args.keep_trees, insert_patterns=insert_patterns, mutation_config_path=args.mutation_config,
+                         keep_trees=args.keep_trees, insert_patterns=args.insert_patterns, mutation_config_path=args.mutation_config,
                          transformers=args.transformer, serializer=args.serializer,
                          cleanup=False, encoding=args.encoding, errors=args.encoding_errors,
                          edit_seed=args.edit_seed, edit_log=args.edit_log, max_inserts_per_quantifier=args.max_inserts,
-                         save_to_file=save_to_file, fitness_log_only=args.fitness_log_only, disable_parameters=args.disable_parameters)
+                         save_to_file=save_to_file, fitness_log_only=args.fitness_log_only, disable_parameters=args.disable_parameters,
+                         corpus=CorpusWriter(args.corpus, compression=args.corpus_compression, encoding=args.encoding, errors=args.encoding_errors) if args.corpus else None,
+                         edits_per_mutant=args.edits_per_mutant,
+                         subtree_pool_size=args.subtree_pool, subtree_reuse=args.subtree_reuse)
 
 
-def create_test(generator_tool, index, *, seed):
+def create_tests(generator_tool, start_index, *, seed, fanout, n):
+    # The tests from start_index on that are created from one selection.
     if seed:
-        random.seed(seed + index)
-    return generator_tool.create(index)
+        random.seed(seed + start_index)
+    k = min(fanout, n - start_index)
+    if k == 1:
+        return [generator_tool.create(start_index)]
+    return generator_tool.create_many(start_index, k)
+
+
+# The generator tool of a pool worker, installed once per process by
+# init_worker instead of being pickled with every task.
+_worker_generator_tool = None
+
+
+def init_worker(generator_tool):
+    global _worker_generator_tool
+    _worker_generator_tool = generator_tool
+
+
+def create_tests_in_worker(start_index, *, seed, fanout, n):
+    return create_tests(_worker_generator_tool, start_index, seed=seed, fanout=fanout, n=n)
 
 
 def execute():
@@ -112,7 +169,8 @@ def execute():
     parser.add_argument('-r', '--rule', metavar='NAME',
                         help='name of the rule to start generation from (default: the parser rule set by grammarinator-process).')
     parser.add_argument('-m', '--model', metavar='NAME', default='grammarinator.runtime.DefaultModel',
-                        help='reference to the decision model (in package.module.class format) (default: %(default)s).')
+                        help='reference to the decision model (in package.module.class format), '
+                             'e.g., mlirmut.synthfuzz.model.AliasModel for alias-table sampling (default: %(default)s).')
     parser.add_argument('-l', '--listener', metavar='NAME', action='append', default=[],
                         help='reference to a listener (in package.module.class format).')
     parser.add_argument('-t', '--transformer', metavar='NAME', action='append', default=[],
@@ -141,11 +199,21 @@ def execute():
                         help='disable test generation by SynthFuzz (disabled by default if no population is given).')
     parser.add_argument('--no-insert', dest='insert', default=True, action='store_false',
                         help='disable test generation by SynthFuzz insertion (disabled by default if no population is given).')
+    parser.add_argument('--edits-per-mutant', default=1, type=int, metavar='NUM',
+                        help='number of edits (or inserts) stacked on each SynthFuzz mutant, with the fitness criteria '
+                             'applied to the combined mutant (default: %(default)d).')
     parser.add_argument('--max-inserts', default=20, type=int,
                         help='maximum number of insertions per quantifier (default: %(default)d).')
     parser.add_argument('--insert-patterns', default=None, metavar='FILE', help='Pickle file containing insert patterns.')
+    parser.add_argument('--grammar-metadata', default=None, metavar='FILE',
+                        help=f'grammar metadata module emitted by the processor ({METADATA_NAME}), providing the insert patterns and '
+                             'the rule-id table of the grammar without unpickling (instead of --insert-patterns and --rule-ids).')
+    parser.add_argument('--rule-ids', default=None, metavar='FILE',
+                        help=f'Pickle file containing the rule-id table of the grammar (default: {RULE_IDS_NAME} next to the insert patterns, if any).')
     parser.add_argument('--mutation-config', metavar='FILE', default=None, type=Path, help='TOML file containing mutation config.')
-    parser.add_argument('--edit-log', type=Path)
+    parser.add_argument('--edit-log', type=Path, metavar='DIR',
+                        help='directory of the binary edit log recording how each test was created '
+                             '(see mlirmut.synthfuzz.replay to rebuild tests from it).')
     parser.add_argument('--keep-trees', default=False, action='store_true',
                         help='keep generated tests to participate in further mutations or recombinations (only if population is given).')
     parser.add_argument('--k-ancestors', default=0, type=int, metavar='NUM',
@@ -154,6 +222,20 @@ def execute():
                         help='number of left siblings to consider for SynthFuzz (default: %(default)d).')
     parser.add_argument('--r-siblings', default=0, type=int, metavar='NUM',
                         help='number of right siblings to consider for SynthFuzz (default: %(default)d).')
+    parser.add_argument('--tree-cache-size', default=512, type=int, metavar='MB',
+                        help='size limit of the in-memory cache of loaded population trees, measured by the size of their compact arrays; '
+                             '0 disables caching (default: %(default)d).')
+    parser.add_argument('--fanout', default=1, type=int, metavar='NUM',
+                        help='number of tests to create from each selection of population trees, '
+                             'from new copies of the same trees (default: %(default)d).')
+    parser.add_argument('--subtree-pool', default=0, type=int, metavar='NUM',
+                        help='number of pre-generated subtrees per rule and depth bucket that mutation draws copies from; '
+                             '0 generates a new subtree for every mutation (default: %(default)d).')
+    parser.add_argument('--subtree-reuse', default=8, type=int, metavar='NUM',
+                        help='number of draws after which a pooled subtree is evicted and re-generated (default: %(default)d).')
+    parser.add_argument('--fill-subtree-pool', default=False, action='store_true',
+                        help='fill the subtree pool up front for every mutable node of the population '
+                             '(before the workers start, otherwise it is filled on demand).')
     parser.add_argument('--batch-size', default=1, type=int, metavar='NUM',
                         help='number of tests to generate at once (default: %(default)d).')
     parser.add_argument('--batch-dir', metavar='DIR', help='directory to store batched tests.')
@@ -169,6 +251,10 @@ def execute():
     # Auxiliary settings.
     parser.add_argument('-o', '--out', metavar='FILE', default=join(os.getcwd(), 'tests', 'test_%d'),
                         help='output file name pattern (default: %(default)s).')
+    parser.add_argument('--corpus', metavar='DIR',
+                        help='append the tests to a packed corpus in DIR instead of saving them to a file each.')
+    parser.add_argument('--corpus-compression', choices=COMPRESSIONS, default=None,
+                        help='compress every test of the packed corpus (choices: %(choices)s; default: no compression).')
     parser.add_argument('--stdout', dest='out', action='store_const', const='', default=SUPPRESS,
                         help='print test cases to stdout (alias for --out=%(const)r)')
     parser.add_argument('-n', default=1, type=int, metavar='NUM',
@@ -195,6 +281,15 @@ def execute():
     except ValueError as e:
         parser.error(e)
 
+    if args.fanout < 1:
+        parser.error('Fanout must be positive.')
+    if args.edits_per_mutant < 1:
+        parser.error('Edits per mutant must be positive.')
+    if args.subtree_pool < 0:
+        parser.error('Subtree pool size must not be negative.')
+    if args.subtree_reuse < 1:
+        parser.error('Subtree reuse must be positive.')
+
     save_to_file = True
     # If the batch size is > 1, then we need a separate batch directory
     if args.batch_size > 1:
@@ -207,25 +302,48 @@ def execute():
             os.makedirs(args.batch_dir)
 
     if args.jobs > 1:
-        with Manager() as manager:
-            with generator_tool_helper(args, weights=manager.dict(args.weights), lock=manager.Lock(), save_to_file=save_to_file) as generator_tool:  # pylint: disable=no-member
-                parallel_create_test = partial(create_test, generator_tool, seed=args.random_seed)
-                with Pool(args.jobs) as pool:
-                    if args.batch_size > 1:
-                        batched_run(pool, parallel_create_test, args)
-                    else:
-                        for idx, _ in enumerate(pool.imap_unordered(parallel_create_test, count(0) if args.n == inf else range(args.n))):
-                            print(f'\rGenerated test case #{idx}', end='')
+        # Every worker gets a private copy of the alternative weights (and
+        # updates it with its own cooldowns), so that the decisions of the
+        # generators need no inter-process communication. The lock is only
+        # taken for printing the tests. The seed trees are shared by the
+        # workers through a memory-mapped snapshot.
+        population = population_helper(args)
+        with population.shared() if population else nullcontext(), \
+                generator_tool_helper(args, population, weights=args.weights, lock=Lock(), save_to_file=save_to_file) as generator_tool:
+            # in the parent, so that every worker inherits the filled pool
+            fill_subtree_pool(generator_tool, args)
+            parallel_create_tests = partial(create_tests_in_worker, seed=args.random_seed, fanout=args.fanout, n=args.n)
+            with Pool(args.jobs, initializer=init_worker, initargs=(generator_tool,)) as pool:
+                if args.batch_size > 1:
+                    batched_run(pool, parallel_create_tests, args)
+                else:
+                    for idx, _ in enumerate(chain.from_iterable(pool.imap_unordered(parallel_create_tests, start_indices(args)))):
+                        print(f'\rGenerated test case #{idx}', end='')
 
     else:
-        with generator_tool_helper(args, weights=args.weights, lock=None) as generator_tool:
-            for i in count(0) if args.n == inf else range(args.n):
-                create_test(generator_tool, i, seed=args.random_seed)
+        with generator_tool_helper(args, population_helper(args), weights=args.weights, lock=None, save_to_file=save_to_file) as generator_tool:
+            fill_subtree_pool(generator_tool, args)
+            for i in start_indices(args):
+                create_tests(generator_tool, i, seed=args.random_seed, fanout=args.fanout, n=args.n)
+
+
+def fill_subtree_pool(generator_tool, args):
+    if not args.fill_subtree_pool:
+        return
+    if args.random_seed:
+        random.seed(args.random_seed)
+    generator_tool.fill_subtree_pool()
+
+
+def start_indices(args):
+    # index of the first test created from each selection
+    return count(0, args.fanout) if args.n == inf else range(0, args.n, args.fanout)
+
 
-def batched_run(pool, parallel_create_test, args):
+def batched_run(pool, parallel_create_tests, args):
     last_idx = 0
     test_batch = []
-    for test, index in pool.imap(parallel_create_test, count(0) if args.n == inf else range(args.n)):
+    for test, index in chain.from_iterable(pool.imap(parallel_create_tests, start_indices(args))):
         if ((index+1) % args.batch_size) == 0:
             batch_fn = join(args.batch_dir, f"batch_{last_idx}-{index}{args.batch_ext}")
             with codecs.open(batch_fn, 'w', args.encoding, args.encoding_errors) as f:
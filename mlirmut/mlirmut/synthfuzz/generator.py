@@ -5,10 +5,9 @@ import codecs
 import logging
 import os
 import random
-from copy import deepcopy
+from array import array
+from bisect import bisect_left
 from dataclasses import dataclass
-import dill
-import math
 from pathlib import Path
 
 from contextlib import nullcontext
@@ -16,9 +15,15 @@ from math import inf
 from os.path import abspath, dirname
 from shutil import rmtree
 
-from grammarinator.tool.default_population import DefaultTree
 from grammarinator.runtime.rule import Rule, UnlexerRule, UnparserRule
 
+from .editlog import EditLogWriter
+from .fragments import ANY_CHILD, FragmentBank, matches_config
+from .insertion import InsertionSite, InsertionSiteBank, Literal, compile_insert_patterns
+from .rules import RULES
+from .subtrees import SubtreePool
+from .tree import NodeRef, SynthFuzzTree, preorder, text_hashes
+
 logger = logging.getLogger(__name__)
 
 class FitnessViolation(Flag):
@@ -30,20 +35,20 @@ class FitnessViolation(Flag):
 @dataclass(slots=True)
 class NodePair:
     concrete: Rule
-    abstract: Rule
+    # id of the donor-side node in the donor tree
+    abstract: int
 
+# Insert patterns of the earlier format (a sequence of names and quantifiers
+# of a single rule), as found in existing insert_patterns.pkl files. The
+# processor now emits InsertAutomaton objects instead.
 @dataclass(eq=True, frozen=True)
 class QuantifierSpec:
     min: int
     max: int
     rule_name: str
-    # TODO: support more complex patterns
-    # Currently, the quantifier can only have a single rule
-    #production_pattern: list[str | UnlexerRule]
 
 @dataclass(eq=True, frozen=True)
 class InsertMatchPattern:
-    # TODO: support more complex patterns
     match_pattern: list[str | QuantifierSpec]
     child_rules: set[str]
 
@@ -53,24 +58,29 @@ class CreatorResult:
 
 @dataclass
 class RecombineResult(CreatorResult):
-    donor: Rule | None
-    recipient: Rule | None
+    # provenance, only recorded if the edit log is enabled
+    donor: NodeRef | None
+    recipient: NodeRef | None
 
 @dataclass
 class EditResult(RecombineResult):
     substitutions: dict[Rule, Rule] | None
     is_fit: bool | None
     fitness_violation: FitnessViolation
+    # for the edit log: (path of the value node, paths of the parameter nodes relative to the donor) per substitution
+    substitution_paths: list[tuple[tuple[int, ...], tuple[tuple[int, ...], ...]]] | None = None
+    # the further edits made on the mutant (see edits_per_mutant), in order
+    stacked: list['EditResult'] | None = None
 
 @dataclass
 class InsertResult(EditResult):
-    # TODO: support multiple edits
-    pass
+    # for the edit log: the srcs of the literals inserted along with the placeholder (None in its place)
+    inserted_word: tuple[str | None, ...] | None = None
 
 @dataclass
 class MutateResult(CreatorResult):
     mutated_node: Rule
-    original_node: Rule
+    original_node: NodeRef | None
 
 class SynthFuzzGeneratorTool:
     """
@@ -82,7 +92,8 @@ class SynthFuzzGeneratorTool:
                  transformers=None, serializer=None, insert_patterns=None, mutation_config_path=None,
                  cleanup=True, encoding='utf-8', errors='strict', edit_seed=None, edit_log=None,
                  max_inserts_per_quantifier=20, save_to_file=True, driver=None, save_errors_only=False,
-                 test_output_path=None, fitness_log_only=False, disable_parameters=False):
+                 test_output_path=None, fitness_log_only=False, disable_parameters=False, corpus=None, edits_per_mutant=1,
+                 subtree_pool_size=0, subtree_reuse=8):
         """
         :param generator_factory: A callable that can produce instances of a
             generator. It is a generalization of a generator class: it has to
@@ -114,8 +125,17 @@ class SynthFuzzGeneratorTool:
         :param bool cleanup: Enable deleting the generated tests at :meth:`__exit__`.
         :param str encoding: Output file encoding.
         :param str errors: Encoding error handling scheme.
+        :param CorpusWriter corpus: Packed corpus to append the tests to instead of saving them to files
+               (``out_format`` is then only used to name the trees kept in the population).
+        :param int edits_per_mutant: Number of edits (or inserts) stacked on each mutant created by
+               :meth:`edit` (or :meth:`insert`), see :meth:`_stack_edits`.
+        :param int subtree_pool_size: Number of pre-generated subtrees per rule and depth bucket that :meth:`mutate`
+               draws from, see :class:`SubtreePool` (default: 0, i.e., every mutation generates a new subtree).
+        :param int subtree_reuse: Number of draws after which a pooled subtree is evicted.
         """
 
+        # first, so that pickled copies (e.g., of spawned workers) get the rule ids before anything else
+        self._rules = RULES
         self._generator_factory = generator_factory
         self._transformers = transformers or []
         self._serializer = serializer or str
@@ -126,6 +146,7 @@ class SynthFuzzGeneratorTool:
 
         self._save_to_file = save_to_file
         self._out_format = out_format
+        self._corpus = corpus
         self._lock = lock or nullcontext()
         self._max_depth = max_depth
         self._population = population
@@ -141,30 +162,37 @@ class SynthFuzzGeneratorTool:
 
         self._edit_rand = random.Random(edit_seed)
         self._edit_log = edit_log
+        self._edit_log_writer = EditLogWriter(edit_log) if edit_log else None
         self._max_inserts_per_quantifier = max_inserts_per_quantifier
-        self._insert_parents = set(insert_patterns.keys())
-        self._insert_patterns: dict[str, InsertMatchPattern] = insert_patterns
+        self._edits_per_mutant = edits_per_mutant
+        # rule name -> minimum depth, for the subtree pool
+        self._rule_min_depths = {}
+        self._subtree_pool = SubtreePool(self._generate_subtree, self._rule_min_depth, subtree_pool_size, subtree_reuse) if subtree_pool_size else None
+        # insert patterns by the rule id of the parent
+        self._insert_patterns = compile_insert_patterns(insert_patterns or {}, self._rules)
+        self._insertion_sites = InsertionSiteBank(self._insert_patterns)
         if mutation_config_path is None:
             mutation_config = {'fitness_criteria': {'should_substitute': [], 'no_duplicate': []}, 'parameterization': {'blacklist': []}}
         else:
             with mutation_config_path.open("rb") as f:
                 mutation_config = tomllib.load(f)
         def build_match_dict(config_list):
+            # rule id -> bitset of the rule ids of the accepted parents, -1 for any parent
             match_dict = dict()
             for entry in config_list:
                 if "." in entry:
                     parent, child = entry.split(".")
-                    if child not in match_dict:
-                        match_dict[child] = []
-                    match_dict[child].append(parent)
                 else:
-                    # any parent
-                    match_dict[child] = "*"
+                    parent, child = "*", entry
+                child_id = ANY_CHILD if child == "*" else self._rules.id(child)
+                parents = -1 if parent == "*" else 1 << self._rules.id(parent)
+                match_dict[child_id] = match_dict.get(child_id, 0) | parents
             return match_dict
         self._parameter_blacklist = build_match_dict(mutation_config["parameterization"]["blacklist"])
         self._fitness_no_dupes = build_match_dict(mutation_config["fitness_criteria"]["no_duplicate"])
         self._fitness_should_sub = build_match_dict(mutation_config["fitness_criteria"]["should_substitute"])
         self._fitness_log_only = fitness_log_only
+        self._fragment_bank = FragmentBank(self._parameter_blacklist, self._fitness_should_sub)
 
         self._driver = driver
         self._save_errors_only = save_errors_only
@@ -180,6 +208,10 @@ class SynthFuzzGeneratorTool:
         """
         Delete the output directory if the tests were saved to files and if ``cleanup`` was enabled.
         """
+        if self._edit_log_writer:
+            self._edit_log_writer.close()
+        if self._corpus:
+            self._corpus.close()
         if self._cleanup and self._out_format:
             rmtree(dirname(self._out_format))
 
@@ -196,31 +228,116 @@ class SynthFuzzGeneratorTool:
                in :meth:`__init__` and hence the tree object was not saved either.
         :rtype: tuple[str, str]
         """
+        strategy, creator = random.choice(self._creators())
+        return self._save(index, strategy, self._create_result(strategy, creator))
+
+    def create_many(self, start_index, k):
+        """
+        Create ``k`` new test cases from a single selection: one generator
+        method is selected randomly like in :meth:`create`, and the population
+        trees it works on are selected and loaded only once. Every test case is
+        then created from new copies of the trees, with a different node,
+        donor node or insertion site as long as the trees offer distinct ones
+        (and with new bindings of the parameters of the donor, for edits).
+
+        :param int start_index: Index of the first test case to be generated.
+        :param int k: Number of test cases to be generated.
+        :return: The results of :meth:`create` for the indices ``start_index``
+            to ``start_index + k - 1``.
+        :rtype: list[tuple[str, str]]
+        """
+        strategy, creator = random.choice(self._creators(fanout=True))
+        return [self._save(start_index + offset, strategy, self._create_result(strategy, creator)) for offset in range(k)]
+
+    def _creators(self, fanout=False):
+        """
+        The enabled generator methods as (strategy, creator) pairs. With
+        ``fanout``, the creators take their selections from the
+        ``fanout_to_*`` generators of the population, which are only started
+        when the creator is first called.
+        """
+        population = self._population
+
+        def selector(select, fanout_select):
+            if not fanout:
+                return lambda: select(self._max_depth)
+            selections = fanout_select(self._max_depth)
+            return lambda: next(selections, None)
+
         creators = []
         if self._enable_generation:
             creators.append(("generate", self.generate))
-        if self._population:
-            if self._enable_mutation and self._population.can_mutate():
-                creators.append(("mutate", lambda: self.mutate(self._population.select_to_mutate(self._max_depth))))
-            if self._enable_recombination and self._population.can_recombine():
-                creators.append(("recombine", lambda: self.recombine(*self._population.select_to_recombine(self._max_depth))))
-            if self._enable_edit and self._population.can_recombine():
-                creators.append(("edit", lambda: self.edit(*self._population.select_to_recombine(self._max_depth))))
-            if self._enable_insert and self._population.can_recombine():
-                creators.append(("insert", lambda: self.insert(*self._population.select_to_insert(self._max_depth))))
-        strategy, creator = random.choice(creators)
-
+        if population:
+            if self._enable_mutation and population.can_mutate():
+                select_to_mutate = selector(population.select_to_mutate, population.fanout_to_mutate)
+                creators.append(("mutate", lambda: self.mutate(select_to_mutate())))
+            if self._enable_recombination and population.can_recombine():
+                select_to_recombine = selector(population.select_to_recombine, population.fanout_to_recombine)
+                creators.append(("recombine", lambda: self.recombine(*select_to_recombine())))
+            if self._enable_edit and population.can_recombine():
+                select_to_edit = selector(population.select_to_edit, population.fanout_to_edit)
+                creators.append(("edit", lambda: self.edit(*select_to_edit())))
+            if self._enable_insert and population.can_recombine():
+                select_to_insert = selector(population.select_to_insert, population.fanout_to_insert)
+                creators.append(("insert", lambda: self.insert(*select_to_insert())))
+        return creators
+
+    def _create_result(self, strategy, creator):
         if strategy in ["edit", "insert"]:
-            result = creator()
+            result = self._stack_edits(strategy, creator())
             # retry if it fails the fitness criteria
             tries = 1
             while (not self._fitness_log_only) and (not result.is_fit) and (tries < 10):
-                result = creator()
+                result = self._stack_edits(strategy, creator())
                 tries += 1
             if not result.is_fit:
                 logger.warning('Failed to generate fit mutant after 10 tries; keeping the mutant anyway.')
         else:
             result = creator()
+        return result
+
+    def _stack_edits(self, strategy, result):
+        """
+        Make ``edits_per_mutant - 1`` further edits (or inserts, by
+        ``strategy``) on the mutant of ``result``, each at a node of the mutant
+        made by the previous ones, with a donor selected from the population.
+        The fitness criteria apply to the combined mutant: it is fit if every
+        edit is. Stacking stops at the first unfit edit (unless the fitness is
+        only logged) or if no further donor is found.
+
+        :return: ``result`` with the combined mutant and fitness, and the
+            further edits in ``stacked``.
+        """
+        stacked = []
+        last = result
+        while len(stacked) < self._edits_per_mutant - 1 and (last.is_fit or self._fitness_log_only):
+            # substitutions leave the value nodes shared between their positions, copy them apart first
+            recipient_tree = SynthFuzzTree(last.mutant).clone()
+            if strategy == "edit":
+                selection = self._population.select_donor_to_edit(recipient_tree, self._max_depth)
+                if selection is None:
+                    break
+                last = self.edit(*selection)
+            else:
+                selection = self._population.select_donor_to_insert(recipient_tree, self._max_depth)
+                if selection is None:
+                    break
+                last = self.insert(recipient_tree, *selection)
+            stacked.append(last)
+        if not stacked:
+            return result
+        result.mutant = last.mutant
+        for edit in stacked:
+            result.is_fit = result.is_fit and edit.is_fit
+            result.fitness_violation |= edit.fitness_violation
+        result.stacked = stacked
+        return result
+
+    def _save(self, index, strategy, result):
+        """
+        Transform, serialize and save the result of a creator as the test case
+        ``index`` (see :meth:`create`).
+        """
         for transformer in self._transformers:
             result.mutant = transformer(result.mutant)
 
@@ -239,15 +356,14 @@ class SynthFuzzGeneratorTool:
                     f.write("Return code: %d\n" % retcode)
                     f.write(stderr)
             if self._edit_log:
-                log_path = self._edit_log / f'{index}.pkl'
-                info = {"strategy": strategy} | result.__dict__
-                with open(log_path, 'wb') as f:
-                    dill.dump(info, f)
+                self._edit_log_writer.append(index, strategy, result)
 
             if not self._save_errors_only and self._population and self._keep_trees:
                 self._population.add_individual(result.mutant, path=test_fn)
 
-            if test_fn:
+            if self._corpus:
+                self._corpus.append(index, test)
+            elif test_fn:
                 with codecs.open(test_fn, 'w', self._encoding, self._errors) as f:
                     f.write(test)
             else:
@@ -258,6 +374,15 @@ class SynthFuzzGeneratorTool:
         else:
             return test, index
 
+    def _node_ref(self, node):
+        """
+        Reference to ``node`` for the provenance fields of the results. Only
+        recorded if the edit log is enabled, as nothing else uses them.
+        """
+        if not self._edit_log:
+            return None
+        return NodeRef.of(node, tree=self._population.tree_fn(node) if self._population else None)
+
     def generate(self, *, rule=None, max_depth=None):
         """
         Instantiate a new generator and generate a new tree from scratch.
@@ -279,6 +404,23 @@ class SynthFuzzGeneratorTool:
 
         return CreatorResult(mutant=start_rule())
 
+    def _generate_subtree(self, rule, max_depth):
+        return self.generate(rule=rule, max_depth=max_depth).mutant
+
+    def _rule_min_depth(self, rule):
+        min_depth = self._rule_min_depths.get(rule)
+        if min_depth is None:
+            min_depth = self._rule_min_depths[rule] = getattr(getattr(self._generator_factory(max_depth=self._max_depth), rule), 'min_depth', 0)
+        return min_depth
+
+    def fill_subtree_pool(self):
+        """
+        Fill the subtree pool up front for every node of the population that
+        :meth:`mutate` may re-generate (no-op if the pool is disabled).
+        """
+        if self._subtree_pool is not None and self._population:
+            self._subtree_pool.fill(self._population.mutation_budgets(self._max_depth))
+
     def mutate(self, mutated_node):
         """
         Mutate a tree at a given position, i.e., discard and re-generate its
@@ -289,13 +431,17 @@ class SynthFuzzGeneratorTool:
         :return: The root of the mutated tree.
         :rtype: Rule
         """
-        original_node = deepcopy(mutated_node)
+        original_node = self._node_ref(mutated_node)
         node, level = mutated_node, 0
         while node.parent:
             node = node.parent
             level += 1
 
-        mutated_node = mutated_node.replace(self.generate(rule=mutated_node.name, max_depth=self._max_depth - level))
+        if self._subtree_pool is not None:
+            subtree = self._subtree_pool.draw(mutated_node.name, self._max_depth - level)
+        else:
+            subtree = self._generate_subtree(mutated_node.name, self._max_depth - level)
+        mutated_node = mutated_node.replace(subtree)
 
         node = mutated_node
         while node.parent:
@@ -315,8 +461,8 @@ class SynthFuzzGeneratorTool:
         :return: The root of the recombined tree.
         :rtype: Rule
         """
-        original_donor = deepcopy(donor_node)
-        original_recipient = deepcopy(recipient_node)
+        original_donor = self._node_ref(donor_node)
+        original_recipient = self._node_ref(recipient_node)
         if recipient_node.name != donor_node.name:
             raise ValueError(f'{recipient_node.name} cannot be replaced with {donor_node.name}')
 
@@ -324,107 +470,82 @@ class SynthFuzzGeneratorTool:
         while node.parent:
             node = node.parent
         return EditResult(mutant=node, is_fit=True, fitness_violation=FitnessViolation.NONE, donor=original_donor, recipient=original_recipient, substitutions=dict())
-    def insert(self, recipient_tree: DefaultTree, donor_tree: DefaultTree):
-        valid_parents = list(self._insert_parents & set(recipient_tree.nodes_by_name.keys()))
-        random.shuffle(valid_parents)
-        # for each possible parent node in the recipient tree:
-        for parent_name in valid_parents:
-            # verify that the donor tree has the required nodes for this insertion pattern
-            insert_pattern = self._insert_patterns[parent_name]
-            if len(insert_pattern.child_rules - set(donor_tree.nodes_by_name.keys())) > 0:
+    def insert(self, recipient_tree: SynthFuzzTree, donor_tree: SynthFuzzTree, site: InsertionSite | None = None):
+        """
+        Insert a node of ``donor_tree`` into ``recipient_tree`` as one more
+        iteration of a quantified part of the body of a recipient node (along
+        with the literals of the iteration), and adapt it like :meth:`edit`.
+
+        :param InsertionSite site: The insertion site and the donor node, as
+            selected by the population (optional). Otherwise, the insertion
+            sites of the recipient are searched for one with a compatible
+            donor node.
+        """
+        if site is not None:
+            inserted_nodes, recipient_node = self._insert_word(recipient_tree, site.parent_id, site.position, site.word_id)
+            return self._insert_result(self.edit(recipient_node, donor_tree.nodes[site.donor_id], donor_tree, site.donor_id), inserted_nodes, recipient_node)
+
+        sites = self._insertion_sites.sites(recipient_tree.index)
+        donor_rules = donor_tree.index.rule_mask
+        candidates = [site for rule_id, site_ids in sites.by_rule.items() if donor_rules >> rule_id & 1 for site in site_ids]
+        random.shuffle(candidates)
+        tries = dict()
+        for site in candidates:
+            parent_id, word_id = sites.parent_ids[site], sites.word_ids[site]
+            # limit the locations tried for the same quantifier of the same node
+            if tries.get((parent_id, word_id), 0) >= self._max_inserts_per_quantifier:
                 continue
-            
-            # TODO: perform backtracking search for more complex patterns
-            def greedy_quantifier_match(recipient_parent):
-                """Try to match the children of the recipient node with the insert match pattern.
-                The algorithm (*should be back-tracking) is greedy and assumes that quantifiers are for single nodes.
-                Returns the child indicies where possible insertions can be made for each quantifier.
-                """
-                children = recipient_parent.children
-                child_idx = 0
-                insertion_locations = dict()
-                for match_node in insert_pattern.match_pattern:
-                    if isinstance(match_node, str):
-                        if children[child_idx].name == match_node:
-                            child_idx += 1
-                        else:
-                            return None  # no match
-                    elif isinstance(match_node, QuantifierSpec):
-                        # also check pattern index???
-                        # TODO exit early if the the minimum is not satisfied
-                        num_matches = 0
-                        possible_locs = []
-                        while child_idx < len(children):
-                            # TODO handle quantifier multi-node patterns
-                            if children[child_idx].name != match_node.rule_name:
-                                break
-                            possible_locs.append(child_idx)
-                            num_matches += 1
-                            child_idx += 1
-                            if num_matches >= match_node.max:
-                                break
-                        if num_matches < match_node.min:
-                            return None
-                        # remove num_matches locations so that only max - num_matches remains
-                        random.shuffle(possible_locs)
-                        # check if max is math.inf
-                        if match_node.max != math.inf:
-                            possible_locs = possible_locs[:match_node.max-num_matches]
-                        insertion_locations[match_node] = possible_locs
-                    else:
-                        raise ValueError(f'Unexpected match node type: {type(match_node)}')
-                return insertion_locations    
-               
-            # for each possible insertion location in the recipient tree:
-            recipient_parents = list(recipient_tree.nodes_by_name[parent_name])
-            for recipient_parent in recipient_parents:
-                insertion_locations = greedy_quantifier_match(recipient_parent)
-                if insertion_locations is None:
-                    continue
-                for spec, locs in insertion_locations.items():
-                    # remove excess locations
-                    locs = locs[:self._max_inserts_per_quantifier]
-                    for loc in locs:
-                        # create a placeholder node
-                        # we intentionally construct it with parent=None and then add the parent later
-                        # to circumvent the default constructor behavior
-                        recipient_node = UnparserRule(name=spec.rule_name, parent=None)
-                        # a side effect of insert_child is to set the parent of the child
-                        recipient_parent.insert_child(idx=loc, node=recipient_node)
-                        donor_node = random.choice(list(donor_tree.nodes_by_name[spec.rule_name]))
-                        #donor_node = list(donor_tree.nodes_by_name[spec.rule_name])[0]
-                        # Make sure that the ancestors and siblings match
-                        if not (self._population.context_filter.verify_k_ancestors(recipient_node, donor_node)
-                            and self._population.context_filter.verify_l_siblings(recipient_node, donor_node)
-                            and self._population.context_filter.verify_r_siblings(recipient_node, donor_node)):
-                            continue
-
-                        # TODO allow multiple edits
-                        return self.edit(recipient_node, donor_node)
-        return InsertResult(mutant=recipient_tree.root, donor=donor_tree.root, recipient=recipient_tree.root, substitutions=None, is_fit=False, fitness_violation=FitnessViolation.NO_INSERT_LOC)
-    
-    def index_nodes(self, current, nodes_by_name, exclude_subtree):
-        if current == exclude_subtree:
-            return
-        # exclude nodes in the parameter blacklist
-        if (current.name in self._parameter_blacklist
-            and (
-                self._parameter_blacklist[current.name] == "*"
-                or current.parent.name in self._parameter_blacklist[current.name]
-            )):
-            return
-        if "*" in self._parameter_blacklist and current.name in self._parameter_blacklist['*']:
-            return
-        if current.name not in nodes_by_name:
-            nodes_by_name[current.name] = []
-        nodes_by_name[current.name].append(current)
-        if current.children:
-            for child in current.children:
-                self.index_nodes(child, nodes_by_name, exclude_subtree)
-
-    def edit(self, recipient_node, donor_node):
-        original_donor = deepcopy(donor_node)
-        original_recipient = deepcopy(recipient_node)
+            tries[(parent_id, word_id)] = tries.get((parent_id, word_id), 0) + 1
+
+            inserted_nodes, recipient_node = self._insert_word(recipient_tree, parent_id, sites.positions[site], word_id)
+            # Only sample among the donors whose ancestors and siblings match
+            donor_ids = self._population.compatible_donors(recipient_node, donor_tree, sites.rule_ids[site])
+            if not donor_ids:
+                # do not leave the inserted nodes behind for the next location
+                for inserted_node in inserted_nodes:
+                    inserted_node.delete()
+                continue
+            donor_id = random.choice(donor_ids)
+
+            return self._insert_result(self.edit(recipient_node, donor_tree.nodes[donor_id], donor_tree, donor_id), inserted_nodes, recipient_node)
+        return InsertResult(mutant=recipient_tree.root, donor=self._node_ref(donor_tree.root), recipient=self._node_ref(recipient_tree.root), substitutions=None, is_fit=False, fitness_violation=FitnessViolation.NO_INSERT_LOC)
+
+    def _insert_result(self, result, inserted_nodes, placeholder):
+        inserted_word = tuple(None if node is placeholder else node.src for node in inserted_nodes) if self._edit_log else None
+        return InsertResult(**vars(result), inserted_word=inserted_word)
+
+    def _insert_word(self, recipient_tree, parent_id, position, word_id):
+        """
+        Insert the nodes of a word of an insert pattern into the node
+        ``parent_id`` of ``recipient_tree`` before the child at ``position``:
+        the literals of the word and a placeholder node for the donor node.
+
+        :return: The inserted nodes and the placeholder node.
+        """
+        _, labels, slot = self._insert_patterns[recipient_tree.index.rule_ids[parent_id]].words[word_id]
+        # we intentionally construct the nodes with parent=None and then add the parent later
+        # to circumvent the default constructor behavior
+        inserted_nodes = [UnlexerRule(src=label.src) if isinstance(label, Literal) else UnparserRule(name=label, parent=None) for label in labels]
+        recipient_parent = recipient_tree.nodes[parent_id]
+        for offset, inserted_node in enumerate(inserted_nodes):
+            # a side effect of insert_child is to set the parent of the child
+            recipient_parent.insert_child(idx=position + offset, node=inserted_node)
+        return inserted_nodes, inserted_nodes[slot]
+
+    def edit(self, recipient_node, donor_node, donor_tree=None, donor_id=None):
+        """
+        Recombine ``recipient_node`` with ``donor_node`` and substitute the
+        parameters of the donor fragment with values from the recipient
+        context.
+
+        :param SynthFuzzTree donor_tree: The population tree containing
+            ``donor_node`` (optional). If given, the parameterization of the
+            donor fragment is looked up in (or added to) the fragment bank.
+        :param int donor_id: The id of ``donor_node`` in ``donor_tree``, as
+            selected by the population (optional, searched for otherwise).
+        """
+        original_donor = self._node_ref(donor_node)
+        original_recipient = self._node_ref(recipient_node)
         substitutions = dict()
 
         # if the donor has no children, then we can't do any adaptations
@@ -432,52 +553,36 @@ class SynthFuzzGeneratorTool:
         if not donor_node.children or self._disable_parameters:
             return self.recombine(recipient_node, donor_node)
 
-        # get the root node of the donor tree
-        def get_root(node):
-            root = node
-            while root.parent:
-                root = root.parent
-            return root
-        donor_root = get_root(donor_node)
-
-        # index the donor tree for possible substitutions
-        fragment_nodes = dict()
-        for child in donor_node.children:
-            self.index_nodes(child, fragment_nodes, exclude_subtree=None)
-        context_nodes = dict()
-        self.index_nodes(donor_root, context_nodes, exclude_subtree=donor_node)
-        common_names = set(fragment_nodes.keys()) & set(context_nodes.keys())
-
-        # traverse the recipient and donor trees to find substitutions
-        # we assume exact matches occur when the source strings match exactly
-        def get_matching_nodes(ref_value, value_list, node_list):
-            return [node_list[i] for i, value in enumerate(value_list) if value == ref_value]
-
         # locate parameters
-        parameters = dict()
-        for name in common_names:
-            nodes_in_fragment = fragment_nodes[name]
-            nodes_in_context = context_nodes[name]
-            node_strings_in_fragment = [str(node) for node in nodes_in_fragment]
-            node_strings_in_context = [str(node) for node in nodes_in_context]
-            for unique_node_string in set(node_strings_in_fragment):
-                param_nodes_in_fragment = get_matching_nodes(ref_value=unique_node_string, value_list=node_strings_in_fragment, node_list=nodes_in_fragment)
-                param_nodes_in_context = get_matching_nodes(ref_value=unique_node_string, value_list=node_strings_in_context, node_list=nodes_in_context)
-                for param_node in param_nodes_in_context:
-                    parameters[param_node] = param_nodes_in_fragment
+        if donor_tree is not None:
+            if donor_id is None:
+                donor_id = donor_tree.nodes.index(donor_node)
+            fragment = self._fragment_bank.fragment(donor_tree, donor_id)
+        else:
+            # get the root node of the donor tree
+            donor_root = donor_node
+            while donor_root.parent:
+                donor_root = donor_root.parent
+            donor_tree = SynthFuzzTree(donor_root)
+            donor_id = donor_tree.nodes.index(donor_node)
+            fragment = self._fragment_bank.fragment(donor_tree, donor_id, cache=False)
+        donor_nodes = donor_tree.nodes
+        donor_index = donor_tree.index
+        donor_rule_ids, donor_parents = donor_index.rule_ids, donor_index.parents
+        rule_names = self._rules.names
 
         # first collect all common ancestors
         # ancestors will be a list from closest to furthest ancestor
+        # donor-side (abstract) nodes are referred to by their id in the donor tree
         ancestors_concrete = [recipient_node]
-        ancestors_abstract = [donor_node]
-        concrete, abstract = recipient_node, donor_node
-        while (concrete.parent and abstract.parent and
-        (concrete.parent.name == abstract.parent.name)):
-            concrete, abstract = concrete.parent, abstract.parent
+        ancestors_abstract = [donor_id]
+        concrete, abstract = recipient_node, donor_id
+        while (concrete.parent and donor_parents[abstract] >= 0 and
+        (concrete.parent.name == rule_names[donor_rule_ids[donor_parents[abstract]]])):
+            concrete, abstract = concrete.parent, donor_parents[abstract]
             ancestors_concrete.append(concrete)
             ancestors_abstract.append(abstract)
 
-        # TODO: when we explore, we should stop exploring a path when there are no parameters to find along that path
         def get_siblings(idx, ancestors):
             ancestor_parent: Rule = ancestors[idx]
             ancestor_child: Rule = ancestors[idx-1]
@@ -486,67 +591,100 @@ class SynthFuzzGeneratorTool:
             siblings_left = siblings[:ancestor_child_idx]
             siblings_right = siblings[ancestor_child_idx+1:]
             return siblings_left, siblings_right
+        def get_abstract_siblings(idx):
+            siblings_left, siblings_right = [], []
+            sibling = donor_index.prev_siblings[ancestors_abstract[idx-1]]
+            while sibling >= 0:
+                siblings_left.append(sibling)
+                sibling = donor_index.prev_siblings[sibling]
+            siblings_left.reverse()
+            sibling = donor_index.next_siblings[ancestors_abstract[idx-1]]
+            while sibling >= 0:
+                siblings_right.append(sibling)
+                sibling = donor_index.next_siblings[sibling]
+            return siblings_left, siblings_right
+        def get_abstract_children(a_id):
+            children = []
+            child = a_id + 1 if a_id + 1 < len(donor_parents) and donor_parents[a_id + 1] == a_id else -1
+            while child >= 0:
+                children.append(child)
+                child = donor_index.next_siblings[child]
+            return children
         parameter_values = dict()
-        def save_param(a_node, c_node):
-            if a_node in parameter_values:
-                parameter_values[a_node].append(c_node)
+        def save_param(a_id, c_node):
+            if a_id in parameter_values:
+                parameter_values[a_id].append(c_node)
             else:
-                parameter_values[a_node] = [c_node]
-        def match_nodes(abstract_nodes: list[Rule], concrete_nodes: list[Rule]):
+                parameter_values[a_id] = [c_node]
+        def match_nodes(abstract_ids: list[int], concrete_nodes: list[Rule]):
             matching_nodes = []
+            # positions of the concrete nodes by name, so that the next matching
+            # concrete node is found by bisection instead of a linear scan
+            concrete_positions = dict()
+            for c_pos, c_node in enumerate(concrete_nodes):
+                concrete_positions.setdefault(c_node.name, []).append(c_pos)
             # for each abstract node, we look for a matching concrete node
             c_idx = 0
-            for a_idx in range(len(abstract_nodes)):
-                a_node = abstract_nodes[a_idx]
-                old_idx = c_idx
-                while c_idx < len(concrete_nodes):
-                    c_node = concrete_nodes[c_idx]
-                    c_idx += 1
-                    # if we find a matching pair, we stop and go to the next abstract node
-                    if a_node.name == c_node.name:
-                        if a_node in parameters:
-                            save_param(a_node=a_node, c_node=c_node)
-                        else:
-                            # continue matching down the chain
-                            matching_nodes.append(NodePair(concrete=c_node, abstract=a_node))
-                        break
-                # if we've exhausted the concrete nodes for this abstract node, then we reset to after the last maching concrete node
-                if c_idx >= len(concrete_nodes):
-                    c_idx = old_idx
+            for a_id in abstract_ids:
+                positions = concrete_positions.get(rule_names[donor_rule_ids[a_id]])
+                if not positions:
+                    continue
+                pos = bisect_left(positions, c_idx)
+                if pos == len(positions):
+                    continue
+                c_node = concrete_nodes[positions[pos]]
+                # if we find a matching pair, we go to the next abstract node
+                if a_id in fragment.parameters:
+                    save_param(a_id=a_id, c_node=c_node)
+                else:
+                    # continue matching down the chain
+                    matching_nodes.append(NodePair(concrete=c_node, abstract=a_id))
+                # if we've exhausted the concrete nodes for this abstract node, then we stay after the last maching concrete node
+                if positions[pos] + 1 < len(concrete_nodes):
+                    c_idx = positions[pos] + 1
 
             return matching_nodes
-        def recursively_match_nodes(abstract_nodes: list[Rule], concrete_nodes: list[Rule]):
-            matching_nodes = match_nodes(abstract_nodes=abstract_nodes, concrete_nodes=concrete_nodes)
+        def recursively_match_nodes(abstract_ids: list[int], concrete_nodes: list[Rule]):
+            matching_nodes = match_nodes(abstract_ids=abstract_ids, concrete_nodes=concrete_nodes)
             for pair in matching_nodes:
-                if pair.abstract.children is None or pair.concrete.children is None:
+                if pair.concrete.children is None:
+                    continue
+                # stop exploring a path when there are no parameters to find along that path
+                if not fragment.binds_parameters(pair.abstract + 1, donor_index.ends[pair.abstract]):
                     continue
-                recursively_match_nodes(abstract_nodes=pair.abstract.children, concrete_nodes=pair.concrete.children)
+                recursively_match_nodes(abstract_ids=get_abstract_children(pair.abstract), concrete_nodes=pair.concrete.children)
 
         # get parameters
         assert len(ancestors_concrete) == len(ancestors_abstract)
         for ancestor_idx in range(1, len(ancestors_concrete)):
+            if not fragment.binds_parameters(ancestors_abstract[ancestor_idx] + 1, donor_index.ends[ancestors_abstract[ancestor_idx]]):
+                continue
             siblings_concrete_left, siblings_concrete_right = get_siblings(ancestor_idx, ancestors_concrete)
-            siblings_abstract_left, siblings_abstract_right = get_siblings(ancestor_idx, ancestors_abstract)
-            recursively_match_nodes(abstract_nodes=siblings_abstract_left, concrete_nodes=siblings_concrete_left)
-            recursively_match_nodes(abstract_nodes=siblings_abstract_right, concrete_nodes=siblings_concrete_right)
+            siblings_abstract_left, siblings_abstract_right = get_abstract_siblings(ancestor_idx)
+            recursively_match_nodes(abstract_ids=siblings_abstract_left, concrete_nodes=siblings_concrete_left)
+            recursively_match_nodes(abstract_ids=siblings_abstract_right, concrete_nodes=siblings_concrete_right)
 
         # determine which parameter nodes in the fragment must be substituted according to the fitness criteria
-        to_check = set()
-        for param_nodes in parameters.values():
-            for param_node in param_nodes:
-                if (param_node.name in self._fitness_should_sub
-                    and (self._fitness_should_sub[param_node.name] == "*"
-                         or param_node.parent.name in self._fitness_should_sub[param_node.name])):
-                    to_check.add(param_node)
-            
+        to_check = {donor_nodes[i] for i in fragment.to_check}
+
         # substitute parameters and check fitness
-        for a_node, param_values in parameter_values.items():
+        chosen_values = []
+        for a_id, param_values in parameter_values.items():
             if len(param_values) == 0:
                 continue
             # randomly choose one of the possible parameter values
             param_value = self._edit_rand.choice(param_values)
-            substitutions[a_node] = param_value
-            for param_node in parameters[a_node]:
+            substitutions[donor_nodes[a_id]] = param_value
+            chosen_values.append((a_id, param_value))
+        substitution_paths = None
+        if self._edit_log:
+            # record the paths before the substitutions move the value nodes
+            substitution_paths = [(NodeRef.of(param_value).path,
+                                   tuple(NodeRef.of(donor_nodes[param_id]).path[len(original_donor.path):] for param_id in fragment.parameters[a_id]))
+                                  for a_id, param_value in chosen_values]
+        for a_id, param_value in chosen_values:
+            for param_id in fragment.parameters[a_id]:
+                param_node = donor_nodes[param_id]
                 param_node.replace(param_value)
                 if param_node in to_check:
                     to_check.remove(param_node)
@@ -559,22 +697,24 @@ class SynthFuzzGeneratorTool:
             node = node.parent
         
         # check if the resulting mutant satisfies the no duplicate criteria
-        seen_potential_dupes = set()
-        def has_duplicates(node):
-            if node.name in self._fitness_no_dupes and (
-                self._fitness_no_dupes[node.name] == "*" or
-                node.parent.name in self._fitness_no_dupes[node.name]):
-                if str(node) in seen_potential_dupes:
-                    return True
-                seen_potential_dupes.add(str(node))
-            if node.children:
-                for child in node.children:
-                    if has_duplicates(child):
-                        return True
-            return False
-        has_dupes = has_duplicates(node)
+        # nodes are compared by the hash of their text instead of their text
+        has_dupes = False
+        if self._fitness_no_dupes:
+            mutant_parents = array('i')
+            mutant_nodes = preorder(node, mutant_parents)
+            mutant_hashes, mutant_lengths = text_hashes(mutant_nodes, mutant_parents)
+            mutant_rule_ids = [self._rules.id(mutant_node.name) for mutant_node in mutant_nodes]
+            seen_potential_dupes = set()
+            for i in range(len(mutant_nodes)):
+                parent_id = mutant_rule_ids[mutant_parents[i]] if mutant_parents[i] >= 0 else 0
+                if matches_config(self._fitness_no_dupes, mutant_rule_ids[i], parent_id):
+                    if (mutant_hashes[i], mutant_lengths[i]) in seen_potential_dupes:
+                        has_dupes = True
+                        break
+                    seen_potential_dupes.add((mutant_hashes[i], mutant_lengths[i]))
         is_fit = is_fit and not has_dupes
         if has_dupes:
             fitness_violation |= FitnessViolation.DUPE
         
-        return EditResult(mutant=node, donor=original_donor, recipient=original_recipient, substitutions=substitutions, is_fit=is_fit, fitness_violation=fitness_violation)
\ No newline at end of file
+        return EditResult(mutant=node, donor=original_donor, recipient=original_recipient, substitutions=substitutions, is_fit=is_fit, fitness_violation=fitness_violation,
+                          substitution_paths=substitution_paths)
\ No newline at end of file
@@ -0,0 +1,380 @@
+from array import array
+from dataclasses import dataclass
+from itertools import product
+from math import inf
+
+from .rules import RULES
+from .texthash import token_hash
+
+# Insert patterns describe the children a node of a parser rule may have, as a
+# regular expression over the names of the child rules and the literals of the
+# rule body. ``ProcessorTool`` compiles them into automata (see
+# :class:`InsertAutomaton`). A new child can be inserted at a position of a
+# node if adding one more iteration of a quantified part of the rule body
+# there still yields children matching the automaton. The simulation of the
+# automaton tracks every way of matching the children at once, so no match is
+# missed by committing to a wrong alternative or quantifier count.
+
+
+@dataclass(frozen=True, slots=True)
+class Literal:
+    src: str
+
+
+@dataclass(frozen=True, slots=True)
+class Symbol:
+    # rule name or Literal
+    label: str | Literal
+
+
+@dataclass(frozen=True, slots=True)
+class Sequence:
+    items: tuple
+
+
+@dataclass(frozen=True, slots=True)
+class Choice:
+    alternatives: tuple
+
+
+@dataclass(frozen=True, slots=True)
+class Repeat:
+    min: int
+    max: int | float
+    body: object
+
+
+def words(expression, limit):
+    """
+    Shortest words of ``expression`` (quantifiers iterated ``min`` times), at
+    most ``limit`` of them.
+    """
+    if isinstance(expression, Symbol):
+        return [(expression.label,)]
+    if isinstance(expression, Sequence):
+        result = [()]
+        for item in expression.items:
+            result = [prefix + suffix for prefix, suffix in product(result, words(item, limit))][:limit]
+        return result
+    if isinstance(expression, Choice):
+        result = []
+        for alternative in expression.alternatives:
+            result.extend(word for word in words(alternative, limit) if word not in result)
+        return result[:limit]
+    return words(Sequence((expression.body,) * expression.min), limit)
+
+
+@dataclass(slots=True)
+class InsertWord:
+    """
+    Children inserted at once: the labels of one iteration of a quantified part
+    of the rule body, where ``labels[slot]`` is the only rule, i.e., the
+    placeholder of the donor node; the other labels are literals.
+    """
+    labels: tuple
+    slot: int
+
+
+@dataclass(slots=True)
+class InsertAutomaton:
+    """
+    Nondeterministic automaton accepting the children of the nodes of a parser
+    rule, with epsilon moves eliminated. Sets of states are bitsets. Labels
+    are rule names or :class:`Literal` objects.
+    """
+    # label -> bitset of the target states, by state
+    moves: list
+    start: int
+    # bitset of the accepting states
+    accept: int
+    words: list
+
+    @classmethod
+    def compile(cls, expression, max_words=16):
+        builder = _Builder()
+        start, end = builder.build(expression)
+        closures = [builder.closure(state) for state in range(len(builder.edges))]
+        moves = []
+        for state in range(len(builder.edges)):
+            state_moves = {}
+            for source in _states(closures[state]):
+                for label, target in builder.edges[source]:
+                    state_moves[label] = state_moves.get(label, 0) | closures[target]
+            moves.append(state_moves)
+        accept = sum(1 << state for state in range(len(closures)) if closures[state] >> end & 1)
+
+        insert_words = []
+        for repeat in _repeats(expression):
+            if repeat.max == 0:
+                continue
+            for labels in words(repeat.body, max_words):
+                slots = [i for i, label in enumerate(labels) if not isinstance(label, Literal)]
+                # the donor provides a single node, the literals are created
+                if len(slots) == 1 and all(labels != word.labels for word in insert_words):
+                    insert_words.append(InsertWord(labels=labels, slot=slots[0]))
+        return cls(moves=moves, start=start, accept=accept, words=insert_words)
+
+    @property
+    def child_rules(self):
+        return {word.labels[word.slot] for word in self.words}
+
+    def encode(self):
+        """
+        Encode the automaton into Python literals for the grammar metadata
+        module (see :mod:`mlirmut.synthfuzz.metadata`): literal labels become
+        1-tuples of their src.
+        """
+        def label(value):
+            return (value.src,) if isinstance(value, Literal) else value
+        return (tuple({label(key): targets for key, targets in state_moves.items()} for state_moves in self.moves),
+                self.start, self.accept,
+                tuple((tuple(label(value) for value in word.labels), word.slot) for word in self.words))
+
+    @classmethod
+    def decode(cls, data):
+        """
+        Inverse of :meth:`encode`.
+        """
+        def label(value):
+            return Literal(value[0]) if isinstance(value, tuple) else value
+        moves, start, accept, insert_words = data
+        return cls(moves=[{label(key): targets for key, targets in state_moves.items()} for state_moves in moves],
+                   start=start, accept=accept,
+                   words=[InsertWord(labels=tuple(label(value) for value in labels), slot=slot) for labels, slot in insert_words])
+
+
+class _Builder:
+    # Thompson construction: every state has labeled edges and epsilon edges
+    # (label None).
+    def __init__(self):
+        self.edges = []
+
+    def state(self):
+        self.edges.append([])
+        return len(self.edges) - 1
+
+    def build(self, expression):
+        start = self.state()
+        if isinstance(expression, Symbol):
+            end = self.state()
+            self.edges[start].append((expression.label, end))
+            return start, end
+        end = start
+        if isinstance(expression, Sequence):
+            for item in expression.items:
+                item_start, item_end = self.build(item)
+                self.edges[end].append((None, item_start))
+                end = item_end
+            return start, end
+        if isinstance(expression, Choice):
+            end = self.state()
+            for alternative in expression.alternatives:
+                alternative_start, alternative_end = self.build(alternative)
+                self.edges[start].append((None, alternative_start))
+                self.edges[alternative_end].append((None, end))
+            return start, end
+        # Repeat: the mandatory iterations, then either a loop or the optional
+        # iterations, each of which can skip to the end.
+        for _ in range(expression.min):
+            body_start, body_end = self.build(expression.body)
+            self.edges[end].append((None, body_start))
+            end = body_end
+        if expression.max == inf:
+            body_start, body_end = self.build(expression.body)
+            self.edges[end].append((None, body_start))
+            self.edges[body_end].append((None, end))
+            return start, end
+        optional_ends = []
+        for _ in range(expression.max - expression.min):
+            body_start, body_end = self.build(expression.body)
+            self.edges[end].append((None, body_start))
+            optional_ends.append(end)
+            end = body_end
+        for optional_end in optional_ends:
+            self.edges[optional_end].append((None, end))
+        return start, end
+
+    def closure(self, state):
+        closure = 1 << state
+        stack = [state]
+        while stack:
+            for label, target in self.edges[stack.pop()]:
+                if label is None and not closure >> target & 1:
+                    closure |= 1 << target
+                    stack.append(target)
+        return closure
+
+
+def _states(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def _repeats(expression):
+    if isinstance(expression, Repeat):
+        yield expression
+        yield from _repeats(expression.body)
+    elif isinstance(expression, Sequence):
+        for item in expression.items:
+            yield from _repeats(item)
+    elif isinstance(expression, Choice):
+        for alternative in expression.alternatives:
+            yield from _repeats(alternative)
+
+
+def insert_automaton(insert_pattern):
+    """
+    Return an :class:`InsertAutomaton`, compiling insert patterns of the
+    earlier format (see :class:`~mlirmut.synthfuzz.generator.InsertMatchPattern`).
+    Their literals are not marked as such, so names that are not identifiers
+    are taken to be literals.
+    """
+    if isinstance(insert_pattern, InsertAutomaton):
+        return insert_pattern
+    items = []
+    for match_node in insert_pattern.match_pattern:
+        if isinstance(match_node, str):
+            items.append(Symbol(match_node if match_node.isidentifier() else Literal(match_node)))
+        else:
+            # QuantifierSpec
+            items.append(Repeat(min=match_node.min, max=match_node.max, body=Symbol(match_node.rule_name)))
+    return InsertAutomaton.compile(Sequence(tuple(items)))
+
+
+def compile_insert_patterns(insert_patterns, rules=RULES):
+    """
+    Compile the insert patterns loaded from the processor output (rule name ->
+    pattern) to :class:`CompiledAutomaton` objects by parent rule id.
+    """
+    return {rules.id(parent_name): CompiledAutomaton(insert_automaton(insert_pattern), rules)
+            for parent_name, insert_pattern in insert_patterns.items()}
+
+
+class CompiledAutomaton:
+    """
+    :class:`InsertAutomaton` over the symbols of tree nodes: the rule id for
+    rule nodes and the (text hash, text length) pair (see
+    :func:`~mlirmut.synthfuzz.tree.text_hashes`) for literals, i.e., nodes of
+    rule id 0.
+    """
+    __slots__ = ('moves', 'start', 'accept', 'words', 'word_rule_ids', 'child_rules')
+
+    def __init__(self, automaton, rules=RULES):
+        def symbol(label):
+            return token_hash(label.src) if isinstance(label, Literal) else rules.id(label)
+        self.moves = [{symbol(label): targets for label, targets in state_moves.items()} for state_moves in automaton.moves]
+        self.start = automaton.start
+        self.accept = automaton.accept
+        # (symbols, labels, slot) per word
+        self.words = [(tuple(symbol(label) for label in word.labels), word.labels, word.slot) for word in automaton.words]
+        # rule ids of the inserted nodes (0 for the literals), for their contexts
+        self.word_rule_ids = [tuple(0 if isinstance(label, Literal) else rules.id(label) for label in word.labels) for word in automaton.words]
+        self.child_rules = rules.mask(automaton.child_rules)
+
+    def run(self, states, symbols):
+        moves = self.moves
+        for symbol in symbols:
+            targets = 0
+            for state in _states(states):
+                targets |= moves[state].get(symbol, 0)
+            if not targets:
+                return 0
+            states = targets
+        return states
+
+    def sites(self, symbols):
+        """
+        Insertion sites in a node with children ``symbols``: (position, word
+        id) pairs, where inserting the word before the child at the position
+        keeps the children matching the automaton. There are none if the
+        children do not match in the first place.
+        """
+        forward = [1 << self.start]
+        for symbol in symbols:
+            states = self.run(forward[-1], (symbol,))
+            if not states:
+                return []
+            forward.append(states)
+        if not forward[-1] & self.accept:
+            return []
+        # backward[i]: states from which symbols[i:] leads to acceptance
+        backward = [0] * len(forward)
+        backward[-1] = self.accept
+        moves = self.moves
+        for i in range(len(symbols) - 1, -1, -1):
+            symbol, following = symbols[i], backward[i + 1]
+            backward[i] = sum(1 << state for state in range(len(moves)) if moves[state].get(symbol, 0) & following)
+        return [(position, word_id)
+                for position in range(len(forward))
+                for word_id, (word_symbols, _, _) in enumerate(self.words)
+                if self.run(forward[position], word_symbols) & backward[position]]
+
+
+@dataclass(slots=True)
+class InsertionSites:
+    """
+    Insertion sites of a tree: parallel arrays of the parent node ids, child
+    positions, word ids and the rule ids of the placeholder nodes, and the
+    site ids by placeholder rule.
+    """
+    parent_ids: array
+    positions: array
+    word_ids: array
+    rule_ids: array
+    by_rule: dict
+
+    def __len__(self):
+        return len(self.parent_ids)
+
+
+@dataclass(frozen=True, slots=True)
+class InsertionSite:
+    """
+    An insertion site of a recipient tree with the donor node selected for it
+    (see :meth:`~mlirmut.synthfuzz.population.SynthFuzzPopulation.select_to_insert`).
+    """
+    parent_id: int
+    position: int
+    word_id: int
+    donor_id: int
+
+
+class InsertionSiteBank:
+    """
+    Computes the insertion sites of trees by the automata of the insert
+    patterns. Sites are cached per :class:`TreeIndex` (which is shared by all
+    copies of a tree), like the tables of
+    :class:`~mlirmut.synthfuzz.fragments.FragmentBank`.
+    """
+    def __init__(self, automata):
+        # rule id of the parent -> CompiledAutomaton
+        self.automata = automata
+        # id(index) -> (index, InsertionSites); the index is kept alive so that its id is not reused
+        self._sites = {}
+
+    def sites(self, index, cache=True):
+        entry = self._sites.get(id(index)) if cache else None
+        if entry is not None:
+            return entry[1]
+
+        rule_ids, ends = index.rule_ids, index.ends
+        sites = InsertionSites(parent_ids=array('i'), positions=array('i'), word_ids=array('i'), rule_ids=array('H'), by_rule={})
+        for parent_rule_id, automaton in self.automata.items():
+            for parent_id in index.ids_by_rule.get(parent_rule_id, ()):
+                symbols = []
+                child_id = parent_id + 1
+                while child_id < ends[parent_id]:
+                    symbols.append(rule_ids[child_id] or (index.text_hashes[child_id], index.text_lengths[child_id]))
+                    child_id = ends[child_id]
+                for position, word_id in automaton.sites(symbols):
+                    word_symbols, _, slot = automaton.words[word_id]
+                    sites.by_rule.setdefault(word_symbols[slot], array('i')).append(len(sites.parent_ids))
+                    sites.parent_ids.append(parent_id)
+                    sites.positions.append(position)
+                    sites.word_ids.append(word_id)
+                    sites.rule_ids.append(word_symbols[slot])
+        if cache:
+            self._sites[id(index)] = (index, sites)
+        return sites
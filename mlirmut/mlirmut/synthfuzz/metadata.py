@@ -0,0 +1,90 @@
+from importlib.util import module_from_spec, spec_from_file_location
+from math import inf
+
+from .insertion import InsertAutomaton
+
+# Grammar metadata: what the SynthFuzz runtime and the analyses need to know
+# about a grammar, emitted by ``ProcessorTool`` as a Python module of literals
+# next to the generator. Unlike graph.pkl and insert_patterns.pkl, loading it
+# does not depend on the layout of the processor classes, and neither the
+# module nor this loader import anything beyond the standard library (the
+# bytecode of the module is cached by the import machinery like that of any
+# module). The module defines:
+#
+#   VERSION: METADATA_VERSION of the writer.
+#   GRAMMAR: name of the generator class.
+#   RULES: the rule-id table, i.e., the rule names in grammar order (see
+#       :class:`~mlirmut.synthfuzz.rules.RuleTable`).
+#   MIN_DEPTHS: rule -> minimum depth of the rule (None if infinite).
+#   QUANTIFIERS: rule -> (index, min, max) per quantifier of the rule body
+#       (max None if unbounded).
+#   CHILDREN, PARENTS: rule -> the rules referred to in the rule body, and
+#       the rules referring to it, in grammar order.
+#   INSERT_PATTERNS: parser rule name -> insert automaton (see
+#       :meth:`~mlirmut.synthfuzz.insertion.InsertAutomaton.encode`).
+#
+# The other per-rule tables are keyed by the rule identifiers of the
+# generator, i.e., the rule name, suffixed with the label for labeled
+# alternatives.
+
+METADATA_NAME = 'grammar_metadata.py'
+METADATA_VERSION = 1
+
+
+def dump_metadata(fn, *, grammar, rules, min_depths, quantifiers, children, insert_patterns):
+    """
+    Write a grammar metadata module. The arguments are the tables described
+    above, except that the values of ``min_depths`` and the max of the
+    quantifiers may be ``inf``, and ``insert_patterns`` holds
+    :class:`~mlirmut.synthfuzz.insertion.InsertAutomaton` objects.
+    """
+    def finite(value):
+        return None if value == inf else value
+
+    parents = {rule: [] for rule in children}
+    for rule, rule_children in children.items():
+        for child in rule_children:
+            if rule not in parents.setdefault(child, []):
+                parents[child].append(rule)
+
+    def table(name, items):
+        f.write(f'{name} = {{\n')
+        for key, value in items:
+            f.write(f'    {key!r}: {value!r},\n')
+        f.write('}\n\n')
+
+    with open(fn, 'w') as f:
+        f.write(f'# Generated by mlirmut.synthfuzz.processor, do not edit.\n\n'
+                f'VERSION = {METADATA_VERSION}\n\n'
+                f'GRAMMAR = {grammar!r}\n\n'
+                f'RULES = {tuple(rules)!r}\n\n')
+        table('MIN_DEPTHS', ((rule, finite(depth)) for rule, depth in min_depths.items()))
+        table('QUANTIFIERS', ((rule, tuple((idx, min, finite(max)) for idx, min, max in specs)) for rule, specs in quantifiers.items()))
+        table('CHILDREN', ((rule, tuple(rule_children)) for rule, rule_children in children.items()))
+        table('PARENTS', ((rule, tuple(rule_parents)) for rule, rule_parents in parents.items()))
+        table('INSERT_PATTERNS', ((rule, automaton.encode()) for rule, automaton in insert_patterns.items()))
+
+
+def load_metadata(fn):
+    """
+    Load a grammar metadata module.
+
+    :return: The module object.
+    """
+    spec = spec_from_file_location('_synthfuzz_grammar_metadata', fn)
+    if spec is None:
+        raise ValueError(f'{fn} is not a grammar metadata module.')
+    metadata = module_from_spec(spec)
+    spec.loader.exec_module(metadata)
+    version = getattr(metadata, 'VERSION', None)
+    if version != METADATA_VERSION:
+        raise ValueError(f'Grammar metadata version {version} of {fn} is not supported (expected {METADATA_VERSION}), process the grammar again.')
+    return metadata
+
+
+def insert_patterns(metadata):
+    """
+    Decode the insert patterns of a loaded metadata module (the format that
+    :func:`~mlirmut.synthfuzz.insertion.compile_insert_patterns` takes).
+    """
+    return {rule: InsertAutomaton.decode(data) for rule, data in metadata.INSERT_PATTERNS.items()}
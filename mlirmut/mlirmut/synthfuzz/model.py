@@ -0,0 +1,116 @@
+from bisect import bisect
+from itertools import accumulate
+from random import random
+
+from grammarinator.runtime import DefaultModel
+
+
+def alias_table(weights):
+    """
+    Build the alias table of a discrete distribution (Vose's method): a draw
+    picks a column uniformly, then either the column itself (with its
+    probability) or its alias.
+
+    :param tuple[float] weights: Non-negative weights with a positive sum.
+    :return: The probabilities and the aliases of the columns.
+    :rtype: tuple[list[float], list[int]]
+    """
+    n = len(weights)
+    total = sum(weights)
+    if total <= 0:
+        raise ValueError('Total of weights must be greater than zero')
+    probs = [w * n / total for w in weights]
+    aliases = list(range(n))
+    small = [i for i, p in enumerate(probs) if p < 1]
+    large = [i for i, p in enumerate(probs) if p >= 1]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        aliases[s] = l
+        probs[l] -= 1 - probs[s]
+        (small if probs[l] < 1 else large).append(l)
+    # the leftovers are 1 up to rounding errors
+    for i in small + large:
+        probs[i] = 1
+    return probs, aliases
+
+
+class AliasModel(DefaultModel):
+    """
+    Decision model drawing alternatives from alias tables, i.e., with a single
+    random number and two lookups per decision instead of the cumulative
+    weights that :func:`random.choices` computes on every call. The tables are
+    cached by rule, alternation, and the weights passed by the generator
+    (which depend on the depth and the predicates). With cooldown, which
+    updates the multipliers of an alternation after every choice, the
+    alternatives are drawn from the cumulative weights instead, like by
+    :class:`~grammarinator.runtime.DefaultModel` under a cooldown wrapper.
+
+    The multipliers (``weights``) and the ``cooldown`` are applied by the model
+    itself, with the semantics of :class:`~grammarinator.runtime.CooldownModel`,
+    which must not wrap it (see :func:`mlirmut.synthfuzz.generate.generator_tool_helper`).
+    As there, the cooled-down multipliers only carry over from one generation
+    to the next if the model instances of the generations share them (see
+    ``multipliers``). The alias tables, which only depend on the initial
+    multipliers, can be shared the same way (see ``tables``).
+    Quantifiers are decided as in :class:`~grammarinator.runtime.DefaultModel`,
+    characters are drawn from a single random number instead of by
+    :func:`random.choice`.
+    """
+
+    def __init__(self, *, cooldown=1.0, weights=None, tables=None, multipliers=None):
+        """
+        :param float cooldown: The cooldown factor (default: 1.0, meaning no cooldown).
+        :param dict[tuple,float] weights: Initial multipliers of alternatives, keyed by
+            (rule name, alternation index, alternative index).
+        :param dict tables: Cache of alias tables to share with other model
+            instances created with the same ``weights`` (default: a new one).
+        :param dict multipliers: Cooled-down multipliers to share with other model
+            instances created with the same ``weights`` (default: a new one).
+        """
+        self._cooldown = cooldown
+        self._weights = weights or {}
+        # (rule name, alternation index) -> {weights: alias table}
+        self._tables = tables if tables is not None else {}
+        # (rule name, alternation index) -> multipliers of the alternatives, with cooldown
+        self._multipliers = multipliers if multipliers is not None else {}
+
+    def choice(self, node, idx, weights):
+        key = (node.name, idx)
+        if self._cooldown < 1:
+            return self._cooldown_choice(key, weights)
+
+        weights = tuple(weights)
+        tables = self._tables.get(key)
+        if tables is None:
+            tables = self._tables[key] = {}
+        table = tables.get(weights)
+        if table is None:
+            multipliers = self._weights
+            table = tables[weights] = alias_table([w * multipliers.get((*key, i), 1) for i, w in enumerate(weights)])
+
+        probs, aliases = table
+        u = random() * len(probs)
+        c = int(u)
+        return c if u - c < probs[c] else aliases[c]
+
+    def _cooldown_choice(self, key, weights):
+        # With cooldown, the multipliers of the alternation change after every
+        # choice, so a table would be rebuilt every time: a linear scan over
+        # the weights is cheaper.
+        multipliers = self._multipliers.get(key)
+        if multipliers is None:
+            multipliers = self._multipliers[key] = [self._weights.get((*key, i), 1) for i in range(len(weights))]
+        # The draw of random.choices, as made by the DefaultModel under a CooldownModel.
+        cum_weights = list(accumulate(w * m for w, m in zip(weights, multipliers)))
+        total = cum_weights[-1]
+        if total <= 0:
+            raise ValueError('Total of weights must be greater than zero')
+        c = bisect(cum_weights, random() * total, 0, len(cum_weights) - 1)
+
+        multipliers[c] *= self._cooldown
+        wsum = sum(multipliers)
+        multipliers[:] = [m / wsum for m in multipliers]
+        return c
+
+    def charset(self, node, idx, chars):
+        return chr(chars[int(random() * len(chars))])
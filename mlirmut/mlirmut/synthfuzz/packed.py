@@ -0,0 +1,126 @@
+import mmap
+import os
+import struct
+from glob import escape, glob
+from os.path import join
+
+# key, offset and length of a record in the data file of its shard
+INDEX_ENTRY = struct.Struct('<qQI')
+
+
+def packed_exists(directory, name):
+    """
+    Check whether ``directory`` contains shards written by a
+    :class:`PackedWriter` called ``name``.
+    """
+    return bool(glob(join(escape(str(directory)), f'{escape(name)}.*.pidx')))
+
+
+class PackedWriter:
+    """
+    Append-only store of binary records keyed by integers (e.g., test case
+    indices), written to ``<name>.<pid>.pack`` data files with fixed-size
+    entries in the accompanying ``<name>.<pid>.pidx`` index files. Every
+    process writes its own shard, so parallel workers never share a file. Files
+    are opened lazily (and reopened after a fork), so writers can be pickled
+    and sent to worker processes.
+    """
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self._pid = None
+        self._data = None
+        self._index = None
+
+    def __getstate__(self):
+        return {'directory': self.directory, 'name': self.name}
+
+    def __setstate__(self, state):
+        self.__init__(state['directory'], state['name'])
+
+    def _open(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        shard = join(self.directory, f'{self.name}.{pid}')
+        self._data = open(f'{shard}.pack', 'ab')
+        self._index = open(f'{shard}.pidx', 'ab')
+        self._pid = pid
+
+    def append(self, key, record):
+        self._open()
+        offset = self._data.tell()
+        self._data.write(record)
+        # The record is flushed before its index entry, so that readers never
+        # find an entry pointing past the end of the data file.
+        self._data.flush()
+        self._index.write(INDEX_ENTRY.pack(key, offset, len(record)))
+        self._index.flush()
+
+    def close(self):
+        if self._pid == os.getpid():
+            self._data.close()
+            self._index.close()
+        self._pid = self._data = self._index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class PackedReader:
+    """
+    Random access to the records of all the shards written by
+    :class:`PackedWriter` instances with the same ``directory`` and ``name``.
+    If a key was appended more than once, the last record wins. Data files are
+    memory-mapped, so reading a record costs no system call.
+    """
+    def __init__(self, directory, name):
+        self._entries = {}
+        self._files = {}
+        for index_fn in sorted(glob(join(escape(str(directory)), f'{escape(name)}.*.pidx'))):
+            data_fn = index_fn[:-len('.pidx')] + '.pack'
+            with open(index_fn, 'rb') as f:
+                buffer = f.read()
+            # ignore a partially written last entry
+            buffer = buffer[:len(buffer) - len(buffer) % INDEX_ENTRY.size]
+            for key, offset, length in INDEX_ENTRY.iter_unpack(buffer):
+                self._entries[key] = (data_fn, offset, length)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def keys(self):
+        return sorted(self._entries)
+
+    def __getitem__(self, key):
+        data_fn, offset, length = self._entries[key]
+        if length == 0:
+            return b''
+        data = self._files.get(data_fn)
+        if data is None:
+            with open(data_fn, 'rb') as f:
+                data = self._files[data_fn] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return data[offset:offset + length]
+
+    def items(self):
+        for key in self.keys():
+            yield key, self[key]
+
+    def close(self):
+        for data in self._files.values():
+            data.close()
+        self._files.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
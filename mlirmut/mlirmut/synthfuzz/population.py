@@ -1,10 +1,225 @@
+import fcntl
 import logging
+import os
 import random
-from itertools import batched
-from grammarinator.tool.default_population import DefaultPopulation, DefaultTree
+import struct
+import tempfile
+import weakref
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import batched, chain, cycle, product
+from math import inf
+from os.path import basename, join
+from uuid import uuid4
+from grammarinator.tool.default_population import DefaultPopulation
+
+from .insertion import InsertionSite, InsertionSiteBank, compile_insert_patterns
+from .rules import RULES
+from .snapshot import PopulationSnapshot, snapshot_dir, write_snapshot
+from .tree import CompactTree, SynthFuzzTree, TreeIndex
 
 logger = logging.getLogger(__name__)
 
+
+class TreeCache:
+    """
+    Bounded LRU cache of deserialized population trees, kept as
+    :class:`CompactTree` objects. The size of a tree is accounted by
+    :attr:`CompactTree.nbytes` and the least recently used trees are evicted
+    once ``max_bytes`` is exceeded.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._trees = OrderedDict()
+        self._size = 0
+
+    def load(self, fn, index=None):
+        """
+        Return a private copy of the tree stored in ``fn``.
+        """
+        compact = self._trees.get(fn)
+        if compact is not None:
+            self._trees.move_to_end(fn)
+            return compact.to_tree(fn=fn)
+
+        tree = SynthFuzzTree.load(fn, index=index)
+        compact = CompactTree.from_tree(tree)
+        size = compact.nbytes
+        if size > self.max_bytes:
+            return tree
+
+        self._trees[fn] = compact
+        self._size += size
+        while self._size > self.max_bytes:
+            _, evicted = self._trees.popitem(last=False)
+            self._size -= evicted.nbytes
+        return tree
+
+
+class PopulationLog:
+    """
+    Append-only manifest of the trees added to a population directory. Every
+    process that keeps trees in the directory (e.g., parallel generation
+    workers with ``--keep-trees``) appends the names of its new tree files
+    under an exclusive file lock, after the tree and its index have been
+    saved. Processes learn about each other's trees by reading the records
+    appended since their last read, so no directory listing is needed.
+    """
+    NAME = 'population.log'
+    # length of the UTF-8 encoded file name that follows
+    RECORD = struct.Struct('<I')
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = join(directory, self.NAME)
+        self._offset = 0
+
+    def append(self, fn):
+        name = basename(fn).encode('utf-8', errors='surrogatepass')
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            os.write(fd, self.RECORD.pack(len(name)) + name)
+        finally:
+            os.close(fd)
+
+    def read_new(self):
+        """
+        Return the tree files appended to the log since the last call.
+        """
+        try:
+            size = os.stat(self.path).st_size
+        except FileNotFoundError:
+            return []
+        if size <= self._offset:
+            return []
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+        fns = []
+        pos = 0
+        # a record may still be partially written, it is read the next time
+        while pos + self.RECORD.size <= len(data):
+            (length,) = self.RECORD.unpack_from(data, pos)
+            end = pos + self.RECORD.size + length
+            if end > len(data):
+                break
+            fns.append(join(self.directory, data[pos + self.RECORD.size:end].decode('utf-8', errors='surrogatepass')))
+            pos = end
+        self._offset += pos
+        return fns
+
+
+class RuleIndex:
+    """
+    Population-wide inverted index from rule ids to the nodes of that rule.
+    Within a rule, nodes are bucketed by their context signatures (see
+    :meth:`ContextFilter.signatures`), and in every bucket the (depth, tree id,
+    node id) entries are kept in parallel arrays sorted by depth, so that the
+    donors fitting into a given depth budget form a prefix of the arrays. The
+    entries of added trees are appended, and a bucket is sorted (stably, i.e.,
+    in the order of addition within a depth) when it is queried next. Tree
+    ids are positions in ``tree_fns``, node ids are pre-order ids in the
+    tree's :class:`TreeIndex`. Roots and nodes of ``excluded_rules`` (a
+    bitset) are never donors, so they are not indexed. If an
+    :class:`InsertionSiteBank` is given, the insertion sites of every tree are
+    indexed as well (``tree_sites``).
+    """
+    def __init__(self, context_filter, insertion_sites=None, excluded_rules=0):
+        self.tree_fns = []
+        self.tree_indexes = []
+        self.tree_signatures = []
+        self.tree_sites = []
+        self._context_filter = context_filter
+        self._insertion_sites = insertion_sites
+        self._tree_ids = {}
+        self._tree_ids_by_index = {}
+        self._excluded_rules = excluded_rules
+        self._entries = {}
+        # (rule id, signatures) of the buckets with entries appended since they were sorted
+        self._unsorted = set()
+        self._tree_counts = {}
+
+    def add(self, fn, index, signatures=None):
+        tree_id = len(self.tree_fns)
+        self.tree_fns.append(fn)
+        self.tree_indexes.append(index)
+        self._tree_ids[fn] = tree_id
+        self._tree_ids_by_index[id(index)] = tree_id
+        anc, left, right = signatures = signatures or self._context_filter.signatures(index)
+        self.tree_signatures.append(signatures)
+        self.tree_sites.append(self._insertion_sites.sites(index, cache=False) if self._insertion_sites else None)
+        parents, node_depths = index.parents, index.depths
+        keys = list(zip(anc, left, right))
+        for rule_id, node_ids in index.ids_by_rule.items():
+            self._tree_counts[rule_id] = self._tree_counts.get(rule_id, 0) + 1
+            if self._excluded_rules >> rule_id & 1:
+                continue
+            # the node ids of the rule by bucket, to extend the arrays at once
+            groups = {}
+            for node_id in node_ids:
+                if parents[node_id] >= 0:
+                    group = groups.get(keys[node_id])
+                    if group is None:
+                        groups[keys[node_id]] = [node_id]
+                    else:
+                        group.append(node_id)
+            buckets = self._entries.setdefault(rule_id, {})
+            for key, group in groups.items():
+                entry = buckets.get(key)
+                if entry is None:
+                    entry = buckets[key] = (array('i'), array('i'), array('i'))
+                depths, tree_ids, entry_node_ids = entry
+                depths.extend([node_depths[node_id] for node_id in group])
+                tree_ids.extend(array('i', (tree_id,)) * len(group))
+                entry_node_ids.extend(group)
+                self._unsorted.add((rule_id, key))
+
+    def tree_index(self, fn):
+        tree_id = self._tree_ids.get(fn)
+        return self.tree_indexes[tree_id] if tree_id is not None else None
+
+    def signatures(self, index):
+        """
+        Context signatures of the nodes of a population tree given by its
+        :class:`TreeIndex`.
+        """
+        tree_id = self._tree_ids_by_index.get(id(index))
+        return self.tree_signatures[tree_id] if tree_id is not None else self._context_filter.signatures(index)
+
+    def tree_count(self, rule_id):
+        """
+        Number of trees containing at least one node of rule ``rule_id``.
+        """
+        return self._tree_counts.get(rule_id, 0)
+
+    def donors(self, rule_id, accepted, max_depth):
+        """
+        Return the buckets of rule ``rule_id`` matching the ``accepted`` context
+        signatures (see :meth:`ContextFilter.accepted_signatures`) as
+        (tree ids, node ids, count) tuples, where the first ``count`` entries
+        have depth at most ``max_depth``.
+        """
+        buckets = self._entries.get(rule_id)
+        if not buckets:
+            return []
+        result = []
+        for key in product(*accepted):
+            entry = buckets.get(key)
+            if entry is not None:
+                if (rule_id, key) in self._unsorted:
+                    self._unsorted.discard((rule_id, key))
+                    depths, tree_ids, node_ids = entry
+                    order = sorted(range(len(depths)), key=depths.__getitem__)
+                    entry = buckets[key] = (array('i', (depths[i] for i in order)), array('i', (tree_ids[i] for i in order)), array('i', (node_ids[i] for i in order)))
+                count = bisect_right(entry[0], max_depth)
+                if count:
+                    result.append((entry[1], entry[2], count))
+        return result
+
+
 # Grammarinator's left and right sibling properties are broken
 # since the __getattr__ workaround overrides them
 def left_sibling(node):
@@ -65,6 +280,93 @@ class ContextFilter:
             d_node = right_sibling(d_node)
         return True
 
+    # The context of a node in each direction is the tuple of the rule ids of its
+    # first k ancestors (l left siblings, r right siblings), nearest first,
+    # cut short at the root (at the ends of the sibling list). The verify_*
+    # methods above accept a donor iff, in each direction, its context equals
+    # a prefix of the recipient's context (the whole context, of full length,
+    # if limit_by_donor_context is disabled). So donors can be bucketed by the
+    # hashes of their contexts and looked up by the hashes of the prefixes of
+    # the recipient's context. (Tuples of ints hash the same in every process.)
+    def signatures(self, index):
+        """
+        Hash the ancestor, left sibling and right sibling contexts of every node
+        of a :class:`TreeIndex`.
+
+        :return: Three arrays of hashes indexed by node id.
+        """
+        result = (array('q'), array('q'), array('q'))
+        for node_id in range(len(index)):
+            for hashes, context in zip(result, self.index_contexts(index, node_id)):
+                hashes.append(hash(context))
+        return result
+
+    def contexts(self, node):
+        """
+        Ancestor, left sibling and right sibling contexts (rule ids) of a node.
+        """
+        rule_id = RULES.id
+        ancestors = []
+        ancestor = node.parent
+        while ancestor is not None and len(ancestors) < self.k_ancestors:
+            ancestors.append(rule_id(ancestor.name))
+            ancestor = ancestor.parent
+        if node.parent is None:
+            return tuple(ancestors), (), ()
+        siblings = node.parent.children
+        idx = siblings.index(node)
+        left = tuple(rule_id(sibling.name) for sibling in reversed(siblings[max(0, idx - self.l_siblings):idx]))
+        right = tuple(rule_id(sibling.name) for sibling in siblings[idx + 1:idx + 1 + self.r_siblings])
+        return tuple(ancestors), left, right
+
+    def index_contexts(self, index, node_id):
+        """
+        Same as :meth:`contexts` for a node given by its id in a
+        :class:`TreeIndex`.
+        """
+        result = []
+        for links, limit in ((index.parents, self.k_ancestors), (index.prev_siblings, self.l_siblings), (index.next_siblings, self.r_siblings)):
+            context = []
+            context_id = links[node_id]
+            while context_id >= 0 and len(context) < limit:
+                context.append(index.rule_ids[context_id])
+                context_id = links[context_id]
+            result.append(tuple(context))
+        return tuple(result)
+
+    def insertion_contexts(self, index, parent_id, position, word_rule_ids, slot):
+        """
+        Same as :meth:`index_contexts` for the placeholder node of an insertion
+        site (see :class:`~mlirmut.synthfuzz.insertion.InsertionSites`), as if
+        the nodes of the word (given by their rule ids) were inserted.
+        """
+        ancestors = []
+        context_id = parent_id
+        while context_id >= 0 and len(ancestors) < self.k_ancestors:
+            ancestors.append(index.rule_ids[context_id])
+            context_id = index.parents[context_id]
+        children = []
+        child_id = parent_id + 1
+        while child_id < index.ends[parent_id]:
+            children.append(index.rule_ids[child_id])
+            child_id = index.ends[child_id]
+        left = (tuple(children[:position]) + word_rule_ids[:slot])[::-1][:self.l_siblings]
+        right = (word_rule_ids[slot + 1:] + tuple(children[position:]))[:self.r_siblings]
+        return tuple(ancestors), left, right
+
+    def accepted_signatures(self, contexts):
+        """
+        Signatures of the donor contexts compatible with the recipient
+        ``contexts`` (as returned by :meth:`contexts`), in each direction.
+        """
+        result = []
+        for context, limit in zip(contexts, (self.k_ancestors, self.l_siblings, self.r_siblings)):
+            if self.limit_by_donor_context:
+                result.append(tuple({hash(context[:i]) for i in range(len(context) + 1)}))
+            else:
+                result.append((hash(context),) if len(context) == limit else ())
+        return tuple(result)
+
 
 # TODO: implement a recombine selector that considers context length
 class SynthFuzzPopulation(DefaultPopulation):
@@ -76,57 +378,518 @@ class SynthFuzzPopulation(DefaultPopulation):
         r_siblings: int,
         min_depths=None,
         limit_by_donor_context: bool = True,
+        tree_cache_size: int = 0,
+        max_select_attempts: int = 100,
+        insert_patterns=None,
     ):
+        # first, so that pickled copies (e.g., of spawned workers) get the rule ids before anything else
+        self._rules = RULES
         super().__init__(directory=directory, min_depths=min_depths)
+        # nodes of these rules are never selected
+        self._excluded_rules = self._rules.mask([None, 'EOF', '<INVALID>'])
+        self._rule_min_depths = {self._rules.id(name): min_depth for name, min_depth in self._min_depths.items()}
         self.context_filter = ContextFilter(k_ancestors, l_siblings, r_siblings, limit_by_donor_context)
-    
+        self._tree_cache = TreeCache(tree_cache_size) if tree_cache_size > 0 else None
+        self._max_select_attempts = max_select_attempts
+        # the insertion sites of the trees are indexed along with their rules
+        self._insertion_sites = InsertionSiteBank(compile_insert_patterns(insert_patterns, self._rules)) if insert_patterns else None
+        self._rule_index = RuleIndex(self.context_filter, self._insertion_sites, self._excluded_rules)
+        self._recipient_options = {}
+        # root of every handed out tree -> population file it was copied from
+        self._sources = weakref.WeakKeyDictionary()
+        self._snapshot = None
+        self._log = PopulationLog(self._directory)
+        self._index_trees()
+
+    def __getstate__(self):
+        # Weak references cannot be pickled (e.g., when the population is sent
+        # to worker processes); handed out trees stay with their process.
+        state = self.__dict__.copy()
+        state['_sources'] = None
+        if self._snapshot is not None:
+            # The receiving process maps the snapshot and indexes the trees
+            # from there, instead of unpickling a copy of the rule index.
+            state['_rule_index'] = None
+            state['_recipient_options'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._sources = weakref.WeakKeyDictionary()
+        if self._rule_index is None:
+            self._rule_index = RuleIndex(self.context_filter, self._insertion_sites, self._excluded_rules)
+            self._index_trees()
+
+    def _index_trees(self):
+        unindexed = sum(self._index_tree(fn) for fn in self._files)
+        if unindexed:
+            logger.info('Indexed %d population tree(s).', unindexed)
+        self.refresh()
+
+    def _index_tree(self, fn):
+        # Seed trees (e.g., created by grammarinator-parse) come without a
+        # TreeIndex; build the missing ones once, when they enter the population.
+        # Returns whether the index had to be built.
+        tree_id = self._snapshot.tree_id(fn) if self._snapshot else None
+        if tree_id is not None:
+            self._rule_index.add(fn, self._snapshot.index(tree_id), self._snapshot.signatures(tree_id))
+            return False
+        index = TreeIndex.load(fn)
+        built = index is None
+        if built:
+            index = SynthFuzzTree.load(fn).index
+        self._rule_index.add(fn, index)
+        return built
+
+    def refresh(self):
+        """
+        Index the trees that other processes added to the population directory
+        since the last refresh (see :class:`PopulationLog`). Called by every
+        selection, it costs a single ``stat`` if nothing was added.
+        """
+        for fn in self._log.read_new():
+            # skip own trees and trees removed from the directory since
+            if self._rule_index.tree_index(fn) is None and os.path.exists(fn):
+                self._files.append(fn)
+                self._index_tree(fn)
+
+    @contextmanager
+    def shared(self):
+        """
+        Write the trees of the population to a snapshot file (see
+        :class:`~mlirmut.synthfuzz.snapshot.PopulationSnapshot`) and serve them
+        from there. Processes that the population is passed to (e.g., forked
+        or spawned generation workers) map the same file, instead of every
+        process loading, indexing and caching its own copies of the trees.
+        Trees added later stay private to the process adding them. The file is
+        removed when the context exits.
+        """
+        fd, path = tempfile.mkstemp(prefix='synthfuzz-population-', suffix='.snapshot', dir=snapshot_dir())
+        os.close(fd)
+        try:
+            rule_index = self._rule_index
+            write_snapshot(path, ((fn, CompactTree.from_tree(SynthFuzzTree.load(fn, index=rule_index.tree_index(fn)))) for fn in rule_index.tree_fns), self.context_filter)
+            self._snapshot = PopulationSnapshot(path)
+            self._rule_index = RuleIndex(self.context_filter, self._insertion_sites, self._excluded_rules)
+            self._recipient_options = {}
+            if self._tree_cache is not None:
+                self._tree_cache = TreeCache(self._tree_cache.max_bytes)
+            self._index_trees()
+            yield self
+        finally:
+            # mappings stay valid after the file is removed
+            os.remove(path)
+
+    def _load_tree(self, fn):
+        # Selection runs on the indexes, only the chosen trees are loaded (or
+        # built from their compact copies), each time as a private copy.
+        tree_id = self._snapshot.tree_id(fn) if self._snapshot else None
+        if tree_id is not None:
+            tree = self._snapshot.tree(tree_id)
+        elif self._tree_cache is not None:
+            tree = self._tree_cache.load(fn, index=self._rule_index.tree_index(fn))
+        else:
+            tree = SynthFuzzTree.load(fn, index=self._rule_index.tree_index(fn))
+        self._sources[tree.root] = tree.fn
+        return tree
+
+    def _filter_ids(self, index, ids, max_depth):
+        # Index-based counterpart of ``_filter_nodes``.
+        rule_ids, parents, levels = index.rule_ids, index.parents, index.levels
+        excluded, min_depths = self._excluded_rules, self._rule_min_depths
+        return [i for i in ids if parents[i] >= 0 and not excluded >> rule_ids[i] & 1 and levels[i] + min_depths.get(rule_ids[i], 0) < max_depth]
+
+    def select_to_mutate(self, max_depth, root=None):
+        if root:
+            return super().select_to_mutate(max_depth, root=root)
+        self.refresh()
+        tree = self._load_tree(self._random_individuals(n=1)[0])
+        options = self._filter_ids(tree.index, range(len(tree.nodes)), max_depth)
+        return tree.nodes[random.choice(options)] if options else tree.root
+
+    def mutation_budgets(self, max_depth):
+        """
+        Rule names and depth budgets of the nodes that :meth:`select_to_mutate`
+        may select, read from the tree indexes without loading any tree.
+
+        :return: Set of (rule name, depth budget) pairs.
+        """
+        self.refresh()
+        names = self._rules.names
+        return {(names[index.rule_ids[i]], max_depth - index.levels[i])
+                for index in self._rule_index.tree_indexes
+                for i in self._filter_ids(index, range(len(index.rule_ids)), max_depth)}
+
     def select_to_insert(self, max_depth):
+        """
+        Select a recipient tree uniformly, then one of its indexed insertion
+        sites, and sample a donor node of the rule of the site from another
+        tree directly from the :class:`RuleIndex`, among those with a context
+        compatible with the context of the inserted node and fitting the depth
+        bound. Falls back to a random pair of trees, without a site, if the
+        population has no insert patterns or no donor is found for the first
+        ``max_select_attempts`` sampled sites.
+
+        :return: Private copies of the recipient and donor trees and the
+            :class:`~mlirmut.synthfuzz.insertion.InsertionSite` (or ``None``).
+        """
+        selection = self._select_site(max_depth)
+        if selection is not None:
+            recipient_tree_id, donor_tree_id, site = selection
+            tree_fns = self._rule_index.tree_fns
+            return self._load_tree(tree_fns[recipient_tree_id]), self._load_tree(tree_fns[donor_tree_id]), site
+
+        pair = self._random_pair()
+        if pair is not None:
+            return *pair, None
+
+    def _random_pair(self):
         tree_fn_options = self._random_individuals(n=len(self._files))
         for batch in batched(tree_fn_options, 2):
             if len(batch) < 2:
                 break
-            recipient_tree = DefaultTree.load(batch[0])
-            donor_tree = DefaultTree.load(batch[1])
-            return recipient_tree, donor_tree
+            return self._load_tree(batch[0]), self._load_tree(batch[1])
+        return None
+
+    def _select_site(self, max_depth):
+        # The indexed part of select_to_insert: (recipient tree id, donor tree
+        # id, InsertionSite) or None.
+        self.refresh()
+        rule_index = self._rule_index
+        if not rule_index.tree_fns:
+            return None
+        for _ in range(self._max_select_attempts if self._insertion_sites else 0):
+            recipient_tree_id = random.randrange(len(rule_index.tree_fns))
+            sites = rule_index.tree_sites[recipient_tree_id]
+            if not sites:
+                continue
+            site = random.randrange(len(sites))
+            donor = self._sample_site_donor(rule_index.tree_indexes[recipient_tree_id], sites, site, max_depth)
+            if donor is None or donor[0] == recipient_tree_id:
+                continue
+            donor_tree_id, donor_id = donor
+            return recipient_tree_id, donor_tree_id, InsertionSite(parent_id=sites.parent_ids[site], position=sites.positions[site], word_id=sites.word_ids[site], donor_id=donor_id)
+        return None
+
+    def _sample_site_donor(self, recipient_index, sites, site, max_depth):
+        # A donor for an insertion site from the RuleIndex: (tree id, node id)
+        # or None.
+        buckets = self._rule_index.donors(sites.rule_ids[site], self._site_signatures(recipient_index, sites, site), max_depth - recipient_index.levels[sites.parent_ids[site]] - 1)
+        return self._sample_donor(buckets)
+
+    def _site_signatures(self, recipient_index, sites, site):
+        # Signatures of the donor contexts accepted at an insertion site.
+        parent_id, word_id = sites.parent_ids[site], sites.word_ids[site]
+        automaton = self._insertion_sites.automata[recipient_index.rule_ids[parent_id]]
+        contexts = self.context_filter.insertion_contexts(recipient_index, parent_id, sites.positions[site], automaton.word_rule_ids[word_id], automaton.words[word_id][2])
+        return self.context_filter.accepted_signatures(contexts)
 
     def select_to_edit(self, max_depth):
-        return self.select_to_recombine(self, max_depth)
+        """
+        Same as :meth:`select_to_recombine`, but the donor tree and the id of
+        the donor node are returned as well, so that the parameterization of
+        the donor fragment can be looked up by node id.
+        """
+        selection = self._select_pair(max_depth)
+        if selection is None:
+            return None
+        recipient_tree, recipient_id, donor_tree, donor_id = selection
+        return recipient_tree.nodes[recipient_id], donor_tree.nodes[donor_id], donor_tree, donor_id
 
     def select_to_recombine(self, max_depth):
+        selection = self._select_pair(max_depth)
+        if selection is None:
+            return None
+        recipient_tree, recipient_id, donor_tree, donor_id = selection
+        return recipient_tree.nodes[recipient_id], donor_tree.nodes[donor_id]
+
+    def _select_pair(self, max_depth):
+        """
+        Select a recipient tree uniformly, then a recipient node of a rule that
+        also occurs in other trees, and sample a donor node of the same rule
+        directly from the population-wide :class:`RuleIndex`, among those with
+        a compatible context and fitting the depth bound. Falls back to
+        scanning random pairs of trees if no donor is found for the first
+        ``max_select_attempts`` sampled recipients.
+
+        :return: Private copies of the recipient and donor trees with the ids
+            of the selected nodes.
+        """
+        self.refresh()
+        rule_index = self._rule_index
+        if not rule_index.tree_fns:
+            return None
+        for _ in range(self._max_select_attempts):
+            recipient_tree_id = random.randrange(len(rule_index.tree_fns))
+            recipient_index = rule_index.tree_indexes[recipient_tree_id]
+            options = self._recipient_options.get((recipient_tree_id, max_depth))
+            if options is None:
+                options = self._recipient_options[(recipient_tree_id, max_depth)] = self._filter_ids(recipient_index, range(len(recipient_index)), max_depth)
+            if not options:
+                continue
+            recipient_id = random.choice(options)
+            if rule_index.tree_count(recipient_index.rule_ids[recipient_id]) < 2:
+                continue
+            donor = self._sample_node_donor(recipient_index, recipient_id, max_depth)
+            if donor is None or donor[0] == recipient_tree_id:
+                continue
+            donor_tree_id, donor_id = donor
+
+            return self._load_tree(rule_index.tree_fns[recipient_tree_id]), recipient_id, self._load_tree(rule_index.tree_fns[donor_tree_id]), donor_id
+
+        logger.debug('Falling back to pairwise selection for recombination.')
+        return self._select_pair_pairwise(max_depth)
+
+    def _sample_node_donor(self, recipient_index, recipient_id, max_depth):
+        # A donor for a recipient node from the RuleIndex: (tree id, node id)
+        # or None.
+        accepted = self.context_filter.accepted_signatures(self.context_filter.index_contexts(recipient_index, recipient_id))
+        buckets = self._rule_index.donors(recipient_index.rule_ids[recipient_id], accepted, max_depth - recipient_index.levels[recipient_id])
+        return self._sample_donor(buckets)
+
+    def select_donor_to_edit(self, recipient_tree, max_depth):
+        """
+        Select a node of ``recipient_tree``, which need not be a population
+        tree (e.g., a mutant to be edited further), and a donor node for it
+        from the population, like :meth:`select_to_edit`.
+
+        :return: The recipient node, the donor node, a private copy of the
+            donor tree and the id of the donor node, or ``None`` if no donor
+            is found for the first ``max_select_attempts`` sampled recipient
+            nodes.
+        """
+        self.refresh()
+        rule_index = self._rule_index
+        recipient_index = recipient_tree.index
+        options = self._filter_ids(recipient_index, range(len(recipient_index)), max_depth)
+        for _ in range(self._max_select_attempts if options else 0):
+            recipient_id = random.choice(options)
+            donor = self._sample_node_donor(recipient_index, recipient_id, max_depth)
+            if donor is None or rule_index.tree_fns[donor[0]] == recipient_tree.fn:
+                continue
+            donor_tree_id, donor_id = donor
+            donor_tree = self._load_tree(rule_index.tree_fns[donor_tree_id])
+            return recipient_tree.nodes[recipient_id], donor_tree.nodes[donor_id], donor_tree, donor_id
+        return None
+
+    def select_donor_to_insert(self, recipient_tree, max_depth):
+        """
+        Select an insertion site of ``recipient_tree``, which need not be a
+        population tree, and a donor node for it from the population, like
+        :meth:`select_to_insert`.
+
+        :return: A private copy of the donor tree and the
+            :class:`~mlirmut.synthfuzz.insertion.InsertionSite`, or ``None``
+            if no donor is found for the first ``max_select_attempts`` sampled
+            sites.
+        """
+        self.refresh()
+        rule_index = self._rule_index
+        sites = self._insertion_sites.sites(recipient_tree.index, cache=False) if self._insertion_sites else None
+        for _ in range(self._max_select_attempts if sites else 0):
+            site = random.randrange(len(sites))
+            donor = self._sample_site_donor(recipient_tree.index, sites, site, max_depth)
+            if donor is None or rule_index.tree_fns[donor[0]] == recipient_tree.fn:
+                continue
+            donor_tree_id, donor_id = donor
+            return (self._load_tree(rule_index.tree_fns[donor_tree_id]),
+                    InsertionSite(parent_id=sites.parent_ids[site], position=sites.positions[site], word_id=sites.word_ids[site], donor_id=donor_id))
+        return None
+
+    @staticmethod
+    def _sample_donor(buckets):
+        # Uniform sample of the donors of the buckets returned by
+        # RuleIndex.donors: (tree id, node id) or None.
+        donor_entry = random.randrange(sum(count for _, _, count in buckets)) if buckets else None
+        if donor_entry is None:
+            return None
+        for tree_ids, node_ids, count in buckets:
+            if donor_entry < count:
+                break
+            donor_entry -= count
+        return tree_ids[donor_entry], node_ids[donor_entry]
+
+    def _verify_context(self, recipient_index, recipient_id, donor_index, donor_id):
+        # Make sure that the ancestors and siblings match (the index-based
+        # counterpart of the ContextFilter.verify_* methods)
+        accepted = self.context_filter.accepted_signatures(self.context_filter.index_contexts(recipient_index, recipient_id))
+        return all(signatures[donor_id] in keys for signatures, keys in zip(self._rule_index.signatures(donor_index), accepted))
+
+    def tree_fn(self, node):
+        """
+        Return the population file of the tree that ``node`` was selected
+        from (``None`` if unknown).
+        """
+        while node.parent:
+            node = node.parent
+        return self._sources.get(node)
+
+    def _select_pair_pairwise(self, max_depth):
         tree_fn_options = self._random_individuals(n=len(self._files))
         for batch in batched(tree_fn_options, 2):
             if len(batch) < 2:
                 break
-            recipient_tree = DefaultTree.load(batch[0])
-            donor_tree = DefaultTree.load(batch[1])
+            recipient_index, donor_index = self._rule_index.tree_index(batch[0]), self._rule_index.tree_index(batch[1])
 
-            common_types = set(recipient_tree.nodes_by_name.keys()).intersection(
-                set(donor_tree.nodes_by_name.keys())
-            )
-            recipient_options = self._filter_nodes(
-                recipient_tree,
+            common_types = recipient_index.rule_mask & donor_index.rule_mask
+            recipient_options = self._filter_ids(
+                recipient_index,
                 (
-                    node
-                    for rule_name in common_types
-                    for node in recipient_tree.nodes_by_name[rule_name]
+                    recipient_id
+                    for rule_id, recipient_ids in recipient_index.ids_by_rule.items()
+                    if common_types >> rule_id & 1
+                    for recipient_id in recipient_ids
                 ),
                 max_depth,
             )
             # Shuffle suitable nodes with sample.
-            for recipient_node in random.sample(
+            for recipient_id in random.sample(
                 recipient_options, k=len(recipient_options)
             ):
-                donor_options = tuple(donor_tree.nodes_by_name[recipient_node.name])
-                for donor_node in random.sample(donor_options, k=len(donor_options)):
-                    # Make sure that the ancestors and siblings match
-                    if not (self.context_filter.verify_k_ancestors(recipient_node, donor_node)
-                        and self.context_filter.verify_l_siblings(recipient_node, donor_node)
-                        and self.context_filter.verify_r_siblings(recipient_node, donor_node)):
-                        continue
+                donor_options = donor_index.ids_by_rule[recipient_index.rule_ids[recipient_id]]
+                for donor_id in random.sample(donor_options, k=len(donor_options)):
                     # Make sure that the output tree won't exceed the depth limit.
-                    if (
-                        recipient_tree.node_levels[recipient_node]
-                        + donor_tree.node_depths[donor_node]
-                        <= max_depth
-                    ):
-                        return recipient_node, donor_node
+                    if recipient_index.levels[recipient_id] + donor_index.depths[donor_id] > max_depth:
+                        continue
+                    if not self._verify_context(recipient_index, recipient_id, donor_index, donor_id):
+                        continue
+                    return self._load_tree(batch[0]), recipient_id, self._load_tree(batch[1]), donor_id
+
+    def compatible_donors(self, recipient_node, donor_tree, rule_id):
+        """
+        Ids of the nodes of rule ``rule_id`` in ``donor_tree`` whose context
+        is compatible with the context of ``recipient_node``.
+        """
+        return self._compatible_ids(self.context_filter.accepted_signatures(self.context_filter.contexts(recipient_node)), donor_tree.index, rule_id)
+
+    def _compatible_ids(self, accepted, donor_index, rule_id, max_depth=inf):
+        # Ids of the donors of rule ``rule_id`` in a tree matching the
+        # ``accepted`` context signatures and the depth budget.
+        anc, left, right = self._rule_index.signatures(donor_index)
+        accepted_anc, accepted_left, accepted_right = (set(keys) for keys in accepted)
+        depths = donor_index.depths
+        return [donor_id for donor_id in donor_index.ids_by_rule.get(rule_id, ())
+                if depths[donor_id] <= max_depth and anc[donor_id] in accepted_anc and left[donor_id] in accepted_left and right[donor_id] in accepted_right]
+
+    # Fan-out selection: several mutants are created from one selected
+    # neighbourhood (see SynthFuzzGeneratorTool.create_many). The trees are
+    # selected and loaded once, and the generators below yield selections on
+    # new copies of them (made by SynthFuzzTree.clone, or clone_branch for
+    # donors), distinct ones first.
+    # Once every option was yielded, they are repeated: edits still bind the
+    # parameters of the donors anew.
+    def _copy_tree(self, tree, donor_id=None):
+        # Of donor trees, only the branch of the donor node is copied.
+        copy = tree.clone() if donor_id is None else tree.clone_branch(donor_id)
+        self._sources[copy.root] = copy.fn
+        return copy
+
+    def fanout_to_mutate(self, max_depth):
+        """
+        Endless counterpart of :meth:`select_to_mutate`: nodes of copies of a
+        single selected tree.
+        """
+        self.refresh()
+        tree = self._load_tree(self._random_individuals(n=1)[0])
+        # the root if nothing else can be mutated
+        options = self._filter_ids(tree.index, range(len(tree.nodes)), max_depth) or [0]
+        while True:
+            for node_id in random.sample(options, k=len(options)):
+                yield self._copy_tree(tree).nodes[node_id]
+
+    def fanout_to_recombine(self, max_depth):
+        """
+        Endless counterpart of :meth:`select_to_recombine`: node pairs of
+        copies of a single selected pair of trees.
+        """
+        for recipient_tree, recipient_id, donor_tree, donor_id in self._fanout_pairs(max_depth):
+            yield recipient_tree.nodes[recipient_id], donor_tree.nodes[donor_id]
+
+    def fanout_to_edit(self, max_depth):
+        """
+        Endless counterpart of :meth:`select_to_edit`: node pairs of copies of
+        a single selected pair of trees.
+        """
+        for recipient_tree, recipient_id, donor_tree, donor_id in self._fanout_pairs(max_depth):
+            yield recipient_tree.nodes[recipient_id], donor_tree.nodes[donor_id], donor_tree, donor_id
+
+    def _fanout_pairs(self, max_depth):
+        # The pair selected by _select_pair, then the other compatible pairs of
+        # the same two trees.
+        selection = self._select_pair(max_depth)
+        if selection is None:
+            return
+        recipient_tree, recipient_id, donor_tree, donor_id = selection
+        pairs = chain([(recipient_id, donor_id)],
+                      (pair for pair in self._compatible_pairs(recipient_tree.index, donor_tree.index, max_depth) if pair != (recipient_id, donor_id)))
+        for recipient_id, donor_id in cycle(pairs):
+            yield self._copy_tree(recipient_tree), recipient_id, self._copy_tree(donor_tree, donor_id), donor_id
+
+    def _compatible_pairs(self, recipient_index, donor_index, max_depth):
+        # The recipient nodes of the rules of the donor tree in random order,
+        # each with a random compatible donor (if any).
+        donor_rules = donor_index.rule_mask
+        options = self._filter_ids(
+            recipient_index,
+            (recipient_id for rule_id, recipient_ids in recipient_index.ids_by_rule.items() if donor_rules >> rule_id & 1 for recipient_id in recipient_ids),
+            max_depth,
+        )
+        for recipient_id in random.sample(options, k=len(options)):
+            accepted = self.context_filter.accepted_signatures(self.context_filter.index_contexts(recipient_index, recipient_id))
+            donor_ids = self._compatible_ids(accepted, donor_index, recipient_index.rule_ids[recipient_id], max_depth - recipient_index.levels[recipient_id])
+            if donor_ids:
+                yield recipient_id, random.choice(donor_ids)
+
+    def fanout_to_insert(self, max_depth):
+        """
+        Endless counterpart of :meth:`select_to_insert`: insertion sites of
+        copies of a single selected pair of trees. Without a site, every
+        selection is the same pair, to be searched by the generator.
+        """
+        selection = self._select_site(max_depth)
+        if selection is None:
+            pair = self._random_pair()
+            if pair is None:
+                return
+            recipient_tree, donor_tree = pair
+            while True:
+                yield self._copy_tree(recipient_tree), self._copy_tree(donor_tree), None
+
+        recipient_tree_id, donor_tree_id, site = selection
+        tree_fns = self._rule_index.tree_fns
+        recipient_tree, donor_tree = self._load_tree(tree_fns[recipient_tree_id]), self._load_tree(tree_fns[donor_tree_id])
+        sites = chain([site], (other for other in self._compatible_sites(recipient_tree_id, donor_tree.index, max_depth) if other != site))
+        for site in cycle(sites):
+            yield self._copy_tree(recipient_tree), self._copy_tree(donor_tree, site.donor_id), site
+
+    def _compatible_sites(self, recipient_tree_id, donor_index, max_depth):
+        # The insertion sites of a recipient tree for the rules of the donor
+        # tree in random order, each with a random compatible donor (if any).
+        rule_index = self._rule_index
+        sites, recipient_index = rule_index.tree_sites[recipient_tree_id], rule_index.tree_indexes[recipient_tree_id]
+        donor_rules = donor_index.rule_mask
+        options = [site for rule_id, site_ids in sites.by_rule.items() if donor_rules >> rule_id & 1 for site in site_ids]
+        for site in random.sample(options, k=len(options)):
+            parent_id = sites.parent_ids[site]
+            donor_ids = self._compatible_ids(self._site_signatures(recipient_index, sites, site), donor_index, sites.rule_ids[site], max_depth - recipient_index.levels[parent_id] - 1)
+            if donor_ids:
+                yield InsertionSite(parent_id=parent_id, position=sites.positions[site], word_id=sites.word_ids[site], donor_id=random.choice(donor_ids))
+
+    def add_individual(self, root, path=None):
+        # Parameter substitutions leave value nodes shared between positions
+        # of a mutant. Save a copy with the positions separated, so that every
+        # load of the tree agrees with its index (and with the paths of the
+        # edit log).
+        tree = SynthFuzzTree(root).clone()
+        # Named like by DefaultPopulation, but saved without the lookup tables of DefaultTree
+        path = basename(path).split('.')[0] if path else None
+        fn = join(self._directory, f'{path or type(self).__name__}.{uuid4().hex}.{self._extension}')
+        digest = tree.save(fn)
+        self._files.append(fn)
+        # Index the new tree once, when it enters the population.
+        index = tree.index
+        index.save(fn, digest)
+        self._rule_index.add(fn, index)
+        # Announce the tree to the other processes sharing the directory only
+        # when both the tree and its index are saved.
+        self._log.append(fn)
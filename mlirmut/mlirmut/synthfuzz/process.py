@@ -30,8 +30,16 @@ def execute():
                         help='default rule to start generation from (default: the first parser rule)')
     parser.add_argument('--lib', metavar='DIR',
                         help='alternative location of import grammars.')
+    parser.add_argument('--fast', default=False, action='store_true',
+                        help='emit the fast-path generator (same output for a given seed, without context-manager overhead).')
+    parser.add_argument('--token-level', default=False, action='store_true',
+                        help='generate every lexer rule as a single leaf node holding the text of the token.')
     parser.add_argument('--pep8', default=False, action='store_true',
                         help='enable autopep8 to format the generated fuzzer.')
+    parser.add_argument('--cache', metavar='DIR',
+                        help='reuse the outputs of earlier runs with the same grammars, options and processor from this directory (and store new ones there).')
+    parser.add_argument('--cache-link', default=False, action='store_true',
+                        help='symlink the cached outputs into the output directory instead of copying them.')
     parser.add_argument('-o', '--out', metavar='DIR', default=getcwd(),
                         help='temporary working directory (default: %(default)s).')
     add_encoding_argument(parser, help='grammar file encoding (default: %(default)s).')
@@ -56,7 +64,7 @@ def execute():
     init_logging()
     process_log_level_argument(args, logger)
 
-    ProcessorTool(args.language, args.out).process(args.grammar, options=options, default_rule=args.rule, encoding=args.encoding, errors=args.encoding_errors, lib_dir=args.lib, actions=args.actions, pep8=args.pep8)
+    ProcessorTool(args.language, args.out, fast=args.fast, token_level=args.token_level, cache_dir=args.cache, link=args.cache_link).process(args.grammar, options=options, default_rule=args.rule, encoding=args.encoding, errors=args.encoding_errors, lib_dir=args.lib, actions=args.actions, pep8=args.pep8)
 
 
 if __name__ == '__main__':
@@ -1,3 +1,4 @@
+import hashlib
 import logging
 import re
 import pickle
@@ -5,10 +6,10 @@ import pickle
 from collections import defaultdict, OrderedDict
 from itertools import chain
 from math import inf
-from os import getcwd
-from os.path import dirname, exists, join
+from os import getcwd, getpid, listdir, makedirs, remove, rename, symlink
+from os.path import abspath, basename, dirname, exists, isdir, join, lexists
 from pkgutil import get_data
-from shutil import copy
+from shutil import copy, rmtree
 from sys import maxunicode
 
 import autopep8
@@ -18,7 +19,9 @@ from jinja2 import Environment
 
 from grammarinator.pkgdata import __version__
 from grammarinator.tool.g4 import ANTLRv4Lexer, ANTLRv4Parser
-from mlirmut.synthfuzz.generator import QuantifierSpec, InsertMatchPattern
+from mlirmut.synthfuzz.insertion import Choice, InsertAutomaton, Literal, Repeat, Sequence, Symbol
+from mlirmut.synthfuzz.metadata import METADATA_NAME, dump_metadata
+from mlirmut.synthfuzz.rules import RULE_IDS_NAME
 
 logger = logging.getLogger(__name__)
 
@@ -376,10 +379,17 @@ class ProcessorTool(object):
     from them and create a generator class that is able to produce textual data
     according to the grammar files.
     """
-    def __init__(self, lang, work_dir=None):
+    def __init__(self, lang, work_dir=None, fast=False, token_level=False, cache_dir=None, link=False):
         """
         :param str lang: Language of the generated code (currently, only ``'py'`` is accepted as Python is the only supported language).
         :param str work_dir: Directory to generate fuzzers into (default: the current working directory).
+        :param bool fast: Emit the fast-path generator, which tracks the depth inline instead of with context managers
+               and dispatches alternatives from constant tables, but produces the same trees for a given seed.
+        :param bool token_level: Generate every lexer rule as a single leaf node holding the text of the token (built in a
+               local buffer), like the tokens of parsed trees, instead of one node per character or referenced lexer rule.
+        :param str cache_dir: Directory of processed grammars, keyed by a hash of the grammar files, the processing options,
+               the template and the processor (default: no caching). See :meth:`process`.
+        :param bool link: Symlink the cached outputs into ``work_dir`` instead of copying them.
         """
         self._lang = lang
         env = Environment(trim_blocks=True,
@@ -387,8 +397,12 @@ class ProcessorTool(object):
                           keep_trailing_newline=False)
         env.filters['substitute'] = lambda s, frm, to: re.sub(frm, to, str(s))
         env.filters['escape_string'] = escape_string
-        self._template = env.from_string(get_data(__package__, 'resources/codegen/GeneratorTemplate.' + lang + '.jinja').decode('utf-8'))
+        self._template_src = get_data(__package__, 'resources/codegen/' + ('FastGeneratorTemplate.' if fast else 'GeneratorTemplate.') + lang + '.jinja')
+        self._template = env.from_string(self._template_src.decode('utf-8'))
         self._work_dir = work_dir or getcwd()
+        self._token_level = token_level
+        self._cache_dir = cache_dir
+        self._link = link
 
     def process(self, grammars, *, options=None, default_rule=None, encoding='utf-8', errors='strict', lib_dir=None, actions=True, pep8=False):
         """
@@ -420,7 +434,31 @@ class ProcessorTool(object):
                predicates of the input grammar (snippets in ``{...}`` and ``{...}?`` form) are disregarded (i.e., no code is
                generated from them).
         :param bool pep8: Boolean to enable pep8 to beautify the generated fuzzer source.
+
+        If the tool has a cache directory, the outputs (the generator, ``graph.pkl``, ``insert_patterns.pkl`` and the
+        rule ids) are looked up by the hash of the grammar files (with their imports), the arguments, the template
+        and the processor code first, and are copied (or linked) from there instead of processing the grammars again.
         """
+        if not self._cache_dir:
+            self._process(grammars, options, default_rule, encoding, errors, lib_dir, actions, pep8)
+            return
+
+        key = self._cache_key(grammars, options=options, default_rule=default_rule, encoding=encoding, errors=errors,
+                              lib_dir=lib_dir, actions=actions, pep8=pep8)
+        entry = join(self._cache_dir, key)
+        if isdir(entry):
+            logger.info('Reusing processed grammar from %s', entry)
+            for grammar in grammars:
+                if not grammar.endswith('.g4'):
+                    copy(grammar, self._work_dir)
+            self._restore(entry)
+            return
+
+        outputs = self._process(grammars, options, default_rule, encoding, errors, lib_dir, actions, pep8)
+        self._store(entry, outputs)
+
+    def _process(self, grammars, options, default_rule, encoding, errors, lib_dir, actions, pep8):
+        # Returns the names of the output files written into the working directory.
         lexer_root, parser_root = None, None
 
         for grammar in grammars:
@@ -445,58 +483,154 @@ class ProcessorTool(object):
         with open(join(self._work_dir, "insert_patterns.pkl"), 'wb') as f:
             pickle.dump(insert_patterns, f)
 
-        src = self._template.render(graph=graph, version=__version__).lstrip()
-        with open(join(self._work_dir, graph.name + '.' + self._lang), 'w') as f:
+        # Stable rule ids for the SynthFuzz runtime: the rules in grammar order
+        with open(join(self._work_dir, RULE_IDS_NAME), 'wb') as f:
+            pickle.dump([rule.name for rule in graph.rules], f)
+
+        # The same, loadable without the processor classes
+        self.dump_metadata(graph, insert_patterns, join(self._work_dir, METADATA_NAME))
+
+        src = self._template.render(graph=graph, version=__version__, tokens=self._token_level).lstrip()
+        generator_fn = graph.name + '.' + self._lang
+        with open(join(self._work_dir, generator_fn), 'w') as f:
             if pep8:
                 src = autopep8.fix_code(src)
             f.write(src)
-    
+
+        return [generator_fn, 'graph.pkl', 'insert_patterns.pkl', RULE_IDS_NAME, METADATA_NAME]
+
+    def _cache_key(self, grammars, **kwargs):
+        h = hashlib.sha256()
+
+        def update(*items):
+            for item in items:
+                item = item if isinstance(item, bytes) else repr(item).encode('utf-8')
+                h.update(len(item).to_bytes(8, 'little'))
+                h.update(item)
+
+        update(__version__, self._lang, self._token_level, self._template_src)
+        # The outputs also depend on the code building and analyzing the graph and deriving the insert patterns.
+        update(get_data(__package__, 'processor.py'), get_data(__package__, 'insertion.py'), get_data(__package__, 'metadata.py'))
+        update(sorted((kwargs.pop('options') or {}).items()), sorted(kwargs.items()))
+        for grammar in grammars:
+            update(basename(grammar))
+            with open(grammar, 'rb') as f:
+                update(f.read())
+            if grammar.endswith('.g4'):
+                for imported in self._scan_imports(grammar, kwargs['lib_dir']):
+                    with open(imported, 'rb') as f:
+                        update(basename(imported), f.read())
+        return h.hexdigest()
+
+    @staticmethod
+    def _scan_imports(grammar, lib_dir):
+        # The grammars imported by ``grammar`` (transitively, in a stable order), found like _collect_imports does,
+        # but without parsing the grammars.
+        import_re = re.compile(r'^\s*import\s+([^;]+);', re.MULTILINE)
+        imports, work_list = [], [grammar]
+        while work_list:
+            current = work_list.pop(0)
+            with open(current, encoding='utf-8', errors='replace') as f:
+                text = f.read()
+            for match in import_re.finditer(text):
+                for delegate in match.group(1).split(','):
+                    # ``import A = B;`` imports B
+                    grammar_fn = delegate.split('=')[-1].strip() + '.g4'
+                    if lib_dir is not None and exists(join(lib_dir, grammar_fn)):
+                        grammar_fn = join(lib_dir, grammar_fn)
+                    else:
+                        grammar_fn = join(dirname(current), grammar_fn)
+                    if exists(grammar_fn) and grammar_fn not in imports:
+                        imports.append(grammar_fn)
+                        work_list.append(grammar_fn)
+        return imports
+
+    def _restore(self, entry):
+        for fn in listdir(entry):
+            dst = join(self._work_dir, fn)
+            if lexists(dst):
+                remove(dst)
+            if self._link:
+                symlink(abspath(join(entry, fn)), dst)
+            else:
+                copy(join(entry, fn), dst)
+
+    def _store(self, entry, outputs):
+        # Populate a private directory first and rename it into place, so that concurrent
+        # processors never see a partial entry.
+        makedirs(self._cache_dir, exist_ok=True)
+        tmp = f'{entry}.{getpid()}.tmp'
+        makedirs(tmp, exist_ok=True)
+        for fn in outputs:
+            copy(join(self._work_dir, fn), tmp)
+        try:
+            rename(tmp, entry)
+        except OSError:
+            # another processor stored the same entry meanwhile
+            rmtree(tmp, ignore_errors=True)
+            return
+        logger.info('Stored processed grammar in %s', entry)
+
+    @staticmethod
+    def dump_metadata(graph, insert_patterns, fn):
+        # The rule references and quantifiers of the rule bodies, up to the referred rules
+        children, quantifiers = {}, {}
+        for rule in graph.rules:
+            rule_children, rule_quantifiers = [], []
+            visited, stack = set(), list(reversed(rule.out_neighbours))
+            while stack:
+                node = stack.pop()
+                if node.id in visited:
+                    continue
+                visited.add(node.id)
+                if isinstance(node, RuleNode):
+                    if node.id not in rule_children:
+                        rule_children.append(node.id)
+                    continue
+                if isinstance(node, QuantifierNode):
+                    rule_quantifiers.append((node.idx, node.min, inf if node.max == 'inf' else node.max))
+                stack.extend(reversed(node.out_neighbours))
+            children[rule.id] = rule_children
+            quantifiers[rule.id] = sorted(rule_quantifiers)
+
+        dump_metadata(fn, grammar=graph.name, rules=[rule.name for rule in graph.rules],
+                      min_depths={rule.id: rule.min_depth for rule in graph.rules},
+                      quantifiers=quantifiers, children=children, insert_patterns=insert_patterns)
+
     def derive_insert_patterns(self, graph):
         parser_rules = [rule for rule in graph.rules if isinstance(rule, UnparserRuleNode)]
         print(f"# parser rules: {len(parser_rules)}")
-        def is_simple_quantifier(node: QuantifierNode):
-            return len(node.out_neighbours) == 1 and isinstance(node.out_neighbours[0], UnparserRuleNode)
-        def contains_quantifier(rule):
-            quantifiers = [node for node in rule.out_neighbours if isinstance(node, QuantifierNode)]
-            if not quantifiers:
-                return False
-            if all(is_simple_quantifier(node) for node in quantifiers):
-                return True
-            return False
-        parser_rules_with_quants = [rule for rule in parser_rules if contains_quantifier(rule)]
-        print(f"# parser rules with simple quantifiers: {len(parser_rules_with_quants)}")
-
-        # create a mapping from the rules inside the quantifiers back to the parent rule itself
-        # we need this to filter candidate locations by the parent node during mutation
-        insert_patterns = dict()
-        for rule in parser_rules_with_quants:
-            match_pattern = list()
-            child_rules = set()
-            valid_rule = True
-            for child in rule.out_neighbours:
+
+        def expression(nodes):
+            # the children of a rule node as a regular expression over the child rules and literals
+            items = []
+            for child in nodes:
                 if isinstance(child, QuantifierNode):
-                    # TODO handle complex quantifier patterns
-                    child_rule = child.out_neighbours[0]
-                    if not isinstance(child_rule, UnparserRuleNode):
-                        print(rule.name)
-                        raise ValueError(f"Quantifier pattern expected to contain a rule, but found {type(child_rule)}")
-                    match_pattern.append(QuantifierSpec(min=child.min, max=child.max if child.max != 'inf' else inf, rule_name=child_rule.name))
-                    child_rules.add(child_rule.name)
-                elif isinstance(child, UnparserRuleNode):
-                    match_pattern.append(child.name)
-                elif isinstance(child, UnlexerRuleNode):
-                    match_pattern.append(child.name)
+                    items.append(Repeat(min=child.min, max=child.max if child.max != 'inf' else inf, body=expression(child.out_neighbours)))
+                elif isinstance(child, (UnparserRuleNode, UnlexerRuleNode)):
+                    items.append(Symbol(child.name))
                 elif isinstance(child, LiteralNode):
-                    match_pattern.append(child.src)
+                    items.append(Symbol(Literal(child.src)))
                 elif isinstance(child, AlternationNode):
-                    # TODO handle alternation nodes
-                    valid_rule = False
-                    break
+                    items.append(Choice(tuple(expression(alternative.out_neighbours) for alternative in child.out_neighbours)))
+                elif isinstance(child, (LambdaNode, ActionNode, VariableNode)):
+                    # no node in the tree
+                    continue
                 else:
-                    print(rule.name)
                     raise ValueError(f"Unexpected node type: {type(child)}")
-            if valid_rule:
-                insert_patterns[rule.name] = InsertMatchPattern(match_pattern, child_rules)
+            return Sequence(tuple(items))
+
+        # compile the body of every rule with a quantified part that a donor node can be inserted into
+        insert_patterns = dict()
+        for rule in parser_rules:
+            try:
+                automaton = InsertAutomaton.compile(expression(rule.out_neighbours))
+            except ValueError as e:
+                print(f"{rule.name}: {e}")
+                continue
+            if automaton.words:
+                insert_patterns[rule.name] = automaton
+        print(f"# parser rules with insert patterns: {len(insert_patterns)}")
         return insert_patterns
 
     def _parse_grammar(self, grammar, encoding, errors, lib_dir):
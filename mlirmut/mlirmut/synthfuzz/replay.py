@@ -0,0 +1,66 @@
+import codecs
+
+from argparse import ArgumentParser
+from os import makedirs
+from os.path import abspath, dirname, isdir
+
+from inators.arg import add_log_level_argument, add_sys_path_argument, add_sys_recursion_limit_argument, add_version_argument, process_log_level_argument, process_sys_path_argument, process_sys_recursion_limit_argument
+from inators.imp import import_object
+
+from grammarinator.cli import add_encoding_argument, add_encoding_errors_argument, init_logging, logger
+from mlirmut.pkgdata import __version__
+from mlirmut.synthfuzz.editlog import EditLogReader, replay
+
+
+def execute():
+    parser = ArgumentParser(description='SynthFuzz: Replay', epilog="""
+        The tool rebuilds test cases from the edit log written by
+        mlirmut.synthfuzz.generate (--edit-log) and the population the tests
+        were created from.
+        """)
+    parser.add_argument('edit_log', metavar='DIR',
+                        help='edit log directory.')
+    parser.add_argument('index', nargs='*', type=int,
+                        help='indices of the test cases to rebuild (default: all logged test cases).')
+    parser.add_argument('--population', metavar='DIR', required=True,
+                        help='directory of the tree pool used (and grown, with --keep-trees) during generation.')
+    parser.add_argument('-s', '--serializer', metavar='NAME',
+                        help='reference to a seralizer (in package.module.function format) that takes a tree and produces a string from it.')
+    parser.add_argument('-o', '--out', metavar='FILE', default='',
+                        help='output file name pattern with a %%d placeholder for the index of the test case '
+                             '(default: print the test cases to the stdout).')
+    add_encoding_argument(parser, help='output file encoding (default: %(default)s).')
+    add_encoding_errors_argument(parser)
+    add_sys_path_argument(parser)
+    add_sys_recursion_limit_argument(parser)
+    add_log_level_argument(parser, short_alias=())
+    add_version_argument(parser, version=__version__)
+    args = parser.parse_args()
+
+    init_logging()
+    process_log_level_argument(args, logger)
+    process_sys_path_argument(args)
+    process_sys_recursion_limit_argument(args)
+    if not isdir(args.edit_log):
+        parser.error('Edit log must point to an existing directory.')
+    if not isdir(args.population):
+        parser.error('Population must point to an existing directory.')
+    serializer = import_object(args.serializer) if args.serializer else str
+    if args.out:
+        makedirs(abspath(dirname(args.out)), exist_ok=True)
+
+    with EditLogReader(args.edit_log) as edit_log:
+        for index in args.index or edit_log.indices():
+            if index not in edit_log:
+                logger.warning('Test case #%d is not in the edit log.', index)
+                continue
+            test = serializer(replay(edit_log[index], args.population))
+            if args.out:
+                with codecs.open(args.out % index if '%d' in args.out else args.out, 'w', args.encoding, args.encoding_errors) as f:
+                    f.write(test)
+            else:
+                print(test)
+
+
+if __name__ == '__main__':
+    execute()
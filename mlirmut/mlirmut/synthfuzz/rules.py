@@ -0,0 +1,80 @@
+import pickle
+
+RULE_IDS_NAME = 'rule_ids.pkl'
+
+
+class RuleTable:
+    """
+    Interning table of rule names. The SynthFuzz runtime refers to rules by
+    small integer ids (positions in ``names``) and to sets of rules by
+    bitsets (ints with bit ``i`` set for rule ``i``), so that the lookups of
+    the mutation loop compare ints instead of strings.
+
+    Id 0 is ``None``, the name of literal token nodes. The table is seeded
+    with the rule-id table emitted by ``ProcessorTool`` (see :meth:`load`),
+    i.e., the rules of the grammar get stable ids in grammar order; any other
+    name is interned on first use. Ids are only meaningful within a process:
+    structures that persist ids (tree indexes, population snapshots) store
+    the names along with them, and pickling the process-wide table
+    (:data:`RULES`) merges it into the table of the receiving process.
+    """
+    def __init__(self, names=()):
+        self.names = [None]
+        self._ids = {None: 0}
+        self.update(names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __reduce__(self):
+        if self is RULES:
+            return shared_rule_table, (tuple(self.names),)
+        return RuleTable, (tuple(self.names[1:]),)
+
+    def id(self, name):
+        """
+        Id of rule ``name``, interned if it is not in the table yet.
+        """
+        rule_id = self._ids.get(name)
+        if rule_id is None:
+            rule_id = self._ids[name] = len(self.names)
+            self.names.append(name)
+        return rule_id
+
+    def update(self, names):
+        for name in names:
+            self.id(name)
+
+    def mask(self, names):
+        """
+        Bitset of the rules ``names``.
+        """
+        mask = 0
+        for name in names:
+            mask |= 1 << self.id(name)
+        return mask
+
+    def load(self, fn):
+        """
+        Intern the rule names of a rule-id table file (a pickled list of names)
+        in order.
+        """
+        with open(fn, 'rb') as f:
+            self.update(pickle.load(f))
+
+
+# The table of the process.
+RULES = RuleTable()
+
+
+def shared_rule_table(names):
+    """
+    Unpickle the table of another process: merge its names into :data:`RULES`.
+    The ids have to agree, which holds as long as nothing is interned in the
+    receiving process before the table arrives (e.g., in a spawned worker).
+    """
+    for rule_id, name in enumerate(names):
+        if RULES.id(name) != rule_id:
+            raise ValueError(f'Rule id of {name!r} differs between processes.')
+    return RULES
+
@@ -0,0 +1,200 @@
+import mmap
+import os
+import pickle
+import struct
+from array import array
+from dataclasses import dataclass
+
+from .rules import RULES
+from .tree import CompactTree, TreeIndex, rule_mask
+
+# magic, version, offset and length of the pickled metadata
+HEADER = struct.Struct('<4sIQQ')
+MAGIC = b'SFPS'
+VERSION = 3
+
+# Per-tree arrays of a snapshot and their type codes: the arrays of the
+# CompactTree and of its TreeIndex, and the context signatures. Rule ids are
+# those of the writing process, whose rule table is saved with the snapshot.
+# ``by_rule`` lists the node ids grouped by rule and ``rule_groups`` holds
+# (rule id, end of the group in ``by_rule``) pairs.
+FIELDS = (
+    ('rule_ids', 'H'),
+    ('kinds', 'B'),
+    ('src_ends', 'q'),
+    ('srcs', 'B'),
+    ('parents', 'i'),
+    ('prev_siblings', 'i'),
+    ('next_siblings', 'i'),
+    ('levels', 'i'),
+    ('depths', 'i'),
+    ('ends', 'i'),
+    ('text_hashes', 'q'),
+    ('text_lengths', 'q'),
+    ('anc_signatures', 'q'),
+    ('left_signatures', 'q'),
+    ('right_signatures', 'q'),
+    ('by_rule', 'i'),
+    ('rule_groups', 'i'),
+)
+
+
+@dataclass(slots=True)
+class SnapshotTree:
+    """
+    Location of the arrays of a tree in a snapshot file: (offset, item count)
+    pairs in the order of :data:`FIELDS`.
+    """
+    fn: str
+    size: int
+    # see CompactTree.classes
+    classes: tuple
+    fields: tuple
+
+
+def write_snapshot(path, trees, context_filter):
+    """
+    Write the ``trees`` (pairs of population file names and
+    :class:`CompactTree` objects) to a snapshot file, together with their
+    indexes and the context signatures computed by ``context_filter``.
+    """
+    entries = []
+    with open(path, 'wb') as f:
+        f.write(bytes(HEADER.size))
+        for fn, tree in trees:
+            index = tree.index
+            by_rule = array('i')
+            rule_groups = array('i')
+            for rule_id, ids in index.ids_by_rule.items():
+                by_rule.extend(ids)
+                rule_groups.extend((rule_id, len(by_rule)))
+            anc, left, right = context_filter.signatures(index)
+            values = {
+                'rule_ids': index.rule_ids, 'kinds': tree.kinds, 'src_ends': tree.src_ends, 'srcs': array('B', tree.srcs),
+                'parents': index.parents, 'prev_siblings': index.prev_siblings, 'next_siblings': index.next_siblings,
+                'levels': index.levels, 'depths': index.depths, 'ends': index.ends,
+                'text_hashes': index.text_hashes, 'text_lengths': index.text_lengths,
+                'anc_signatures': anc, 'left_signatures': left, 'right_signatures': right,
+                'by_rule': by_rule, 'rule_groups': rule_groups,
+            }
+            fields = []
+            for field, typecode in FIELDS:
+                data = array(typecode, values[field])
+                # keep every array aligned to 8 bytes
+                f.write(bytes(-f.tell() % 8))
+                fields.append((f.tell(), len(data)))
+                data.tofile(f)
+            entries.append(SnapshotTree(fn=fn, size=len(index), classes=tree.classes, fields=tuple(fields)))
+
+        meta_offset = f.tell()
+        meta = pickle.dumps((list(RULES.names), entries), protocol=pickle.HIGHEST_PROTOCOL)
+        f.write(meta)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, meta_offset, len(meta)))
+
+
+class PopulationSnapshot:
+    """
+    Read-only, memory-mapped view of a snapshot file written by
+    :func:`write_snapshot`. The arrays of the compact trees and of their
+    indexes are memoryviews of the mapping, so every process attaching the
+    same file shares one copy of them in the page cache. The rule ids of the
+    snapshot are used as they are if they agree with the rule table of the
+    process (e.g., in the workers of the writing process), otherwise they are
+    translated to private arrays.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, meta_offset, meta_length = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'Not a population snapshot: {path}')
+        names, self._trees = pickle.loads(self._mmap[meta_offset:meta_offset + meta_length])
+        self._rules = [RULES.id(name) for name in names]
+        self._translate = self._rules != list(range(len(names)))
+        self._tree_ids = {entry.fn: tree_id for tree_id, entry in enumerate(self._trees)}
+        self._compacts = [None] * len(self._trees)
+        self._signatures = [None] * len(self._trees)
+
+    def __getstate__(self):
+        # the file is mapped again by the receiving process
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def __len__(self):
+        return len(self._trees)
+
+    @property
+    def tree_fns(self):
+        return [entry.fn for entry in self._trees]
+
+    def tree_id(self, fn):
+        return self._tree_ids.get(fn)
+
+    def _arrays(self, tree_id):
+        view = memoryview(self._mmap)
+        return {field: view[offset:offset + length * array(typecode).itemsize].cast(typecode)
+                for (field, typecode), (offset, length) in zip(FIELDS, self._trees[tree_id].fields)}
+
+    def compact(self, tree_id):
+        """
+        :class:`CompactTree` of a snapshot tree, backed by the mapping.
+        """
+        compact = self._compacts[tree_id]
+        if compact is None:
+            arrays = self._arrays(tree_id)
+            rules = self._rules
+            rule_ids = arrays['rule_ids']
+            if self._translate:
+                rule_ids = array('H', (rules[rule_id] for rule_id in rule_ids))
+            ids_by_rule = {}
+            start = 0
+            groups = arrays['rule_groups']
+            by_rule = arrays['by_rule']
+            for i in range(0, len(groups), 2):
+                ids_by_rule[rules[groups[i]]] = by_rule[start:groups[i + 1]]
+                start = groups[i + 1]
+            index = TreeIndex(
+                version=TreeIndex.VERSION, rule_ids=rule_ids,
+                parents=arrays['parents'], prev_siblings=arrays['prev_siblings'], next_siblings=arrays['next_siblings'],
+                levels=arrays['levels'], depths=arrays['depths'], ends=arrays['ends'],
+                text_hashes=arrays['text_hashes'], text_lengths=arrays['text_lengths'],
+                ids_by_rule=ids_by_rule, rule_mask=rule_mask(ids_by_rule))
+            compact = self._compacts[tree_id] = CompactTree(index=index, classes=self._trees[tree_id].classes,
+                                                            kinds=arrays['kinds'], src_ends=arrays['src_ends'], srcs=arrays['srcs'])
+            if not self._translate:
+                # hashes of contexts of the rule ids of the writing process
+                self._signatures[tree_id] = (arrays['anc_signatures'], arrays['left_signatures'], arrays['right_signatures'])
+        return compact
+
+    def index(self, tree_id):
+        """
+        :class:`TreeIndex` of a snapshot tree, backed by the mapping.
+        """
+        return self.compact(tree_id).index
+
+    def signatures(self, tree_id):
+        """
+        Context signatures of the nodes of a snapshot tree (see
+        :meth:`~mlirmut.synthfuzz.population.ContextFilter.signatures`), or
+        ``None`` if the rule ids of the snapshot had to be translated.
+        """
+        self.compact(tree_id)
+        return self._signatures[tree_id]
+
+    def tree(self, tree_id):
+        """
+        Build a new copy of a snapshot tree.
+        """
+        return self.compact(tree_id).to_tree(fn=self._trees[tree_id].fn)
+
+
+def snapshot_dir():
+    """
+    Directory for snapshot files: the shared memory file system if there is
+    one, so that the mapping is never written back to disk.
+    """
+    return '/dev/shm' if os.path.isdir('/dev/shm') else None
@@ -0,0 +1,106 @@
+import random
+from math import inf
+
+# Width of the depth buckets of a SubtreePool.
+DEPTH_BUCKET = 4
+
+
+def flatten(root):
+    """
+    Flatten the subtree of ``root`` into a tuple of (node class, parent
+    position, attributes) triplets in preorder.
+    """
+    flat, stack = [], [(root, -1)]
+    while stack:
+        node, parent_id = stack.pop()
+        flat.append((type(node), parent_id, {name: value for name, value in node.__dict__.items() if name not in ('parent', 'children')}))
+        stack.extend((child, len(flat) - 1) for child in reversed(node.children))
+    return tuple(flat)
+
+
+def unflatten(flat):
+    """
+    Build a new copy of a subtree flattened by :func:`flatten`.
+
+    :return: The root of the copy.
+    """
+    new = object.__new__
+    nodes = []
+    for node_class, parent_id, attrs in flat:
+        node = new(node_class)
+        node.__dict__.update(attrs)
+        parent = nodes[parent_id] if parent_id >= 0 else None
+        node.parent = parent
+        node.children = []
+        if parent is not None:
+            parent.children.append(node)
+        nodes.append(node)
+    return nodes[0]
+
+
+class SubtreePool:
+    """
+    Subtrees generated from grammar for
+    :meth:`~mlirmut.synthfuzz.generator.SynthFuzzGeneratorTool.mutate`, pooled
+    by rule and depth bucket. The subtrees of a bucket are generated with the
+    smallest depth budget of the bucket (but not below the minimum depth of
+    the rule), so they fit into every budget of the bucket. A draw picks a
+    random subtree of the pool and returns a new copy of it.
+
+    Pools are refilled on demand: while a pool holds fewer than ``size``
+    subtrees, every draw generates a new one, and a subtree is evicted once it
+    was drawn ``reuse`` times, so the pools keep turning over. Subtrees are
+    kept flattened (see :func:`flatten`) instead of as :class:`CompactTree`
+    objects, whose index would cost more to build than the subtree itself.
+    """
+    def __init__(self, generate, min_depth, size, reuse):
+        """
+        :param generate: Callable generating the root of a new subtree of a
+            rule within a depth budget: ``generate(rule, max_depth)``.
+        :param min_depth: Callable returning the minimum depth of a rule.
+        """
+        self._generate = generate
+        self._min_depth = min_depth
+        self.size = size
+        self.reuse = reuse
+        # (rule, depth budget) -> list of [flattened subtree, remaining draws]
+        self._pools = {}
+
+    def _key(self, rule, max_depth):
+        depth = max_depth if max_depth == inf else max_depth - max_depth % DEPTH_BUCKET
+        # if the rule does not fit into the budget, generation fails as without a pool
+        return rule, max(depth, min(self._min_depth(rule), max_depth))
+
+    def _new_entry(self, key):
+        rule, depth = key
+        return [flatten(self._generate(rule, depth)), self.reuse]
+
+    def draw(self, rule, max_depth):
+        """
+        Return a new copy of a pooled subtree of ``rule`` that fits into the
+        depth budget ``max_depth``.
+        """
+        key = self._key(rule, max_depth)
+        pool = self._pools.setdefault(key, [])
+        if len(pool) < self.size:
+            entry = self._new_entry(key)
+            pool.append(entry)
+        else:
+            entry = random.choice(pool)
+        entry[1] -= 1
+        if entry[1] <= 0:
+            pool.remove(entry)
+        return unflatten(entry[0])
+
+    def fill(self, keys):
+        """
+        Fill the pools up front for the (rule, depth budget) pairs ``keys``.
+        """
+        # sorted, so that a seeded fill is reproducible
+        for key in sorted({self._key(rule, max_depth) for rule, max_depth in keys}):
+            pool = self._pools.setdefault(key, [])
+            while len(pool) < self.size:
+                pool.append(self._new_entry(key))
+
+    def __len__(self):
+        return sum(len(pool) for pool in self._pools.values())
@@ -0,0 +1,18 @@
+# Nodes are compared by a polynomial hash of their UTF-8 encoded text (i.e., of
+# ``str(node)``) modulo a Mersenne prime. The hash of a concatenation follows
+# from the hashes and lengths of its parts, so subtree hashes are computed
+# bottom-up in a single pass, without building the text of any subtree (see
+# :func:`~mlirmut.synthfuzz.tree.text_hashes`).
+TEXT_HASH_MODULUS = (1 << 61) - 1
+TEXT_HASH_BASE = 1_000_003
+
+
+def token_hash(src):
+    """
+    Text hash and text length (in bytes) of a token with text ``src``.
+    """
+    data = src.encode('utf-8', errors='surrogatepass')
+    token_hash = 0
+    for byte in data:
+        token_hash = (token_hash * TEXT_HASH_BASE + byte) % TEXT_HASH_MODULUS
+    return token_hash, len(data)
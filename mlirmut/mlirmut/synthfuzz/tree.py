@@ -0,0 +1,458 @@
+import hashlib
+import os
+import pickle
+from array import array
+from dataclasses import dataclass, fields
+from itertools import chain
+
+from grammarinator.runtime.rule import UnlexerRule
+from grammarinator.tool.default_population import DefaultTree
+
+from .rules import RULES
+from .texthash import TEXT_HASH_BASE, TEXT_HASH_MODULUS, token_hash
+
+
+def preorder(root, parents=None):
+    """
+    List the nodes of the tree rooted at ``root`` in pre-order. The position of
+    a node in this list is its id in :class:`TreeIndex`. If ``parents`` is
+    given, the id of the parent of every listed node is appended to it (-1 for
+    the root). Parents are taken from the traversal and not from the
+    ``parent`` fields, so nodes that are shared between multiple positions of
+    the tree are listed (and later copied) once for each position.
+    """
+    nodes = []
+    stack = [(root, -1)]
+    while stack:
+        node, parent_id = stack.pop()
+        if parents is not None:
+            parents.append(parent_id)
+        node_id = len(nodes)
+        nodes.append(node)
+        if node.children:
+            stack.extend((child, node_id) for child in reversed(node.children))
+    return nodes
+
+
+def text_hashes(nodes, parents):
+    """
+    Compute the text hash and the text length (in bytes) of every node of a
+    tree listed by :func:`preorder`.
+
+    :return: Arrays of hashes and lengths indexed by node id.
+    """
+    hashes = array('q', [0]) * len(nodes)
+    lengths = array('q', [0]) * len(nodes)
+    token_hashes = {}
+    # In reverse pre-order, children are visited right to left before their
+    # parent, so the hash of the parent is accumulated from the right.
+    for i in range(len(nodes) - 1, -1, -1):
+        node = nodes[i]
+        if isinstance(node, UnlexerRule) and node.src:
+            token = token_hashes.get(node.src)
+            if token is None:
+                token = token_hashes[node.src] = token_hash(node.src)
+            hashes[i], lengths[i] = token
+        parent_id = parents[i]
+        if parent_id >= 0:
+            hashes[parent_id] = (hashes[i] * pow(TEXT_HASH_BASE, lengths[parent_id], TEXT_HASH_MODULUS) + hashes[parent_id]) % TEXT_HASH_MODULUS
+            lengths[parent_id] += lengths[i]
+    return hashes, lengths
+
+
+def load_root(fn):
+    """
+    Load the root of the tree stored in ``fn``, which holds either the bare
+    root (see :meth:`SynthFuzzTree.save`) or a pickled
+    :class:`~grammarinator.tool.default_population.DefaultTree` (e.g., a seed
+    tree of ``grammarinator-parse``).
+
+    :return: The root and the digest of the file (see :func:`tree_digest`).
+    """
+    with open(fn, 'rb') as f:
+        data = f.read()
+    tree = pickle.loads(data)
+    return (tree.root if isinstance(tree, DefaultTree) else tree), tree_digest(data)
+
+
+def tree_digest(data):
+    """
+    Digest of the contents of a tree file, which ties a saved
+    :class:`TreeIndex` to the version of the tree it was built from.
+    """
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def rule_mask(rule_ids):
+    mask = 0
+    for rule_id in rule_ids:
+        mask |= 1 << rule_id
+    return mask
+
+
+@dataclass(slots=True)
+class TreeIndex:
+    """
+    Compact, structure-only index of a population tree. Nodes are referred to
+    by their pre-order id, so the same index describes every copy of the tree.
+    The index is computed once when a tree enters the population and is saved
+    next to the tree file along with the digest of the file (see :meth:`save`),
+    so that it is not used for another tree saved under the same name. Rules are referred to by their
+    ids in :data:`~mlirmut.synthfuzz.rules.RULES`.
+    """
+    VERSION = 5
+
+    version: int
+    rule_ids: array
+    parents: array
+    prev_siblings: array
+    next_siblings: array
+    levels: array
+    depths: array
+    # id after the last node of the subtree of each node
+    ends: array
+    # see text_hashes
+    text_hashes: array
+    text_lengths: array
+    ids_by_rule: dict
+    # bitset of the rules of the tree
+    rule_mask: int
+
+    @classmethod
+    def build(cls, root):
+        parents = array('i')
+        nodes = preorder(root, parents)
+        levels = array('i', [0]) * len(nodes)
+        for i in range(1, len(nodes)):
+            levels[i] = levels[parents[i]] + 1
+        depths = array('i', [0]) * len(nodes)
+        ends = array('i', range(1, len(nodes) + 1))
+        for i in range(len(nodes) - 1, 0, -1):
+            if depths[parents[i]] < depths[i] + 1:
+                depths[parents[i]] = depths[i] + 1
+            if ends[parents[i]] < ends[i]:
+                ends[parents[i]] = ends[i]
+        # Children are listed in order in pre-order, so the previous child seen
+        # with the same parent is the left sibling.
+        prev_siblings = array('i', [-1]) * len(nodes)
+        next_siblings = array('i', [-1]) * len(nodes)
+        last_child = {}
+        for i in range(1, len(nodes)):
+            prev_id = last_child.get(parents[i], -1)
+            if prev_id >= 0:
+                prev_siblings[i] = prev_id
+                next_siblings[prev_id] = i
+            last_child[parents[i]] = i
+
+        hashes, lengths = text_hashes(nodes, parents)
+
+        rule_id = RULES.id
+        rule_ids = array('H', (rule_id(node.name) for node in nodes))
+        ids_by_rule = {}
+        for i, node_rule_id in enumerate(rule_ids):
+            ids_by_rule.setdefault(node_rule_id, array('i')).append(i)
+        return cls(version=cls.VERSION, rule_ids=rule_ids, parents=parents,
+                   prev_siblings=prev_siblings, next_siblings=next_siblings, levels=levels, depths=depths, ends=ends,
+                   text_hashes=hashes, text_lengths=lengths,
+                   ids_by_rule=ids_by_rule, rule_mask=rule_mask(ids_by_rule))
+
+    def __len__(self):
+        return len(self.rule_ids)
+
+    def __getstate__(self):
+        # Rule ids are local to the process, so they are pickled (and saved)
+        # as positions in the list of the names of the rules of the tree.
+        state = {field.name: getattr(self, field.name) for field in fields(self)}
+        rules = list(self.ids_by_rule)
+        local_ids = {rule_id: i for i, rule_id in enumerate(rules)}
+        state['rules'] = [RULES.names[rule_id] for rule_id in rules]
+        state['rule_ids'] = array('H', (local_ids[rule_id] for rule_id in self.rule_ids))
+        state['ids_by_rule'] = [self.ids_by_rule[rule_id] for rule_id in rules]
+        del state['rule_mask']
+        return state
+
+    def __setstate__(self, state):
+        rules = [RULES.id(name) for name in state.pop('rules')]
+        state['rule_ids'] = array('H', (rules[i] for i in state['rule_ids']))
+        state['ids_by_rule'] = dict(zip(rules, state['ids_by_rule']))
+        state['rule_mask'] = rule_mask(state['ids_by_rule'])
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+    @staticmethod
+    def path(tree_fn):
+        return f'{tree_fn}.idx'
+
+    @classmethod
+    def load(cls, tree_fn, digest=None):
+        """
+        Load the index of the tree stored in ``tree_fn``. Returns ``None`` if
+        the index is missing, outdated, or was built for other contents of the
+        tree file.
+
+        :param bytes digest: Digest of the tree file (see :func:`tree_digest`),
+            if it is already known (default: computed from the file).
+        """
+        try:
+            with open(cls.path(tree_fn), 'rb') as f:
+                saved_digest, index = pickle.load(f)
+            if digest is None:
+                with open(tree_fn, 'rb') as f:
+                    digest = tree_digest(f.read())
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, TypeError, ValueError):
+            return None
+        if not isinstance(index, cls) or index.version != cls.VERSION or saved_digest != digest:
+            return None
+        return index
+
+    def save(self, tree_fn, digest):
+        """
+        Save the index next to the tree file ``tree_fn`` with ``digest``, the
+        digest of the file (see :func:`tree_digest`).
+        """
+        # Write to a temporary file first so that concurrent readers never see
+        # a partial index.
+        fn = self.path(tree_fn)
+        tmp_fn = f'{fn}.{os.getpid()}.tmp'
+        with open(tmp_fn, 'wb') as f:
+            pickle.dump((digest, self), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_fn, fn)
+
+
+class SynthFuzzTree(DefaultTree):
+    """
+    Population tree backed by a :class:`TreeIndex`. ``nodes`` lists the nodes
+    of the tree in pre-order, i.e., ``nodes[i]`` is the node with id ``i`` in
+    ``index``. The ``nodes_by_name``, ``node_levels`` and ``node_depths``
+    lookup tables of :class:`DefaultTree` are not populated, and they are not
+    saved either: tree files hold the bare root.
+    """
+
+    def __init__(self, root, index=None, nodes=None, fn=None):
+        super().__init__(root)
+        self.index = index or TreeIndex.build(root)
+        self.nodes = nodes or preorder(root)
+        # the population file the tree (or the tree it was cloned from) was loaded from
+        self.fn = fn
+
+    @classmethod
+    def load(cls, fn, index=None, save_index=True):
+        """
+        Load the tree stored in ``fn`` together with its index (unless an
+        already loaded ``index`` is given). If the index is missing or outdated,
+        it is rebuilt, and saved unless ``save_index`` is disabled (e.g., for
+        read-only uses of a population).
+        """
+        root, digest = load_root(fn)
+        nodes = preorder(root)
+        index = index or TreeIndex.load(fn, digest)
+        if index is None or len(index) != len(nodes):
+            index = TreeIndex.build(root)
+            if save_index:
+                index.save(fn, digest)
+        return cls(root, index=index, nodes=nodes, fn=fn)
+
+    def save(self, fn):
+        """
+        Save the bare root of the tree into ``fn``.
+
+        :return: The digest of the file (see :func:`tree_digest`).
+        """
+        data = pickle.dumps(self.root, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(fn, 'wb') as f:
+            f.write(data)
+        return tree_digest(data)
+
+    def clone(self):
+        """
+        Copy the nodes of the tree without going through :func:`copy.deepcopy`
+        or pickle. Node attributes (name, src, ...) are shallow-copied, only the
+        parent/children links are rebuilt. The index is shared with the copy.
+        """
+        new = object.__new__
+        copies = []
+        for node, parent_id in zip(self.nodes, self.index.parents):
+            node_copy = new(node.__class__)
+            attrs = node_copy.__dict__
+            attrs.update(node.__dict__)
+            attrs['children'] = []
+            if parent_id >= 0:
+                parent = copies[parent_id]
+                attrs['parent'] = parent
+                parent.children.append(node_copy)
+            else:
+                attrs['parent'] = None
+            copies.append(node_copy)
+        return SynthFuzzTree(copies[0], index=self.index, nodes=copies, fn=self.fn)
+
+    def clone_branch(self, node_id):
+        """
+        Same as :meth:`clone`, but only the subtree of node ``node_id`` and the
+        ancestors of the node are copied, e.g., for donor trees, where nothing
+        else is changed. The other nodes are shared with this tree: they are
+        children of the copied ancestors, but their parent links still lead
+        to the original ones, so they must be left intact.
+        """
+        index = self.index
+        parents = index.parents
+        ancestor_ids = []
+        ancestor_id = parents[node_id]
+        while ancestor_id >= 0:
+            ancestor_ids.append(ancestor_id)
+            ancestor_id = parents[ancestor_id]
+        ancestor_ids.reverse()
+        new = object.__new__
+        copies = list(self.nodes)
+        for copy_id in chain(ancestor_ids, range(node_id, index.ends[node_id])):
+            node = copies[copy_id]
+            node_copy = new(node.__class__)
+            attrs = node_copy.__dict__
+            attrs.update(node.__dict__)
+            parent_id = parents[copy_id]
+            if parent_id < 0:
+                attrs['parent'] = None
+            else:
+                parent = copies[parent_id]
+                attrs['parent'] = parent
+                if copy_id <= node_id:
+                    # the copied ancestors (and the subtree root) take the place
+                    # of the originals, found by position as nodes may be shared
+                    position = 0
+                    sibling_id = index.prev_siblings[copy_id]
+                    while sibling_id >= 0:
+                        position += 1
+                        sibling_id = index.prev_siblings[sibling_id]
+                    parent.children[position] = node_copy
+                else:
+                    parent.children.append(node_copy)
+            attrs['children'] = list(node.children) if copy_id < node_id else []
+            copies[copy_id] = node_copy
+        return SynthFuzzTree(copies[0], index=self.index, nodes=copies, fn=self.fn)
+
+
+# How the src of a node is stored in a CompactTree: nodes with no src
+# attribute (e.g., UnparserRule), src set to None, src text.
+NO_SRC, NONE_SRC, TEXT_SRC = range(3)
+
+
+@dataclass(slots=True)
+class CompactTree:
+    """
+    Array-backed representation of a population tree. The structure (rules,
+    parents and the id range of the subtree of every node, which gives the
+    children) is the :class:`TreeIndex` of the tree; the node classes and the
+    token texts are kept in flat arrays. A compact tree takes a small fraction
+    of the memory of its :class:`~grammarinator.runtime.Rule` objects and can
+    be traversed by node id; Rule nodes are only built (by :meth:`to_tree`)
+    when a tree is handed out for mutation or serialization.
+    """
+    index: TreeIndex
+    # distinct (node class, src kind) pairs of the tree
+    classes: tuple
+    # position of the class of each node in ``classes``
+    kinds: array
+    # the UTF-8 encoded src of node i is srcs[src_ends[i - 1]:src_ends[i]]
+    src_ends: array
+    srcs: bytes
+
+    @classmethod
+    def from_tree(cls, tree):
+        classes = {}
+        kinds = array('B')
+        src_ends = array('q')
+        srcs = bytearray()
+        for node in tree.nodes:
+            src = node.__dict__.get('src', NO_SRC)
+            if src is NO_SRC:
+                src_kind = NO_SRC
+            elif src is None:
+                src_kind = NONE_SRC
+            else:
+                src_kind = TEXT_SRC
+                srcs += src.encode('utf-8', errors='surrogatepass')
+            kinds.append(classes.setdefault((node.__class__, src_kind), len(classes)))
+            src_ends.append(len(srcs))
+        return cls(index=tree.index, classes=tuple(classes), kinds=kinds, src_ends=src_ends, srcs=bytes(srcs))
+
+    def children(self, node_id):
+        """
+        Ids of the children of a node, in order.
+        """
+        ends = self.index.ends
+        child_id = node_id + 1
+        while child_id < ends[node_id]:
+            yield child_id
+            child_id = ends[child_id]
+
+    def src(self, node_id):
+        _, src_kind = self.classes[self.kinds[node_id]]
+        if src_kind != TEXT_SRC:
+            return None
+        return str(self.srcs[self.src_ends[node_id - 1] if node_id > 0 else 0:self.src_ends[node_id]], 'utf-8', 'surrogatepass')
+
+    @property
+    def nbytes(self):
+        """
+        Approximate memory use of the tree and its index.
+        """
+        index = self.index
+        arrays = (self.kinds, self.src_ends, index.rule_ids, index.parents, index.prev_siblings, index.next_siblings,
+                  index.levels, index.depths, index.ends, index.text_hashes, index.text_lengths)
+        return sum(len(a) * a.itemsize for a in arrays) + len(self.srcs)
+
+    def to_tree(self, fn=None):
+        """
+        Build the Rule nodes of the tree. Every call returns a new copy.
+        """
+        index = self.index
+        classes, src_ends, srcs = self.classes, self.src_ends, self.srcs
+        rule_names = RULES.names
+        new = object.__new__
+        nodes = []
+        src_start = 0
+        for rule_id, kind, parent_id, src_end in zip(index.rule_ids, self.kinds, index.parents, src_ends):
+            node_class, src_kind = classes[kind]
+            node = new(node_class)
+            parent = nodes[parent_id] if parent_id >= 0 else None
+            attrs = node.__dict__
+            attrs['name'] = rule_names[rule_id]
+            attrs['parent'] = parent
+            attrs['children'] = []
+            if src_kind == TEXT_SRC:
+                attrs['src'] = str(srcs[src_start:src_end], 'utf-8', 'surrogatepass')
+                src_start = src_end
+            elif src_kind == NONE_SRC:
+                attrs['src'] = None
+            if parent is not None:
+                parent.children.append(node)
+            nodes.append(node)
+        return SynthFuzzTree(nodes[0], index=index, nodes=nodes, fn=fn)
+
+
+@dataclass(frozen=True, slots=True)
+class NodeRef:
+    """
+    Compact reference to a node: the population file of its tree (``None`` if
+    the tree is not part of the population) and the positions of the nodes
+    along the path from the root, used to record the provenance of mutants
+    without copying the nodes themselves.
+    """
+    tree: str | None
+    path: tuple[int, ...]
+
+    @classmethod
+    def of(cls, node, tree=None):
+        path = []
+        while node.parent:
+            path.append(node.parent.children.index(node))
+            node = node.parent
+        return cls(tree=tree, path=tuple(reversed(path)))
+
+    def resolve(self):
+        """
+        Load the referenced tree and return the referenced node.
+        """
+        node, _ = load_root(self.tree)
+        for idx in self.path:
+            node = node.children[idx]
+        return node
@@ -0,0 +1,74 @@
+import random
+import sys
+
+from importlib import import_module
+from pathlib import Path
+from shutil import copytree
+
+import pytest
+
+from mlirmut.synthfuzz.metadata import METADATA_NAME, insert_patterns, load_metadata
+from mlirmut.synthfuzz.population import SynthFuzzPopulation
+from mlirmut.synthfuzz.processor import ProcessorTool
+from mlirmut.synthfuzz.rules import RULE_IDS_NAME, RULES
+
+RESOURCES = Path(__file__).parent / 'resources'
+GRAMMAR = RESOURCES / 'Let.g4'
+MAX_DEPTH = 10
+
+
+def new_population(directory, **kwargs):
+    return SynthFuzzPopulation(str(directory), k_ancestors=2, l_siblings=2, r_siblings=2, **kwargs)
+
+
+@pytest.fixture(scope='session')
+def grammar_dir(tmp_path_factory):
+    """
+    Directory of the processor outputs of the test grammar. The rule ids of
+    the grammar are loaded into the rule table of the process, like by
+    ``mlirmut.synthfuzz.generate``.
+    """
+    work_dir = tmp_path_factory.mktemp('grammar')
+    ProcessorTool('py', str(work_dir)).process([str(GRAMMAR)], default_rule='program')
+    RULES.load(work_dir / RULE_IDS_NAME)
+    sys.path.insert(0, str(work_dir))
+    yield work_dir
+    sys.path.remove(str(work_dir))
+
+
+@pytest.fixture(scope='session')
+def generator_class(grammar_dir):
+    return import_module('LetGenerator').LetGenerator
+
+
+@pytest.fixture(scope='session')
+def let_insert_patterns(grammar_dir):
+    return insert_patterns(load_metadata(grammar_dir / METADATA_NAME))
+
+
+@pytest.fixture(scope='session')
+def seed_population(tmp_path_factory, generator_class):
+    """
+    Directory of a population of trees generated from the test grammar.
+    """
+    directory = tmp_path_factory.mktemp('seeds')
+    population = new_population(directory)
+    rand_state = random.getstate()
+    random.seed(0)
+    for i in range(12):
+        population.add_individual(generator_class(max_depth=MAX_DEPTH).program(), path=f'seed{i}.let')
+    random.setstate(rand_state)
+    return directory
+
+
+@pytest.fixture
+def population_dir(tmp_path, seed_population):
+    """
+    Private copy of the seed population, which a test may grow.
+    """
+    return Path(copytree(seed_population, tmp_path / 'population'))
+
+
+@pytest.fixture
+def make_population():
+    return new_population
@@ -0,0 +1,12 @@
+grammar Let;
+
+program : stmt+ EOF ;
+stmt : 'let' ID '=' expr ';' | 'print' '(' args? ')' ';' | 'if' expr block ;
+block : '{' stmt* '}' ;
+args : expr (',' expr)* ;
+expr : ID | NUM | expr op expr | '(' expr ')' ;
+op : '+' | '*' ;
+
+ID : 'a' | 'b' | 'c' ;
+NUM : [0-9] ;
+WS : [ \t\r\n]+ -> skip ;
@@ -0,0 +1,98 @@
+import multiprocessing
+import random
+
+import pytest
+
+from click.testing import CliRunner
+
+from mlirmut.scripts import batch_mlir, filter_inputs
+from mlirmut.synthfuzz.corpus import COMPRESSIONS, CorpusReader, CorpusWriter, is_corpus
+from mlirmut.synthfuzz.generator import SynthFuzzGeneratorTool
+from mlirmut.synthfuzz.packed import INDEX_ENTRY, PackedReader, PackedWriter, packed_exists
+
+from conftest import MAX_DEPTH
+
+TESTS = {i: f'test {i}\n' * i for i in range(20)}
+
+
+def append_records(writer, keys):
+    for key in keys:
+        writer.append(key, TESTS[key].encode())
+    writer.close()
+
+
+def test_packed_round_trip(tmp_path):
+    assert not packed_exists(tmp_path, 'records')
+    writer = PackedWriter(tmp_path, 'records')
+    # the writer is sent to another process, which writes a shard of its own
+    process = multiprocessing.get_context('spawn').Process(target=append_records, args=(writer, range(10, 20)))
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    append_records(writer, range(10))
+    assert len(list(tmp_path.glob('records.*.pidx'))) == 2
+    assert packed_exists(tmp_path, 'records')
+
+    with PackedReader(tmp_path, 'records') as reader:
+        assert len(reader) == 20 and reader.keys() == list(range(20))
+        assert {key: record.decode() for key, record in reader.items()} == TESTS
+        assert reader[0] == b'' and 20 not in reader
+
+    # the last record of a key wins, and a partially written entry is ignored
+    with PackedWriter(tmp_path, 'records') as writer:
+        writer.append(3, b'rewritten')
+    for fn in tmp_path.glob('records.*.pidx'):
+        with open(fn, 'ab') as f:
+            f.write(b'\0' * (INDEX_ENTRY.size - 1))
+    with PackedReader(tmp_path, 'records') as reader:
+        assert len(reader) == 20 and reader[3] == b'rewritten' and reader[4] == TESTS[4].encode()
+
+
+@pytest.mark.parametrize('compression', [None, *COMPRESSIONS])
+def test_corpus(tmp_path, population_dir, make_population, generator_class, compression):
+    corpus_dir = tmp_path / 'corpus'
+    population = make_population(population_dir)
+    random.seed(2)
+    with SynthFuzzGeneratorTool(generator_class, str(tmp_path / 'test_%d'), max_depth=MAX_DEPTH, population=population,
+                                corpus=CorpusWriter(corpus_dir, compression=compression), cleanup=False) as generator:
+        for index in range(30):
+            generator.create(index)
+    random.seed(2)
+    with SynthFuzzGeneratorTool(generator_class, str(tmp_path / 'test_%d'), max_depth=MAX_DEPTH, population=make_population(population_dir),
+                                cleanup=False) as generator:
+        for index in range(30):
+            generator.create(index)
+
+    # the tests are appended to the corpus instead of being saved to files
+    assert is_corpus(corpus_dir) and not is_corpus(population_dir)
+    with CorpusReader(corpus_dir) as corpus:
+        assert corpus.indices() == list(range(30))
+        for index, test in corpus.items():
+            assert test == (tmp_path / f'test_{index}').read_text()
+        assert corpus.label(5) == f'{corpus_dir}#5'
+
+
+@pytest.fixture
+def corpus_dir(tmp_path):
+    corpus_dir = tmp_path / 'corpus'
+    with CorpusWriter(corpus_dir, compression='zlib') as corpus:
+        for index, test in TESTS.items():
+            corpus.append(index, test)
+    return corpus_dir
+
+
+def test_batch_mlir(tmp_path, corpus_dir):
+    result = CliRunner().invoke(batch_mlir.main, [str(corpus_dir), str(tmp_path / 'batches'), '--batch-size', '8'])
+    assert result.exit_code == 0, result.output
+    batches = [(tmp_path / 'batches' / f'batch_{i}.mlir').read_text() for i in range(3)]
+    assert not (tmp_path / 'batches' / 'batch_3.mlir').exists()
+    assert '\n// -----\n'.join(batches) == '\n// -----\n'.join(TESTS.values())
+
+
+def test_filter_inputs(tmp_path, corpus_dir):
+    output_dir = tmp_path / 'filtered'
+    filter_inputs.filter_corpus(corpus_dir, output_dir, "grep -q 'test 1' %inputpath", max_workers=4)
+    with CorpusReader(corpus_dir) as corpus, CorpusReader(output_dir) as filtered:
+        assert filtered.indices() == [index for index, test in TESTS.items() if 'test 1' in test]
+        # the records are copied as they are
+        assert all(filtered.record(index) == corpus.record(index) for index in filtered.indices())
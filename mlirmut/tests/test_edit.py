@@ -0,0 +1,184 @@
+import random
+
+import pytest
+
+from mlirmut.synthfuzz.fragments import FragmentBank
+from mlirmut.synthfuzz.generator import FitnessViolation, SynthFuzzGeneratorTool
+from mlirmut.synthfuzz.tree import SynthFuzzTree
+
+from conftest import MAX_DEPTH
+
+MUTATION_CONFIG = '''
+[fitness_criteria]
+should_substitute = ["expr.ID"]
+no_duplicate = ["block.stmt"]
+
+[parameterization]
+blacklist = ["op", "args.expr"]
+'''
+
+# The configuration above, by child rule name: "*" for any parent, or the accepted parents.
+BLACKLIST = {'op': '*', 'expr': ['args']}
+SHOULD_SUB = {'ID': ['expr']}
+NO_DUPES = {'stmt': ['block']}
+
+
+def matches(config, node):
+    return node.name in config and (config[node.name] == '*' or node.parent.name in config[node.name])
+
+
+def reference_edit(recipient_node, donor_node, edit_rand):
+    """
+    The edit algorithm before the fragment bank and the tree indexes (the
+    seed implementation), walking the node objects.
+
+    :return: The mutant, the number of substitutions and the fitness violation.
+    """
+    if not donor_node.children:
+        node = recipient_node.replace(donor_node)
+        while node.parent:
+            node = node.parent
+        return node, 0, FitnessViolation.NONE
+
+    def index_nodes(current, nodes_by_name, exclude_subtree):
+        if current == exclude_subtree or matches(BLACKLIST, current):
+            return
+        nodes_by_name.setdefault(current.name, []).append(current)
+        for child in current.children or []:
+            index_nodes(child, nodes_by_name, exclude_subtree)
+
+    donor_root = donor_node
+    while donor_root.parent:
+        donor_root = donor_root.parent
+    fragment_nodes, context_nodes = {}, {}
+    for child in donor_node.children:
+        index_nodes(child, fragment_nodes, None)
+    index_nodes(donor_root, context_nodes, donor_node)
+
+    parameters = {}
+    for name in set(fragment_nodes) & set(context_nodes):
+        for text in {str(node) for node in fragment_nodes[name]}:
+            for param_node in context_nodes[name]:
+                if str(param_node) == text:
+                    parameters[param_node] = [node for node in fragment_nodes[name] if str(node) == text]
+
+    ancestors_concrete, ancestors_abstract = [recipient_node], [donor_node]
+    concrete, abstract = recipient_node, donor_node
+    while concrete.parent and abstract.parent and concrete.parent.name == abstract.parent.name:
+        concrete, abstract = concrete.parent, abstract.parent
+        ancestors_concrete.append(concrete)
+        ancestors_abstract.append(abstract)
+
+    def siblings(idx, ancestors):
+        children = ancestors[idx].children
+        child_idx = children.index(ancestors[idx - 1])
+        return children[:child_idx], children[child_idx + 1:]
+
+    parameter_values = {}
+
+    def match_nodes(abstract_nodes, concrete_nodes):
+        matching = []
+        c_idx = 0
+        for a_node in abstract_nodes:
+            old_idx = c_idx
+            while c_idx < len(concrete_nodes):
+                c_node = concrete_nodes[c_idx]
+                c_idx += 1
+                if a_node.name == c_node.name:
+                    if a_node in parameters:
+                        parameter_values.setdefault(a_node, []).append(c_node)
+                    else:
+                        matching.append((c_node, a_node))
+                    break
+            if c_idx >= len(concrete_nodes):
+                c_idx = old_idx
+        return matching
+
+    def recursively_match_nodes(abstract_nodes, concrete_nodes):
+        for c_node, a_node in match_nodes(abstract_nodes, concrete_nodes):
+            if a_node.children is not None and c_node.children is not None:
+                recursively_match_nodes(a_node.children, c_node.children)
+
+    for idx in range(1, len(ancestors_concrete)):
+        concrete_left, concrete_right = siblings(idx, ancestors_concrete)
+        abstract_left, abstract_right = siblings(idx, ancestors_abstract)
+        recursively_match_nodes(abstract_left, concrete_left)
+        recursively_match_nodes(abstract_right, concrete_right)
+
+    to_check = {node for nodes in parameters.values() for node in nodes if matches(SHOULD_SUB, node)}
+    substitutions = 0
+    for a_node, values in parameter_values.items():
+        value = edit_rand.choice(values)
+        substitutions += 1
+        for param_node in parameters[a_node]:
+            param_node.replace(value)
+            to_check.discard(param_node)
+    violation = FitnessViolation.NONE if not to_check else FitnessViolation.SUB
+
+    node = recipient_node.replace(donor_node)
+    while node.parent:
+        node = node.parent
+
+    seen = set()
+
+    def has_duplicates(node):
+        if matches(NO_DUPES, node):
+            if str(node) in seen:
+                return True
+            seen.add(str(node))
+        return any(has_duplicates(child) for child in node.children or [])
+
+    if has_duplicates(node):
+        violation |= FitnessViolation.DUPE
+    return node, substitutions, violation
+
+
+@pytest.mark.parametrize('with_donor_tree', [True, False])
+def test_edit_matches_reference(tmp_path, population_dir, make_population, generator_class, with_donor_tree):
+    config = tmp_path / 'mutation_config.toml'
+    config.write_text(MUTATION_CONFIG)
+    generator = SynthFuzzGeneratorTool(generator_class, '', max_depth=MAX_DEPTH, mutation_config_path=config,
+                                       edit_seed=3, cleanup=False)
+    # two populations of the same trees hand out separate copies of the same selections
+    population, reference_population = make_population(population_dir), make_population(population_dir)
+    reference_rand = random.Random(3)
+
+    edits = substituted = unfit = 0
+    for i in range(300):
+        random.seed(i)
+        selection = population.select_to_edit(MAX_DEPTH)
+        random.seed(i)
+        reference_selection = reference_population.select_to_edit(MAX_DEPTH)
+        if selection is None:
+            assert reference_selection is None
+            continue
+        recipient_node, donor_node, donor_tree, donor_id = selection
+        if with_donor_tree:
+            result = generator.edit(recipient_node, donor_node, donor_tree, donor_id)
+        else:
+            result = generator.edit(recipient_node, donor_node)
+        mutant, substitutions, violation = reference_edit(*reference_selection[:2], reference_rand)
+
+        assert str(result.mutant) == str(mutant)
+        assert len(result.substitutions) == substitutions
+        assert result.fitness_violation == violation
+        assert result.is_fit == (violation == FitnessViolation.NONE)
+        edits += 1
+        substituted += substitutions > 0
+        unfit += not result.is_fit
+    # the selections exercise substitutions and both fitness outcomes
+    assert edits > 200 and substituted > 0 and 0 < unfit < edits
+
+
+def test_fragment_bank(population_dir, make_population):
+    trees = [SynthFuzzTree.load(fn) for fn in make_population(population_dir)._files]
+    bank, uncached = FragmentBank({}, {}, max_fragments=4), FragmentBank({}, {})
+    for _ in range(3):
+        for tree in trees:
+            for donor_id in range(0, len(tree.nodes), 3):
+                assert bank.fragment(tree, donor_id) == uncached.fragment(tree, donor_id, cache=False)
+                assert len(bank._fragments) <= 4
+                # only the tables of trees with cached fragments are kept
+                assert {index_id for index_id, _ in bank._fragments} == set(bank._tables)
+                assert sum(count for _, _, count in bank._tables.values()) == len(bank._fragments)
+    assert not uncached._fragments and not uncached._tables
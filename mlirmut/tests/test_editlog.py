@@ -0,0 +1,33 @@
+import random
+
+import pytest
+
+from mlirmut.synthfuzz.editlog import EditLogReader, replay
+from mlirmut.synthfuzz.generator import SynthFuzzGeneratorTool
+
+from conftest import MAX_DEPTH
+
+
+@pytest.mark.parametrize('keep_trees', [False, True])
+@pytest.mark.parametrize('edits_per_mutant', [1, 3])
+def test_replay_round_trip(tmp_path, population_dir, make_population, generator_class, let_insert_patterns, keep_trees, edits_per_mutant):
+    out_dir, edit_log = tmp_path / 'out', tmp_path / 'edit_log'
+    population = make_population(population_dir, insert_patterns=let_insert_patterns)
+    random.seed(1)
+    with SynthFuzzGeneratorTool(generator_class, str(out_dir / '%d.let'), max_depth=MAX_DEPTH, population=population,
+                                keep_trees=keep_trees, insert_patterns=let_insert_patterns, edit_seed=1,
+                                edit_log=str(edit_log), edits_per_mutant=edits_per_mutant, cleanup=False) as generator:
+        for index in range(60):
+            generator.create(index)
+
+    files_before = sorted(population_dir.iterdir())
+    with EditLogReader(str(edit_log)) as log:
+        indices = sorted(log.indices())
+        strategies = {log[index].strategy for index in indices}
+        assert indices == list(range(60))
+        for index in indices:
+            assert str(replay(log[index], str(population_dir))) == (out_dir / f'{index}.let').read_text()
+    # every strategy was logged (and replayed) at least once
+    assert strategies == {'generate', 'mutate', 'recombine', 'edit', 'insert'}
+    # replay does not touch the population
+    assert sorted(population_dir.iterdir()) == files_before
@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+
+from pathlib import Path
+
+import pytest
+
+import mlirmut
+from mlirmut.synthfuzz.generate import create_tests
+from mlirmut.synthfuzz.generator import SynthFuzzGeneratorTool
+
+from conftest import MAX_DEPTH
+
+
+def run_generate(grammar_dir, *args):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(Path(mlirmut.__file__).parents[1]), os.environ.get('PYTHONPATH', '')]))
+    subprocess.run([sys.executable, '-m', 'mlirmut.synthfuzz.generate', 'LetGenerator.LetGenerator', '-r', 'program',
+                    '-d', str(MAX_DEPTH), '--sys-path', str(grammar_dir), *map(str, args)],
+                   env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+@pytest.mark.parametrize('n', [12, 10])
+def test_create_tests(tmp_path, population_dir, make_population, generator_class, n):
+    out_dir = tmp_path / 'out'
+    with SynthFuzzGeneratorTool(generator_class, str(out_dir / '%d.let'), max_depth=MAX_DEPTH, population=make_population(population_dir),
+                                cleanup=False) as generator:
+        results = [create_tests(generator, start_index, seed=1, fanout=4, n=n) for start_index in range(0, n, 4)]
+    # the last selection only creates the tests left
+    assert [len(tests) for tests in results] == [4, 4, n - 8]
+    assert [index for tests in results for _, index in tests] == list(range(n))
+    assert sorted(os.listdir(out_dir)) == sorted(f'{index}.let' for index in range(n))
+
+
+@pytest.mark.parametrize('n', [12, 10])
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_fanout(tmp_path, grammar_dir, population_dir, n, jobs):
+    out_dir = tmp_path / 'out'
+    run_generate(grammar_dir, '-o', out_dir / '%d.let', '-n', n, '--fanout', 4, '-j', jobs, '--population', population_dir,
+                 '--random-seed', 1)
+    assert sorted(os.listdir(out_dir)) == sorted(f'{index}.let' for index in range(n))
+
+    # the tests only depend on the seed and their index, not on the number of jobs
+    reference_dir = tmp_path / 'reference'
+    run_generate(grammar_dir, '-o', reference_dir / '%d.let', '-n', n, '--fanout', 4, '--population', population_dir,
+                 '--random-seed', 1)
+    for index in range(n):
+        assert (out_dir / f'{index}.let').read_text() == (reference_dir / f'{index}.let').read_text()
@@ -0,0 +1,50 @@
+import pickle
+
+from ast import literal_eval
+from math import inf
+
+from mlirmut.synthfuzz.generator import InsertMatchPattern, QuantifierSpec
+from mlirmut.synthfuzz.insertion import InsertAutomaton, InsertWord, Literal, compile_insert_patterns, insert_automaton
+from mlirmut.synthfuzz.rules import RULES
+from mlirmut.synthfuzz.texthash import token_hash
+
+from conftest import RESOURCES
+
+
+def test_encode_decode(grammar_dir, let_insert_patterns):
+    with open(grammar_dir / 'insert_patterns.pkl', 'rb') as f:
+        pickled = pickle.load(f)
+    assert set(pickled) == set(let_insert_patterns) == {'program', 'stmt', 'block', 'args'}
+    for rule, automaton in pickled.items():
+        data = automaton.encode()
+        # the encoding is made of literals, as written into the metadata module
+        assert literal_eval(repr(data)) == data
+        assert InsertAutomaton.decode(data) == automaton
+        assert let_insert_patterns[rule] == automaton
+    assert let_insert_patterns['args'].words == [InsertWord(labels=(Literal(','), 'expr'), slot=1)]
+
+
+def test_old_insert_patterns(grammar_dir, let_insert_patterns):
+    # insert_patterns.pkl as written by the extract_quantifiers notebook of the seed version
+    with open(RESOURCES / 'insert_patterns_old.pkl', 'rb') as f:
+        old_patterns = pickle.load(f)
+    assert old_patterns['block'] == InsertMatchPattern(['{', QuantifierSpec(min=0, max=inf, rule_name='stmt'), '}'], {'stmt'})
+
+    old_automaton = insert_automaton(old_patterns['block'])
+    assert old_automaton.words == [InsertWord(labels=('stmt',), slot=0)]
+    assert insert_automaton(old_automaton) is old_automaton
+
+    old_compiled = compile_insert_patterns(old_patterns)
+    compiled = compile_insert_patterns(let_insert_patterns)
+    stmt, eof = RULES.id('stmt'), RULES.id('EOF')
+    open_brace, close_brace = token_hash('{'), token_hash('}')
+    children = {
+        'block': [[open_brace, close_brace], [open_brace, stmt, stmt, close_brace], [open_brace, stmt], [stmt, close_brace]],
+        'program': [[stmt, eof], [stmt, stmt, stmt, eof], [eof], [stmt]],
+    }
+    for rule, symbols_list in children.items():
+        rule_id = RULES.id(rule)
+        for symbols in symbols_list:
+            assert old_compiled[rule_id].sites(symbols) == compiled[rule_id].sites(symbols)
+    assert compiled[RULES.id('block')].sites([open_brace, stmt, close_brace]) == [(1, 0), (2, 0)]
+    assert compiled[RULES.id('block')].sites([open_brace, stmt]) == []
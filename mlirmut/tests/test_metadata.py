@@ -0,0 +1,65 @@
+import json
+import os
+import pickle
+import subprocess
+import sys
+
+from math import inf
+from pathlib import Path
+
+import pytest
+
+import mlirmut
+from mlirmut.synthfuzz.metadata import METADATA_NAME, load_metadata
+from mlirmut.synthfuzz.rules import RULE_IDS_NAME
+
+# Loads the metadata in a process where grammarinator (and the dependencies
+# of the processor) cannot be imported, as in the analysis scripts.
+LOADER = '''
+import json
+import sys
+
+
+class Blocker:
+    def find_spec(self, name, path=None, target=None):
+        if name.split('.')[0] in ('grammarinator', 'antlr4', 'jinja2'):
+            raise ImportError(f'{name} is blocked')
+
+
+sys.meta_path.insert(0, Blocker())
+from mlirmut.synthfuzz.metadata import insert_patterns, load_metadata
+metadata = load_metadata(sys.argv[1])
+print(json.dumps({'rules': metadata.RULES, 'min_depths': metadata.MIN_DEPTHS,
+                  'insert_patterns': {rule: [list(word.labels[-1:]) for word in automaton.words] for rule, automaton in insert_patterns(metadata).items()},
+                  'modules': sorted(name for name in sys.modules if name.split('.')[0] in ('grammarinator', 'antlr4', 'jinja2'))}))
+'''
+
+
+def test_load_without_grammarinator(grammar_dir, let_insert_patterns):
+    env = dict(os.environ, PYTHONPATH=str(Path(mlirmut.__file__).parents[1]))
+    result = subprocess.run([sys.executable, '-c', LOADER, str(grammar_dir / METADATA_NAME)], env=env, check=True, capture_output=True, text=True)
+    loaded = json.loads(result.stdout)
+    assert not loaded['modules']
+    metadata = load_metadata(grammar_dir / METADATA_NAME)
+    assert loaded['rules'] == list(metadata.RULES) and loaded['min_depths'] == metadata.MIN_DEPTHS
+    assert loaded['insert_patterns'] == {rule: [list(word.labels[-1:]) for word in automaton.words] for rule, automaton in let_insert_patterns.items()}
+
+
+def test_tables(grammar_dir, generator_class):
+    metadata = load_metadata(grammar_dir / METADATA_NAME)
+    assert metadata.GRAMMAR == generator_class.__name__
+    with open(grammar_dir / RULE_IDS_NAME, 'rb') as f:
+        assert list(metadata.RULES) == pickle.load(f)
+    for rule, min_depth in metadata.MIN_DEPTHS.items():
+        assert getattr(generator_class, rule).min_depth == (inf if min_depth is None else min_depth)
+    # the parents are the inverse of the children
+    assert {(rule, child) for rule, children in metadata.CHILDREN.items() for child in children} \
+        == {(parent, rule) for rule, parents in metadata.PARENTS.items() for parent in parents}
+    assert metadata.QUANTIFIERS['block'] == ((0, 0, None),)
+
+
+def test_version(tmp_path, grammar_dir):
+    fn = tmp_path / METADATA_NAME
+    fn.write_text((grammar_dir / METADATA_NAME).read_text().replace('VERSION = 1\n', 'VERSION = 0\n'))
+    with pytest.raises(ValueError):
+        load_metadata(fn)
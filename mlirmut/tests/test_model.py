@@ -0,0 +1,79 @@
+import random
+
+from collections import Counter
+from functools import partial
+
+import pytest
+
+from grammarinator.runtime import CooldownModel, DefaultModel
+from grammarinator.tool import DefaultGeneratorFactory
+
+from mlirmut.synthfuzz.model import AliasModel, alias_table
+
+from conftest import MAX_DEPTH
+
+WEIGHTS = {('stmt', 0, 2): 3.0, ('expr', 0, 2): 0.5}
+
+
+class Node:
+    def __init__(self, name):
+        self.name = name
+
+
+class ReferenceModel(DefaultModel):
+    # draws characters like the alias model, which does not use random.choice
+    charset = AliasModel.charset
+
+
+@pytest.mark.parametrize('weights', [(1, 1, 1, 1), (1, 2, 3, 4), (0, 5, 0, 1), (0.1, 10, 0.01)])
+def test_alias_table(weights):
+    probs, aliases = alias_table(weights)
+    n = len(weights)
+    # a column is drawn with probability 1/n, then itself or its alias
+    drawn = [probs[i] / n for i in range(n)]
+    for j in range(n):
+        if aliases[j] != j:
+            drawn[aliases[j]] += (1 - probs[j]) / n
+    assert drawn == pytest.approx([w / sum(weights) for w in weights])
+
+
+def test_alias_table_zero():
+    with pytest.raises(ValueError):
+        alias_table((0, 0))
+
+
+def test_choice():
+    model = AliasModel(weights={('a', 0, 0): 2.0})
+    random.seed(0)
+    counts = Counter(model.choice(Node('a'), 0, [1, 1, 2]) for _ in range(40000))
+    # multiplied by the initial multipliers
+    assert [counts[i] / 40000 for i in range(3)] == pytest.approx([0.4, 0.2, 0.4], abs=0.01)
+    # the tables are cached by rule, alternation and weights
+    assert list(model._tables[('a', 0)]) == [(1, 1, 2)]
+    assert Counter(model.choice(Node('a'), 1, [0, 3, 0]) for _ in range(100)) == {1: 100}
+
+
+def generate(factory):
+    random.seed(0)
+    return [str(factory(max_depth=MAX_DEPTH).program()) for _ in range(30)]
+
+
+def test_cooldown(generator_class):
+    # the cooldown carries over from one generation to the next, as with the
+    # weights that the CooldownModels of the generations share
+    expected = generate(DefaultGeneratorFactory(generator_class, model_class=ReferenceModel, cooldown=0.5, weights=dict(WEIGHTS)))
+    alias_model = partial(AliasModel, cooldown=0.5, weights=dict(WEIGHTS), tables={}, multipliers={})
+    assert generate(DefaultGeneratorFactory(generator_class, model_class=alias_model)) == expected
+    # unlike with a cooldown private to every generation
+    private_model = partial(AliasModel, cooldown=0.5, weights=dict(WEIGHTS), tables={})
+    assert generate(DefaultGeneratorFactory(generator_class, model_class=private_model)) != expected
+
+    # the multipliers are those of the CooldownModel
+    weights, multipliers = dict(WEIGHTS), {}
+    cooldown_model, model = CooldownModel(DefaultModel(), cooldown=0.5, weights=weights), AliasModel(cooldown=0.5, weights=dict(WEIGHTS), multipliers=multipliers)
+    for _ in range(20):
+        state = random.getstate()
+        choice = cooldown_model.choice(Node('stmt'), 0, [1, 1, 1])
+        random.setstate(state)
+        assert model.choice(Node('stmt'), 0, [1, 1, 1]) == choice
+    assert multipliers[('stmt', 0)] == pytest.approx([weights[('stmt', 0, i)] for i in range(3)])
@@ -0,0 +1,101 @@
+import multiprocessing
+import random
+
+from mlirmut.synthfuzz.population import PopulationLog, TreeCache
+from mlirmut.synthfuzz.tree import CompactTree, SynthFuzzTree
+
+from conftest import MAX_DEPTH
+
+
+def test_tree_cache(population_dir, make_population):
+    fns = make_population(population_dir)._files[:3]
+    sizes = [CompactTree.from_tree(SynthFuzzTree.load(fn)).nbytes for fn in fns]
+    # room for the first two trees only
+    cache = TreeCache(sizes[0] + sizes[1])
+    for fn in fns[:2]:
+        cache.load(fn)
+    assert list(cache._trees) == fns[:2]
+
+    # a hit is a private copy, and makes the tree the most recently used
+    tree = cache.load(fns[0])
+    assert str(tree.root) == str(SynthFuzzTree.load(fns[0]).root)
+    tree.root.children.clear()
+    assert str(cache.load(fns[0]).root) == str(SynthFuzzTree.load(fns[0]).root)
+    assert list(cache._trees) == [fns[1], fns[0]]
+
+    # the least recently used tree is evicted
+    cache.load(fns[2])
+    assert fns[1] not in cache._trees
+    assert cache._size == sum(tree.nbytes for tree in cache._trees.values()) <= cache.max_bytes
+
+    # trees larger than the cache are not cached
+    small = TreeCache(min(sizes) - 1)
+    assert str(small.load(fns[0]).root) == str(SynthFuzzTree.load(fns[0]).root)
+    assert not small._trees
+
+
+def test_cached_selections(population_dir, make_population):
+    population, cached = make_population(population_dir), make_population(population_dir, tree_cache_size=1024 * 1024)
+    for i in range(100):
+        random.seed(i)
+        selection = population.select_to_recombine(MAX_DEPTH)
+        random.seed(i)
+        assert [str(node) for node in cached.select_to_recombine(MAX_DEPTH)] == [str(node) for node in selection]
+    assert cached._tree_cache._trees
+
+
+def test_select_pair(population_dir, make_population):
+    population = make_population(population_dir)
+    for i in range(100):
+        random.seed(i)
+        recipient_node, donor_node = population.select_to_recombine(MAX_DEPTH)
+        assert recipient_node.name == donor_node.name
+        assert population.tree_fn(recipient_node) != population.tree_fn(donor_node)
+
+
+def test_empty_population(tmp_path, make_population, let_insert_patterns):
+    population = make_population(tmp_path, insert_patterns=let_insert_patterns)
+    assert population.select_to_recombine(MAX_DEPTH) is None
+    assert population.select_to_edit(MAX_DEPTH) is None
+    assert population.select_to_insert(MAX_DEPTH) is None
+
+
+def add_trees(population, generator_class, seed, n):
+    random.seed(seed)
+    for i in range(n):
+        population.add_individual(generator_class(max_depth=MAX_DEPTH).program(), path=f'added{seed}_{i}.let')
+
+
+def test_population_log(population_dir, make_population, generator_class):
+    population, other = make_population(population_dir), make_population(population_dir)
+    files = list(population._files)
+    # trees kept by two other processes, e.g., parallel generation workers
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=add_trees, args=(other, generator_class, seed, 5)) for seed in (1, 2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+    assert population._files == files
+
+    population.refresh()
+    added = population._files[len(files):]
+    assert len(added) == 10 and sorted(population._files) == sorted(make_population(population_dir)._files)
+    for fn in added:
+        assert population._rule_index.tree_index(fn).rule_ids == SynthFuzzTree.load(fn).index.rule_ids
+    # own trees are not indexed again
+    add_trees(population, generator_class, 3, 1)
+    population.refresh()
+    assert len(population._files) == len(files) + 11 and len(set(population._files)) == len(population._files)
+
+    # a partially written record is read once complete
+    log = PopulationLog(population_dir)
+    name = b'partial.let'
+    with open(log.path, 'ab') as f:
+        f.write(PopulationLog.RECORD.pack(len(name)) + name[:4])
+    assert sorted(log.read_new()) == sorted(population._files)
+    assert log.read_new() == []
+    with open(log.path, 'ab') as f:
+        f.write(name[4:])
+    assert log.read_new() == [str(population_dir / 'partial.let')]
@@ -0,0 +1,99 @@
+import os
+import random
+
+from importlib.util import module_from_spec, spec_from_file_location
+from shutil import copy
+
+import pytest
+
+from grammarinator.runtime import CooldownModel, DefaultModel, UnlexerRule
+
+from mlirmut.synthfuzz.metadata import METADATA_NAME
+from mlirmut.synthfuzz.processor import ProcessorTool
+from mlirmut.synthfuzz.rules import RULE_IDS_NAME
+
+from conftest import GRAMMAR, MAX_DEPTH
+
+OUTPUTS = ['LetGenerator.py', 'graph.pkl', 'insert_patterns.pkl', RULE_IDS_NAME, METADATA_NAME]
+
+
+def generator_class(work_dir, **kwargs):
+    work_dir.mkdir(exist_ok=True)
+    ProcessorTool('py', str(work_dir), **kwargs).process([str(GRAMMAR)], default_rule='program')
+    # every variant is imported as a module of its own
+    spec = spec_from_file_location(f'LetGenerator_{work_dir.name}', work_dir / 'LetGenerator.py')
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.LetGenerator
+
+
+def generate(generator_class, cooldown):
+    # the cooled-down weights carry over to the following tests
+    weights = {}
+    random.seed(0)
+    return [generator_class(model=CooldownModel(DefaultModel(), cooldown=cooldown, weights=weights) if cooldown < 1 else DefaultModel(),
+                            max_depth=MAX_DEPTH).program() for _ in range(50)]
+
+
+def nodes(node):
+    yield node
+    for child in node.children:
+        yield from nodes(child)
+
+
+@pytest.fixture(scope='module')
+def default_generator_class(tmp_path_factory):
+    return generator_class(tmp_path_factory.mktemp('default'))
+
+
+@pytest.mark.parametrize('cooldown', [1.0, 0.5])
+def test_fast(tmp_path, default_generator_class, cooldown):
+    fast_generator_class = generator_class(tmp_path / 'fast', fast=True)
+    for root, expected in zip(generate(fast_generator_class, cooldown), generate(default_generator_class, cooldown)):
+        assert str(root) == str(expected)
+        assert [(type(node), node.name) for node in nodes(root)] == [(type(node), node.name) for node in nodes(expected)]
+
+
+@pytest.mark.parametrize('fast', [False, True])
+@pytest.mark.parametrize('cooldown', [1.0, 0.5])
+def test_token_level(tmp_path, default_generator_class, fast, cooldown):
+    token_level_generator_class = generator_class(tmp_path / 'token_level', fast=fast, token_level=True)
+    for root, expected in zip(generate(token_level_generator_class, cooldown), generate(default_generator_class, cooldown)):
+        assert str(root) == str(expected)
+        # every token is a single leaf holding its text
+        tokens = [node for node in nodes(root) if isinstance(node, UnlexerRule)]
+        assert all(not token.children and token.src for token in tokens)
+        assert [(token.name, token.src) for token in tokens] == [(token.name, str(token)) for token in nodes(expected)
+                                                                if isinstance(token, UnlexerRule) and not isinstance(token.parent, UnlexerRule)]
+
+
+def process(grammar, work_dir, cache_dir, **kwargs):
+    work_dir.mkdir()
+    ProcessorTool('py', str(work_dir), cache_dir=str(cache_dir), **kwargs).process([str(grammar)], default_rule='program')
+    return {fn: (work_dir / fn).read_bytes() for fn in os.listdir(work_dir)}
+
+
+@pytest.mark.parametrize('link', [False, True])
+def test_cache(tmp_path, monkeypatch, link):
+    grammar, cache_dir = tmp_path / GRAMMAR.name, tmp_path / 'cache'
+    copy(GRAMMAR, grammar)
+
+    # miss: the grammar is processed and the outputs are stored
+    outputs = process(grammar, tmp_path / 'miss', cache_dir)
+    assert sorted(outputs) == sorted(OUTPUTS)
+    assert len(os.listdir(cache_dir)) == 1
+
+    # hit: the outputs are restored without processing
+    processed = []
+    process_grammars = ProcessorTool._process
+    monkeypatch.setattr(ProcessorTool, '_process', lambda self, *args: processed.append(args) or process_grammars(self, *args))
+    assert process(grammar, tmp_path / 'hit', cache_dir, link=link) == outputs
+    assert not processed
+    assert all(os.path.islink(tmp_path / 'hit' / fn) == link for fn in OUTPUTS)
+
+    # miss: other processor options or a changed grammar are processed again
+    process(grammar, tmp_path / 'token_level', cache_dir, token_level=True)
+    grammar.write_text(grammar.read_text().replace("op : '+' | '*' ;", "op : '+' | '*' | '-' ;"))
+    process(grammar, tmp_path / 'changed', cache_dir)
+    assert len(processed) == 2
+    assert len(os.listdir(cache_dir)) == 3
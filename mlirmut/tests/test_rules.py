@@ -0,0 +1,23 @@
+import pickle
+
+import pytest
+
+from mlirmut.synthfuzz.rules import RULES, RuleTable, shared_rule_table
+
+
+def test_rule_table():
+    table = RuleTable(['program', 'stmt'])
+    assert table.names == [None, 'program', 'stmt']
+    assert table.id('stmt') == 2 and table.id('expr') == 3 and len(table) == 4
+    assert table.mask(['program', 'expr']) == 0b1010
+    copy = pickle.loads(pickle.dumps(table))
+    assert copy is not table and copy.names == table.names
+
+
+def test_shared_rule_table(grammar_dir):
+    # the table of the process is merged into the table of the receiving process
+    assert pickle.loads(pickle.dumps(RULES)) is RULES
+    assert shared_rule_table(tuple(RULES.names[:3])) is RULES
+    # which fails if the ids of the processes disagree
+    with pytest.raises(ValueError):
+        shared_rule_table((None, RULES.names[2], RULES.names[1]))
@@ -0,0 +1,92 @@
+import os
+import pickle
+import random
+import subprocess
+import sys
+
+from pathlib import Path
+
+import pytest
+
+import mlirmut
+from mlirmut.synthfuzz.snapshot import PopulationSnapshot, write_snapshot
+from mlirmut.synthfuzz.tree import CompactTree, SynthFuzzTree
+
+from conftest import MAX_DEPTH
+
+INDEX_FIELDS = ('rule_ids', 'parents', 'prev_siblings', 'next_siblings', 'levels', 'depths', 'ends', 'text_hashes', 'text_lengths')
+
+# Writes the snapshot in a process whose rule table interns other names
+# before those of the grammar, so the rule ids of the snapshot differ from
+# those of the test process.
+WRITER = '''
+import sys
+from mlirmut.synthfuzz.rules import RULES
+RULES.update(['unknown_a', 'unknown_b'])
+RULES.load(sys.argv[1])
+from mlirmut.synthfuzz.population import SynthFuzzPopulation
+from mlirmut.synthfuzz.snapshot import write_snapshot
+from mlirmut.synthfuzz.tree import CompactTree, SynthFuzzTree
+population = SynthFuzzPopulation(sys.argv[2], k_ancestors=2, l_siblings=2, r_siblings=2)
+write_snapshot(sys.argv[3], ((fn, CompactTree.from_tree(SynthFuzzTree.load(fn))) for fn in population._files), population.context_filter)
+'''
+
+
+def write_snapshot_in_process(path, population):
+    write_snapshot(path, ((fn, CompactTree.from_tree(SynthFuzzTree.load(fn))) for fn in population._files), population.context_filter)
+
+
+def write_snapshot_in_subprocess(path, population, grammar_dir):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(Path(mlirmut.__file__).parents[1]), os.environ.get('PYTHONPATH', '')]))
+    subprocess.run([sys.executable, '-c', WRITER, str(grammar_dir / 'rule_ids.pkl'), population._directory, str(path)], env=env, check=True)
+
+
+@pytest.mark.parametrize('translate', [False, True])
+def test_attach(tmp_path, grammar_dir, population_dir, make_population, translate):
+    population = make_population(population_dir)
+    path = tmp_path / 'population.snapshot'
+    if translate:
+        write_snapshot_in_subprocess(path, population, grammar_dir)
+    else:
+        write_snapshot_in_process(path, population)
+
+    snapshot = PopulationSnapshot(str(path))
+    assert snapshot._translate == translate
+    assert sorted(snapshot.tree_fns) == sorted(population._files)
+    for fn in population._files:
+        tree_id = snapshot.tree_id(fn)
+        expected = SynthFuzzTree.load(fn)
+        tree = snapshot.tree(tree_id)
+        assert str(tree.root) == str(expected.root)
+        assert [node.name for node in tree.nodes] == [node.name for node in expected.nodes]
+
+        index, expected_index = snapshot.index(tree_id), expected.index
+        for field in INDEX_FIELDS:
+            assert list(getattr(index, field)) == list(getattr(expected_index, field)), field
+        assert {rule_id: list(ids) for rule_id, ids in index.ids_by_rule.items()} == {rule_id: list(ids) for rule_id, ids in expected_index.ids_by_rule.items()}
+        assert index.rule_mask == expected_index.rule_mask
+
+        expected_signatures = [list(signatures) for signatures in population.context_filter.signatures(expected_index)]
+        # the signatures of the snapshot are only used if its rule ids need no translation
+        if translate:
+            assert snapshot.signatures(tree_id) is None
+        else:
+            assert [list(signatures) for signatures in snapshot.signatures(tree_id)] == expected_signatures
+        assert [list(signatures) for signatures in population.context_filter.signatures(index)] == expected_signatures
+
+
+def test_shared_population(population_dir, make_population):
+    population, reference = make_population(population_dir), make_population(population_dir)
+    with population.shared():
+        # the copy maps the snapshot, like a worker process
+        attached = pickle.loads(pickle.dumps(population))
+        assert attached._snapshot is not None and attached._snapshot.path == population._snapshot.path
+        for i in range(100):
+            random.seed(i)
+            selection = attached.select_to_edit(MAX_DEPTH)
+            random.seed(i)
+            expected = reference.select_to_edit(MAX_DEPTH)
+            assert (selection is None) == (expected is None)
+            if selection is not None:
+                assert [str(node) for node in selection[:2]] == [str(node) for node in expected[:2]]
+                assert str(selection[2].root) == str(expected[2].root)
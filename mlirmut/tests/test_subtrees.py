@@ -0,0 +1,65 @@
+import random
+
+from mlirmut.synthfuzz.generator import SynthFuzzGeneratorTool
+from mlirmut.synthfuzz.subtrees import DEPTH_BUCKET, SubtreePool, flatten, unflatten
+
+from conftest import MAX_DEPTH
+
+
+def nodes(node):
+    yield node
+    for child in node.children:
+        yield from nodes(child)
+
+
+def test_flatten(generator_class):
+    random.seed(0)
+    root = generator_class(max_depth=MAX_DEPTH).program()
+    copy = unflatten(flatten(root))
+    assert str(copy) == str(root)
+    for node, copied in zip(nodes(root), nodes(copy), strict=True):
+        assert node is not copied and type(node) is type(copied) and node.name == copied.name
+        assert all(child.parent is copied for child in copied.children)
+    assert copy.parent is None
+
+
+def test_draw(generator_class):
+    generated = []
+
+    def generate(rule, max_depth):
+        generated.append((rule, max_depth))
+        return getattr(generator_class(max_depth=max_depth), rule)()
+
+    random.seed(0)
+    pool = SubtreePool(generate, lambda rule: getattr(generator_class, rule).min_depth, size=3, reuse=2)
+    # the pool is filled by the first draws, with the smallest budget of the bucket
+    subtrees = [pool.draw('stmt', 2 * DEPTH_BUCKET + 1) for _ in range(3)]
+    assert generated == [('stmt', 2 * DEPTH_BUCKET)] * 3 and len(pool) == 3
+    # then the pooled subtrees are drawn as new copies
+    subtree = pool.draw('stmt', 2 * DEPTH_BUCKET + 2)
+    assert len(generated) == 3 and str(subtree) in {str(subtree) for subtree in subtrees}
+    assert all(subtree is not drawn for drawn in subtrees)
+    # until they were drawn reuse times
+    assert len(pool) == 2
+    for _ in range(20):
+        pool.draw('stmt', 2 * DEPTH_BUCKET + 3)
+    assert len(pool) <= 3 and len(generated) > 3
+    assert set(generated) == {('stmt', 2 * DEPTH_BUCKET)}
+
+    # buckets below the minimum depth of the rule use the minimum depth instead
+    pool.fill([('program', 1), ('expr', DEPTH_BUCKET - 1)])
+    assert generated[-6:] == [('expr', getattr(generator_class, 'expr').min_depth)] * 3 + [('program', 1)] * 3
+    assert {key: len(entries) for key, entries in pool._pools.items() if key[0] != 'stmt'} == {('expr', getattr(generator_class, 'expr').min_depth): 3, ('program', 1): 3}
+
+
+def test_pooled_mutations(population_dir, make_population, generator_class):
+    population = make_population(population_dir)
+    random.seed(0)
+    with SynthFuzzGeneratorTool(generator_class, '', max_depth=MAX_DEPTH, population=population, subtree_pool_size=2,
+                                subtree_reuse=4, cleanup=False) as generator:
+        generator.fill_subtree_pool()
+        assert len(generator._subtree_pool) and all(len(pool) == 2 for pool in generator._subtree_pool._pools.values())
+        for _ in range(50):
+            assert str(generator.mutate(population.select_to_mutate(MAX_DEPTH)).mutant)
+    # the minimum depths of the rules are only looked up once
+    assert set(generator._rule_min_depths) == {rule for rule, _ in generator._subtree_pool._pools}
@@ -0,0 +1,11 @@
+from mlirmut.synthfuzz.texthash import token_hash
+from mlirmut.synthfuzz.tree import SynthFuzzTree
+
+
+def test_text_hashes(population_dir, make_population):
+    for fn in make_population(population_dir)._files:
+        tree = SynthFuzzTree.load(fn)
+        index = tree.index
+        for node, text_hash, text_length in zip(tree.nodes, index.text_hashes, index.text_lengths):
+            # the hashes composed bottom-up are those of the texts of the subtrees
+            assert (text_hash, text_length) == token_hash(str(node))